@@ -0,0 +1,85 @@
+"""
+Import time of the bubblekicker modules
+
+Each module is imported in a fresh interpreter, so batch workers, tile
+workers and command line runs pay its import cost on every start. The
+best time of the repetitions is reported together with the heavy optional
+dependencies the import pulls in. The script exits with an error when an
+import loads one of the lazily imported dependencies (pyplot, the
+scikit-image and scipy packages) or takes longer than --max-seconds.
+
+Run from the repository root, e.g.:
+
+    python benchmarks/import_time.py --repeat 5 --max-seconds 2
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MODULES = ['bubblekicker', 'bubblekicker.bubblekicker',
+           'bubblekicker.executor', 'bubblekicker.tiling',
+           'bubblekicker.storage', 'bubblekicker.report']
+# dependencies only imported by the functions using them
+LAZY_MODULES = ['matplotlib.pyplot', 'skimage', 'scipy']
+
+_IMPORT_SCRIPT = """
+import json, sys, timeit
+start = timeit.default_timer()
+import {module}
+seconds = timeit.default_timer() - start
+print(json.dumps({{"seconds": seconds, "loaded": [
+    name for name in {lazy!r} if name in sys.modules]}}))
+"""
+
+
+def import_time(module, repeat=5):
+    """
+    Time the import of a module in fresh interpreters
+
+    :param module: dotted module name
+    :param repeat: number of interpreters, the best time is kept
+    :return: best import time in seconds, list of the lazily imported
+        dependencies loaded by the import
+    """
+    times, loaded = [], set()
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c',
+             _IMPORT_SCRIPT.format(module=module, lazy=LAZY_MODULES)],
+            cwd=ROOT)
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        times.append(result["seconds"])
+        loaded.update(result["loaded"])
+    return min(times), sorted(loaded)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--modules', nargs='+', default=MODULES,
+                        help="modules to import")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="fresh interpreters per module, the best is "
+                             "kept")
+    parser.add_argument('--max-seconds', type=float,
+                        help="fail when an import takes longer")
+    args = parser.parse_args(argv)
+
+    failures = []
+    for module in args.modules:
+        seconds, loaded = import_time(module, args.repeat)
+        print("{:<28} {:8.3f} s  {}".format(module, seconds,
+                                           ", ".join(loaded)))
+        if loaded:
+            failures.append("{} imports {}".format(module, ", ".join(loaded)))
+        if args.max_seconds is not None and seconds > args.max_seconds:
+            failures.append("{} takes {:.3f} s".format(module, seconds))
+    if failures:
+        sys.exit("Import regressions:\n" + "\n".join(failures))
+
+
+if __name__ == "__main__":
+    main()
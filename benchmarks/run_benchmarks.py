@@ -0,0 +1,322 @@
+"""
+Speed, memory and accuracy benchmarks of bubblekicker on synthetic images
+
+For each image size and bubble count a synthetic image with known bubble
+diameters is generated, on which the individual BubbleKicker steps, both
+pipelines, the property calculation and filtering, the batch processing
+of a folder of such images and the tiled processing are timed, with the
+process and thread backends. For each case the best time of the
+repetitions and the peak memory increase are reported (and the speedup
+of the parallel cases against the serial path), and the detected size
+distributions of the pipelines are compared with the ground truth
+(Kolmogorov-Smirnov statistic and relative median error).
+
+Run from the repository root, e.g.:
+
+    python benchmarks/run_benchmarks.py --sizes 600x800 2400x3200
+        --counts 50 500 --output results
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import timeit
+
+import pandas as pd
+import cv2 as cv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from bubblekicker.bubblekicker import (BubbleKicker, BACKENDS,
+                                       batchbubblekicker, ibatchbubblekicker,
+                                       _bubble_properties_table,
+                                       _bubble_properties_filter,
+                                       bubble_properties_calculate)
+from bubblekicker.executor import StepExecutor
+from bubblekicker.pipelines import CannyPipeline, AdaptiveThresholdPipeline
+from bubblekicker.synthetic import (synthetic_bubble_image,
+                                    compare_distributions)
+from bubblekicker.tiling import tiled_apply_steps
+
+CANNY_ARGS = ([120, 180], 3, 3, 1, 1)
+ADAPTIVE_ARGS = (31, 10, 3, 1, 1, 1)
+# (step, parameters, preceding steps) of the timed BubbleKicker steps
+STEP_CASES = [
+    ('edge_detect_canny_opencv', {'threshold': [120, 180]}, []),
+    ('edge_detect_canny_skimage', {'sigma': 3, 'threshold': [0.01, 0.5]},
+     []),
+    ('adaptive_threshold_opencv', {'blocksize': 31, 'cvalue': 10}, []),
+    ('dilate_opencv', {'footprintsize': 3},
+     CannyPipeline.steps(*CANNY_ARGS)[:1]),
+    ('dilate_skimage', {}, CannyPipeline.steps(*CANNY_ARGS)[:1]),
+    ('fill_holes_opencv', {}, CannyPipeline.steps(*CANNY_ARGS)[:2]),
+    ('clear_border_skimage', {'buffer_size': 3, 'bgval': 1},
+     CannyPipeline.steps(*CANNY_ARGS)[:3]),
+    ('erode_opencv', {'footprintsize': 1},
+     CannyPipeline.steps(*CANNY_ARGS)[:4]),
+]
+# serial case of each group against which the speedup is reported
+SPEEDUP_BASELINES = {'batch': "ibatchbubblekicker (1 worker)",
+                     'tiled': "whole image"}
+
+
+def _reset_peak_memory():
+    """reset the peak resident memory of the process (Linux only)
+
+    :return: the current resident memory in kB, or None when unsupported
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return _resident_memory()[0]
+    except (IOError, OSError):
+        return None
+
+
+def _resident_memory():
+    """current and peak resident memory in kB (Linux)"""
+    memory = {}
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(('VmRSS', 'VmHWM')):
+                memory[line.split(':')[0]] = int(line.split()[1])
+    return memory['VmRSS'], memory['VmHWM']
+
+
+def measure(function, setup=None, repeat=3):
+    """
+    Time a function and measure its peak memory increase
+
+    The peak memory is the increase of the peak resident memory of the
+    process. Where it cannot be reset (other than Linux), the increase of
+    the maximum resident memory since the start of the process is used,
+    which misses the peaks below earlier peaks.
+
+    :param function: function without arguments to benchmark
+    :param setup: function preparing each repetition (not timed)
+    :param repeat: number of repetitions, the best time is kept
+    :return: best time in seconds, peak memory increase in MB
+    """
+    times, peaks = [], []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        before = _reset_peak_memory()
+        if before is None:
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peak = lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        else:
+            peak = lambda: _resident_memory()[1]
+        start = timeit.default_timer()
+        function()
+        times.append(timeit.default_timer() - start)
+        peaks.append((peak() - before) / 1024.)
+    return min(times), max(peaks)
+
+
+def _step_benchmarks(image, repeat):
+    """time the individual BubbleKicker steps"""
+    records = []
+    for name, params, previous_steps in STEP_CASES:
+        bubbler = BubbleKicker.from_array(image)
+        bubbler.apply_steps(previous_steps)
+        prepared = bubbler.current_image.copy()
+
+        def setup():
+            bubbler.current_image = prepared.copy()
+
+        seconds, memory = measure(lambda: getattr(bubbler, name)(**params),
+                                  setup, repeat)
+        records.append(("step", name, seconds, memory))
+    return records
+
+
+def _pipeline_benchmarks(image, truth, repeat):
+    """time the pipelines and compare their results with the truth"""
+    records, accuracy = [], []
+    executor = StepExecutor()
+    for pipeline, args in [(CannyPipeline, CANNY_ARGS),
+                           (AdaptiveThresholdPipeline, ADAPTIVE_ARGS)]:
+        bubbler = pipeline.from_array(image)
+        seconds, memory = measure(lambda: bubbler.run(*args),
+                                  bubbler.reset_to_raw, repeat)
+        records.append(("pipeline", pipeline.__name__, seconds, memory))
+        seconds, memory = measure(
+            lambda: bubbler.apply_steps(pipeline.steps(*args),
+                                        executor=executor),
+            bubbler.reset_to_raw, repeat)
+        records.append(("pipeline", pipeline.__name__ + " (executor)",
+                        seconds, memory))
+
+        bubbler.reset_to_raw()
+        _, property_table = bubble_properties_calculate(bubbler.run(*args),
+                                                        engine='opencv')
+        comparison = compare_distributions(property_table, truth)
+        comparison["pipeline"] = pipeline.__name__
+        accuracy.append(comparison)
+    return records, accuracy
+
+
+def _property_benchmarks(image, repeat):
+    """time the property calculation and filtering"""
+    records = []
+    binary = CannyPipeline.from_array(image).run(*CANNY_ARGS)
+    for engine in ['regionprops', 'opencv']:
+        seconds, memory = measure(
+            lambda: _bubble_properties_table(binary, engine=engine),
+            repeat=repeat)
+        records.append(("properties", "_bubble_properties_table "
+                                      "({})".format(engine),
+                        seconds, memory))
+
+    _, marker_image, property_table = _bubble_properties_table(
+        binary, engine='opencv')
+    state = {}
+
+    def setup():
+        state['id_image'] = marker_image.copy()
+
+    seconds, memory = measure(
+        lambda: _bubble_properties_filter(property_table, state['id_image']),
+        setup, repeat)
+    records.append(("properties", "_bubble_properties_filter",
+                    seconds, memory))
+    return records
+
+
+def _batch_benchmarks(image, n_images, workers, repeat):
+    """time the batch processing of a folder of images"""
+    records = []
+    data_path = tempfile.mkdtemp()
+    try:
+        for index in range(n_images):
+            cv.imwrite(os.path.join(data_path,
+                                    "image_{}.png".format(index)), image)
+        seconds, memory = measure(
+            lambda: batchbubblekicker(data_path, 'red', CannyPipeline,
+                                      *CANNY_ARGS), repeat=repeat)
+        records.append(("batch", "batchbubblekicker", seconds, memory))
+        # a single worker processes the images in the current process,
+        # whatever the backend
+        for backend, n_workers in ([(BACKENDS[0], 1)] +
+                                   [(backend, workers)
+                                    for backend in BACKENDS]):
+            seconds, memory = measure(
+                lambda: list(ibatchbubblekicker(data_path, 'red',
+                                                CannyPipeline, CANNY_ARGS,
+                                                workers=n_workers,
+                                                backend=backend)),
+                repeat=repeat)
+            name = ("ibatchbubblekicker (1 worker)" if n_workers == 1 else
+                    "ibatchbubblekicker ({} workers, {})".format(n_workers,
+                                                                 backend))
+            records.append(("batch", name, seconds, memory))
+    finally:
+        shutil.rmtree(data_path)
+    return records
+
+
+def _tiled_benchmarks(image, workers, repeat):
+    """time the tiled pipeline against the whole image processing"""
+    records = []
+    bubbler = CannyPipeline.from_array(image)
+    steps = CannyPipeline.steps(*CANNY_ARGS)
+    tile_size = (max(image.shape[0] // 2, 1), max(image.shape[1] // 2, 1))
+    seconds, memory = measure(lambda: bubbler.apply_steps(steps),
+                              bubbler.reset_to_raw, repeat)
+    records.append(("tiled", "whole image", seconds, memory))
+    for backend in BACKENDS:
+        seconds, memory = measure(
+            lambda: tiled_apply_steps(bubbler, steps, tile_size=tile_size,
+                                      workers=workers, backend=backend),
+            bubbler.reset_to_raw, repeat)
+        name = "tiled_apply_steps ({} workers, {})".format(workers, backend)
+        records.append(("tiled", name, seconds, memory))
+    return records
+
+
+def run_benchmarks(sizes, counts, repeat=3, n_images=4, workers=2,
+                   seed=0):
+    """
+    Run the benchmarks for all image sizes and bubble counts
+
+    :return: timing table, accuracy table
+    """
+    timings, accuracy = [], []
+    for rows, cols in sizes:
+        for count in counts:
+            image, truth = synthetic_bubble_image((rows, cols), count,
+                                                  seed=seed)
+            case = {"size": "{}x{}".format(rows, cols), "bubbles": count}
+            records = _step_benchmarks(image, repeat)
+            pipeline_records, comparisons = _pipeline_benchmarks(image, truth,
+                                                                 repeat)
+            records += pipeline_records
+            records += _property_benchmarks(image, repeat)
+            records += _batch_benchmarks(image, n_images, workers, repeat)
+            records += _tiled_benchmarks(image, workers, repeat)
+            # speedup of the parallel cases against the serial path
+            serial = dict((group, seconds)
+                          for group, name, seconds, _ in records
+                          if SPEEDUP_BASELINES.get(group) == name)
+            for group, name, seconds, memory in records:
+                record = dict(case)
+                record.update({"group": group, "name": name,
+                               "seconds": seconds, "peak_memory_mb": memory})
+                if group in serial:
+                    record["speedup"] = serial[group] / seconds
+                timings.append(record)
+            for comparison in comparisons:
+                comparison.update(case)
+                accuracy.append(comparison)
+    return (pd.DataFrame(timings, columns=["size", "bubbles", "group", "name",
+                                           "seconds", "peak_memory_mb",
+                                           "speedup"]),
+            pd.DataFrame(accuracy, columns=["size", "bubbles", "pipeline",
+                                            "detected", "expected", "ks",
+                                            "median_error"]))
+
+
+def _image_size(text):
+    """parse an image size given as ROWSxCOLS"""
+    try:
+        rows, cols = text.lower().split('x')
+        return int(rows), int(cols)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Use ROWSxCOLS, e.g. 600x800")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', nargs='+', type=_image_size,
+                        default=[(600, 800), (1200, 1600)],
+                        help="image sizes as ROWSxCOLS")
+    parser.add_argument('--counts', nargs='+', type=int, default=[50, 200],
+                        help="numbers of bubbles per image")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="repetitions of each case, the best is kept")
+    parser.add_argument('--images', type=int, default=4,
+                        help="number of images of the batch cases")
+    parser.add_argument('--workers', type=int, default=2,
+                        help="workers of the parallel batch and tiled "
+                             "cases")
+    parser.add_argument('--output', help="CSV file prefix for the tables")
+    args = parser.parse_args(argv)
+
+    timings, accuracy = run_benchmarks(args.sizes, args.counts, args.repeat,
+                                       args.images, args.workers)
+    pd.set_option('display.width', 120)
+    print(timings.to_string(index=False))
+    print("")
+    print(accuracy.to_string(index=False))
+    if args.output:
+        timings.to_csv(args.output + "_timings.csv", index=False)
+        accuracy.to_csv(args.output + "_accuracy.csv", index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,4 +3,10 @@ from bubblekicker import BubbleKicker
 from pipelines import CannyPipeline, AdaptiveThresholdPipeline
 from utils import (calculate_convexity, 
                    calculate_circularity_reciprocal)
-
+from cache import StepCache, ResultCache
+from distributions import PropertyAccumulator
+from storage import ResultStore
+from sparse import SparseLabels
+from index import BubbleIndex
+from report import DistributionRenderer, write_report
+from preview import PreviewKicker
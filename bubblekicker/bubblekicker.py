@@ -4,25 +4,54 @@ S. Van Hoey
 """
 
 import os
+import json
+import inspect
+import itertools
+import threading
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FuncFormatter
-
-from skimage.feature import canny
-from skimage.segmentation import clear_border
-from skimage.morphology import dilation, rectangle
-from skimage.measure import regionprops
 
 import cv2 as cv
 
+# matplotlib and scikit-image are imported by the functions using them, so
+# processes that only run the opencv steps (e.g. batch workers) start fast
+
 from utils import (calculate_convexity, 
-		   calculate_circularity_reciprocal)
+		   calculate_circularity_reciprocal, wall_time, cpu_time)
+from distributions import PropertyAccumulator
+from executor import StepExecutor, square_kernel, clear_border_labels
+from sparse import SparseLabels
 
 CHANNEL_CODE = {'blue': 0, 'green': 1, 'red': 2}
 DEFAULT_FILTERS = {'circularity_reciprocal': {'min': 0.2, 'max': 1.6},
                    'convexity': {'min': 0.92}}
+PROPERTY_ENGINES = ['regionprops', 'opencv']
+READ_MODES = ['color', 'channel', 'grayscale', 'mmap']
+BACKENDS = ['process', 'thread']
+# identifiers of the image arrays loaded with BubbleKicker.from_array
+_ARRAY_SOURCES = itertools.count()
+# functions called with each step record, e.g. to feed a profiler
+STEP_HOOKS = []
+STEP_RECORD_FIELDS = ["step", "message", "params", "wall_time", "cpu_time",
+                      "shape", "dtype", "nbytes", "allocated", "cached"]
+
+# weights of the border pixel configurations used by the skimage perimeter
+PERIMETER_WEIGHTS = np.zeros(50, dtype=np.double)
+PERIMETER_WEIGHTS[[5, 7, 15, 17, 25, 27]] = 1
+PERIMETER_WEIGHTS[[21, 33]] = np.sqrt(2)
+PERIMETER_WEIGHTS[[13, 23]] = (1 + np.sqrt(2)) / 2
+PERIMETER_KERNEL = np.array([[10, 2, 10],
+                             [2, 1, 2],
+                             [10, 2, 10]], dtype=np.float32)
+# pixel edge midpoints (row, col) used to build the convex hull of pixels
+DIAMOND_OFFSETS = np.array([[-0.5, 0.], [0.5, 0.], [0., -0.5], [0., 0.5]])
 
 
 class NotAllowedChannel(Exception):
@@ -34,15 +63,48 @@ class NotAllowedChannel(Exception):
 
 class Logger(object):
     """
-    Log the sequence of log statements performed
+    Log the sequence of log statements performed, together with a
+    structured record (timing, output image, parameters) of each step
     """
     def __init__(self):
         self.log = []
+        self.records = []
 
     def add_log(self, message):
         """add a log statement to the sequence"""
         self.log.append(message)
 
+    def add_record(self, step, params, image, wall_time, cpu_time,
+                   allocated=0, cached=False):
+        """add the record of the step with the last log statement and pass
+        it to the functions in STEP_HOOKS
+
+        :param step: method name of the step
+        :param params: dictionary with the parameters of the step
+        :param image: output image of the step
+        :param wall_time: elapsed time of the step in seconds
+        :param cpu_time: processor time of the step in seconds
+        :param allocated: bytes of newly allocated output image
+        :param cached: True when the image came from the step cache
+        """
+        record = {"step": step, "message": self.log[-1],
+                  "params": params, "wall_time": wall_time,
+                  "cpu_time": cpu_time, "shape": image.shape,
+                  "dtype": str(image.dtype), "nbytes": image.nbytes,
+                  "allocated": allocated, "cached": cached}
+        self.records.append(record)
+        for hook in STEP_HOOKS:
+            hook(record)
+        return record
+
+    def to_dataframe(self):
+        """step records as a DataFrame"""
+        return pd.DataFrame(self.records, columns=STEP_RECORD_FIELDS)
+
+    def to_json(self):
+        """step records as a JSON string"""
+        return json.dumps(self.records, default=repr)
+
     def get_last_log(self):
         return self.log[-1]
 
@@ -54,6 +116,25 @@ class Logger(object):
     def clear_log(self):
         """clear all the logs"""
         self.log = []
+        self.records = []
+
+
+def step_profile(records):
+    """
+    Aggregate step records, e.g. of all images of a batch run, per step
+
+    :param records: list of step records (see Logger.add_record)
+    :return: DataFrame with per step the number of runs, the total, mean
+        and maximum wall time, the total processor time and the total
+        allocated bytes, slowest steps first
+    """
+    table = pd.DataFrame(list(records), columns=STEP_RECORD_FIELDS)
+    profile = table.groupby("step").agg(
+        OrderedDict([("wall_time", ["count", "sum", "mean", "max"]),
+                     ("cpu_time", ["sum"]), ("allocated", ["sum"])]))
+    profile.columns = ["count", "wall_time", "wall_time_mean",
+                       "wall_time_max", "cpu_time", "allocated"]
+    return profile.sort_values("wall_time", ascending=False)
 
 
 def batchbubblekicker(data_path, channel, pipeline, *args):
@@ -77,9 +158,298 @@ def batchbubblekicker(data_path, channel, pipeline, *args):
     return results
 
 
+def _is_tiff(filename):
+    """check if the file is a TIFF file based on the extension"""
+    return os.path.splitext(filename)[1].lower() in ('.tif', '.tiff')
+
+
+def _memory_map_image(filename):
+    """memory-map an uncompressed image file read-only"""
+    if filename.endswith('.npy'):
+        return np.load(filename, mmap_mode='r')
+    if _is_tiff(filename):
+        try:
+            import tifffile
+        except ImportError:
+            raise ImportError("Memory mapping TIFF files requires "
+                              "the tifffile package")
+        return tifffile.memmap(filename, mode='r')
+    raise IOError("Memory mapping is only supported for .npy and "
+                  "uncompressed TIFF files")
+
+
+class BatchFailure(object):
+    """
+    Placeholder for an image of a batch run that could not be processed,
+    keeping the error message and traceback of the worker
+    """
+    def __init__(self, filename, error, trace=''):
+        self.filename = filename
+        self.error = error
+        self.traceback = trace
+
+    def __repr__(self):
+        return "BatchFailure({!r}, {!r})".format(self.filename, self.error)
+
+
+def _batch_tasks(data_path, channel, pipeline, args, read_mode,
+                 store=None, cache=None):
+    """generate the individual image tasks of a batch run"""
+    if isinstance(data_path, (list, tuple)):
+        paths = ((imgfile, imgfile) for imgfile in data_path)
+    else:
+        paths = ((imgfile, os.path.join(data_path, imgfile))
+                 for imgfile in os.listdir(data_path))
+    for imgfile, path in paths:
+        yield (imgfile, path, channel, pipeline, args, read_mode, store,
+               cache)
+
+
+# executors reusing their image buffers for all images of a batch worker
+_BATCH_EXECUTORS = threading.local()
+
+
+def _batch_executor():
+    """step executor of the current worker process or thread"""
+    if not hasattr(_BATCH_EXECUTORS, 'executor'):
+        _BATCH_EXECUTORS.executor = StepExecutor()
+    return _BATCH_EXECUTORS.executor
+
+
+@contextmanager
+def worker_pool(workers=None, backend='process'):
+    """
+    Pool of worker processes or threads, terminated on exit
+
+    OpenCV releases the GIL, so the thread backend runs the OpenCV steps
+    in parallel while sharing the images in memory instead of pickling
+    them to worker processes. The number of OpenCV threads is limited to
+    the cores per worker, to not oversubscribe the cores.
+
+    :param workers: number of workers, None uses all cores
+    :param backend: process | thread
+    """
+    if backend not in BACKENDS:
+        raise ValueError("Not a valid backend, use one "
+                         "of {}".format(", ".join(BACKENDS)))
+    workers = workers or cpu_count()
+    opencv_threads = max(1, cpu_count() // workers)
+    previous_threads = None
+    if backend == 'thread':
+        previous_threads = cv.getNumThreads()
+        cv.setNumThreads(opencv_threads)
+        pool = ThreadPool(processes=workers)
+    else:
+        pool = Pool(processes=workers, initializer=cv.setNumThreads,
+                    initargs=(opencv_threads,))
+    try:
+        yield pool
+        pool.close()
+    finally:
+        # also stops the workers when the work is stopped early
+        pool.terminate()
+        pool.join()
+        if previous_threads is not None:
+            cv.setNumThreads(previous_threads)
+
+
+def _batch_process_file(task):
+    """run the pipeline on a single image of a batch run, capturing
+    any error as a BatchFailure so the other images can continue
+
+    :return: image file name, result, step records of the image, whether
+        the result was found in the cache (None without a cache) and the
+        size in bytes of the cache entry written, the caller counts the
+        hits and misses and evicts from the cache, as the cache of a worker
+        process is a copy (see _batch_cache_update)
+    """
+    (imgfile, path, channel, pipeline, args, read_mode, store,
+     cache) = task
+    records = []
+    labels = None
+    cache_hit = None
+    cache_bytes = 0
+    try:
+        metadata = {'filename': path, 'channel': channel,
+                    'read_mode': read_mode, 'pipeline': pipeline.__name__,
+                    'args': list(args)}
+        cached = None
+        if cache is not None:
+            key = cache.key(path, pipeline, channel, args, read_mode)
+            cached = cache.lookup(key)
+            cache_hit = cached is not None
+        if cached is not None:
+            result, property_table = cached
+            metadata['steps'] = cache.read_metadata(key)['steps']
+            if store is not None:
+                _store_cached(store, imgfile, result, property_table,
+                              metadata, cache, key)
+                store = None
+        else:
+            current_bubbler = pipeline(path, channel=channel,
+                                       read_mode=read_mode)
+            if hasattr(pipeline, 'steps'):
+                # only the final image is allocated, the intermediate
+                # steps run in the buffers of the executor
+                result = current_bubbler.apply_steps(
+                    pipeline.steps(*args), executor=_batch_executor()).copy()
+            else:
+                result = current_bubbler.run(*args)
+            labels = current_bubbler.pop_labels()
+            metadata['steps'] = current_bubbler.logs.log
+            records = current_bubbler.logs.records
+            for record in records:
+                record['filename'] = imgfile
+            if cache is not None:
+                _, cache_bytes = cache.write_entry(key, result, metadata,
+                                                   pipeline, labels)
+                labels = None
+        if store is not None:
+            store.write(imgfile, result, metadata, labels)
+    except Exception as err:
+        result = BatchFailure(imgfile,
+                              "{}: {}".format(type(err).__name__, err),
+                              traceback.format_exc())
+    return imgfile, result, records, cache_hit, cache_bytes
+
+
+def _batch_cache_update(cache, cache_hit, cache_bytes):
+    """count the cache lookup of an image of a batch run and account for
+    the size of the cache entry written by the worker"""
+    if cache_hit is None:
+        return
+    cache.count(cache_hit)
+    if not cache_hit:
+        cache.account(cache_bytes)
+
+
+def _store_cached(store, imgfile, binary_image, property_table, metadata,
+                  cache, key):
+    """write a cached result into a store, reusing the cached property
+    table when the store and cache derive the same table"""
+    if (store.rules, store.engine) != (cache.rules, cache.engine):
+        store.write(imgfile, binary_image, metadata)
+        return
+    sparse_labels = None
+    if store.labels and cache.labels:
+        sparse_labels = cache.read_sparse_labels(key)
+    store.write(imgfile, binary_image, metadata,
+                property_table=property_table, sparse_labels=sparse_labels)
+
+
+def ibatchbubblekicker(data_path, channel, pipeline, args=(), workers=None,
+                       chunksize=1, ordered=True, read_mode='channel',
+                       store=None, cache=None, records=None,
+                       backend='process'):
+    """
+    Streaming and parallel version of batchbubblekicker: the images are
+    distributed over a pool of worker processes (or threads) and the result
+    of each image is yielded as soon as it is available, so only the images
+    in flight are kept in memory
+
+    :param data_path: folder containing images to process or a list of
+        image file paths
+    :param channel: green | red | blue
+    :param pipeline: class from pipelines.py to use as processing sequence
+    :param args: sequence of arguments required by the pipeline
+    :param workers: number of workers, None uses all cores and 1
+        processes the images in the current process
+    :param chunksize: number of images sent to a worker at once
+    :param ordered: yield the results in the order of the files (True) or
+        as soon as each image is finished (False)
+    :param read_mode: how the images are loaded by the pipeline, by default
+        only the used channel is kept in memory
+    :param store: ResultStore in which the workers save the property table,
+        binary image and step history of each image, under its file name
+        (a list of images with the same file name raises a ValueError)
+    :param cache: ResultCache with the results of previous runs, images
+        whose contents, pipeline settings and pipeline code did not change
+        are not processed again
+    :param records: list to which the step records of all images are
+        appended, with the image file name added (see step_profile)
+    :param backend: process | thread, the thread backend avoids pickling
+        the images between processes (see worker_pool)
+    :return: generator of (filename, result) tuples, with result the
+        output binary image or a BatchFailure when processing failed
+    """
+    if store is not None and isinstance(data_path, (list, tuple)):
+        store.check_names(data_path)
+    if cache is not None:
+        # size of the cache before the workers add their entries, which are
+        # accounted for as their results come in (see _batch_cache_update)
+        cache.evict()
+    tasks = _batch_tasks(data_path, channel, pipeline, tuple(args),
+                         read_mode, store, cache)
+
+    if workers == 1:
+        for task in tasks:
+            (imgfile, result, step_records, cache_hit,
+             cache_bytes) = _batch_process_file(task)
+            if records is not None:
+                records.extend(step_records)
+            _batch_cache_update(cache, cache_hit, cache_bytes)
+            yield imgfile, result
+        return
+
+    with worker_pool(workers, backend) as pool:
+        mapper = pool.imap if ordered else pool.imap_unordered
+        for (imgfile, result, step_records, cache_hit,
+             cache_bytes) in mapper(_batch_process_file, tasks, chunksize):
+            if records is not None:
+                records.extend(step_records)
+            _batch_cache_update(cache, cache_hit, cache_bytes)
+            yield imgfile, result
+
+
+def _processing_step(step):
+    """decorate a BubbleKicker method as an image processing step, which
+    adds a step record to the logs and reuses the result from the step
+    cache when the same step sequence with the same parameters was run
+    before on the same raw image"""
+    @wraps(step)
+    def recorded_step(self, *args, **kwargs):
+        start_wall, start_cpu = wall_time(), cpu_time()
+        params = inspect.getcallargs(step, self, *args, **kwargs)
+        params.pop('self')
+        previous = self.current_image
+
+        cached = None
+        if self._cache is not None:
+            key = (self._source, self._read_mode, self._channel,
+                   tuple(self.logs.log), step.__name__,
+                   repr(sorted(params.items())))
+            cached = self._cache.get(key)
+        if cached is not None:
+            self.current_image, message = cached
+            self.logs.add_log(message)
+        else:
+            step(self, *args, **kwargs)
+            if self._cache is not None:
+                cached_image = self._cache.put(key, self.current_image,
+                                               self.logs.get_last_log())
+                if (self._labels is not None and
+                        self._labels[0] is self.current_image):
+                    self._labels = cached_image, self._labels[1]
+                self.current_image = cached_image
+
+        image = self.current_image
+        if self._labels is not None and self._labels[0] is not image:
+            self._labels = None
+        allocated = (0 if cached is not None or
+                     np.may_share_memory(image, previous) else image.nbytes)
+        self.logs.add_record(step.__name__, params, image,
+                             wall_time() - start_wall,
+                             cpu_time() - start_cpu, allocated,
+                             cached is not None)
+        return image
+    recorded_step.__wrapped__ = step
+    return recorded_step
+
+
 class BubbleKicker(object):
 
-    def __init__(self, filename, channel='red'):
+    def __init__(self, filename, channel='red', read_mode='color',
+                 cache=None):
         """
         This class contains a set of functions that can be applied to a
         bubble image in order to derive a binary bubble-image and calculate the
@@ -87,36 +457,136 @@ class BubbleKicker(object):
 
         :param filename: image file name
         :param channel: green | red | blue
+        :param read_mode: color | channel | grayscale | mmap, how the image
+            file is loaded (see _read_image)
+        :param cache: StepCache to reuse the intermediate images of
+            previously performed step sequences, e.g. when retrying
+            settings after a reset_to_raw (cached images are read-only)
         """
+        self._read_mode_control(read_mode)
+        self._channel_control(channel)
+        self._initialize(self._read_image(filename, read_mode, channel),
+                         filename, channel, read_mode, cache)
 
-        self.raw_file = self._read_image(filename)
-        self.logs = Logger()
+    @classmethod
+    def from_array(cls, image, channel='red', cache=None):
+        """
+        Create the bubble processing object from an image array instead of
+        an image file, e.g. a video frame or a tile of a larger image
 
-        self._channel_control(channel)
+        :param image: MxNx3 image (opencv BGR order) or MxN image
+        :param channel: green | red | blue, ignored for MxN images
+        :param cache: StepCache to reuse intermediate images
+        """
+        cls._channel_control(channel)
+        bubbler = cls.__new__(cls)
+        bubbler._initialize(image, None, channel, 'array', cache)
+        return bubbler
+
+    def _initialize(self, raw_file, filename, channel, read_mode, cache):
+        """set up the raw and current image of a loaded raw file"""
+        self._filename = filename
+        self._read_mode = read_mode
         self._channel = channel
+        self._cache = cache
+        # arrays have no file name to identify their cached steps
+        self._source = (filename if filename is not None
+                        else ('array', next(_ARRAY_SOURCES)))
+
+        self.raw_file = raw_file
+        self.logs = Logger()
+        # bubble labels kept by the clear border step with its image
+        self._labels = None
 
-        self.raw_image = self.raw_file[:, :, CHANNEL_CODE[self._channel]]
-        self.current_image = self.raw_image.copy()
+        self.raw_image = self._channel_view()
+        # the raw image is only copied when a step changes it in place
+        self.current_image = self.raw_image
 
     @staticmethod
-    def _read_image(filename):
-        """read the image from a file and store
-        an RGB-image MxNx3
+    def _read_image(filename, read_mode='color', channel='red'):
+        """read the image from a file
+
+        The read_mode defines what is kept in memory:
+
+        * color: the RGB-image MxNx3 is stored
+        * channel: only the MxN image of the given channel is stored
+        * grayscale: the MxN grayscale image is stored
+        * mmap: the file is memory-mapped read-only instead of loaded,
+          supported for numpy .npy files and uncompressed TIFF files (the
+          latter requires the tifffile package)
         """
-        image = cv.imread(filename)
+        if read_mode == 'mmap':
+            return _memory_map_image(filename)
+
+        if read_mode == 'grayscale':
+            image = cv.imread(filename, cv.IMREAD_GRAYSCALE)
+        else:
+            image = cv.imread(filename)
+        if image is None:
+            raise IOError("Could not read image file {}".format(filename))
+
+        if read_mode == 'channel':
+            # keep a contiguous copy of the single channel only
+            image = cv.extractChannel(image, CHANNEL_CODE[channel])
         return image
 
+    def _channel_view(self):
+        """get the current channel of the raw file without copying"""
+        if self.raw_file.ndim == 2:
+            return self.raw_file
+        channel_code = CHANNEL_CODE[self._channel]
+        if self._read_mode == 'mmap' and _is_tiff(self._filename):
+            # tifffile keeps the RGB order instead of the opencv BGR order
+            channel_code = 2 - channel_code
+        return self.raw_file[:, :, channel_code]
+
+    def _writable_image(self):
+        """make sure the current image can be changed in place, copying it
+        when it is still shared with the (read-only) raw image"""
+        if (np.may_share_memory(self.current_image, self.raw_image) or
+                not self.current_image.flags.writeable or
+                not self.current_image.flags.c_contiguous):
+            self.current_image = self.current_image.copy()
+        # the image is changed in place, the labels no longer apply
+        self._labels = None
+        return self.current_image
+
+    def pop_labels(self):
+        """
+        Hand over the bubble labels of the current image kept by the clear
+        border step, to pass to bubble_properties_calculate instead of
+        labeling the image again
+
+        The property calculation updates the marker image in place, so the
+        labels are handed over only once.
+
+        :return: (nbubbles, marker image, stats, centroids) or None when no
+            labels are kept for the current image
+        """
+        kept, self._labels = self._labels, None
+        if kept is not None and kept[0] is self.current_image:
+            return kept[1]
+        return None
+
     def reset_to_raw(self):
         """make the current image again the raw image"""
-        self.current_image = self.raw_image.copy()
+        self.current_image = self.raw_image
+        self._labels = None
         self.logs.clear_log()
 
     def switch_channel(self, channel):
         """change the color channel"""
         self._channel_control(channel)
+        if self._read_mode == 'channel':
+            self.raw_file = self._read_image(self._filename,
+                                             self._read_mode, channel)
+        elif self.raw_file.ndim == 2:
+            raise NotAllowedChannel('No color channels available in '
+                                    'the loaded image!')
         self._channel = channel
-        self.raw_image = self.raw_file[:, :, CHANNEL_CODE[self._channel]]
-        self.current_image = self.raw_image.copy()
+        self.raw_image = self._channel_view()
+        self.current_image = self.raw_image
+        self._labels = None
         self.logs.clear_log()
         print("Currently using channel {}".format(self._channel))
 
@@ -131,6 +601,14 @@ class BubbleKicker(object):
             raise NotAllowedChannel('Not a valid channel for '
                                     'RGB color scheme!')
 
+    @staticmethod
+    def _read_mode_control(read_mode):
+        """check if the read mode is supported"""
+        if read_mode not in READ_MODES:
+            raise ValueError("Not a valid read mode, use one "
+                             "of {}".format(", ".join(READ_MODES)))
+
+    @_processing_step
     def edge_detect_canny_opencv(self, threshold=[0.01, 0.5]):
         """perform the edge detection algorithm of Canny on the image using
         the openCV package. Thresholds are respectively min and max threshodls for building 
@@ -145,8 +623,11 @@ class BubbleKicker(object):
                           '- opencv'.format(threshold[0], threshold[1]))
         return image
 
+    @_processing_step
     def edge_detect_canny_skimage(self, sigma=3, threshold=[0.01, 0.5]):
         """perform the edge detection algorithm of Canny on the image using scikit package"""
+        from skimage.feature import canny
+
         image = canny(self.current_image,
                       sigma=sigma,
                       low_threshold=threshold[0],
@@ -162,6 +643,7 @@ class BubbleKicker(object):
                                              sigma))
         return image
 
+    @_processing_step
     def adaptive_threshold_opencv(self, blocksize=91, cvalue=18):
         """
         perform the edge detection algorithm of Canny on the image using an
@@ -186,11 +668,12 @@ class BubbleKicker(object):
                           '- opencv'.format(blocksize, cvalue))
         return image
 
+    @_processing_step
     def dilate_opencv(self, footprintsize=3):
         """perform the dilation of the image"""
 
         # set up structuring element with footprintsize
-        kernel = np.ones((footprintsize, footprintsize), np.uint8)
+        kernel = square_kernel(footprintsize)
 
         # perform algorithm with given environment,
         # store in same memory location
@@ -204,8 +687,10 @@ class BubbleKicker(object):
                           '- opencv'.format(footprintsize))
         return image
 
+    @_processing_step
     def dilate_skimage(self):
         """perform the dilation of the image"""
+        from skimage.morphology import dilation, rectangle
 
         # set up structuring element
         # (@Giacomo, is (1, 90) and (1, 0) different? using rectangle here...
@@ -213,8 +698,9 @@ class BubbleKicker(object):
 
         # perform algorithm with given environment,
         # store in same memory location
-        image = dilation(self.current_image, selem=struct_env,
-                         out=self.current_image)
+        current_image = self._writable_image()
+        image = dilation(current_image, selem=struct_env,
+                         out=current_image)
 
         # update current image
         self.current_image = image
@@ -224,18 +710,20 @@ class BubbleKicker(object):
 
         return image
 
+    @_processing_step
     def fill_holes_opencv(self):
         """fill the holes of the image"""
         # perform algorithm
         h, w = self.current_image.shape[:2]  # stores image sizes
         mask = np.zeros((h + 2, w + 2), np.uint8)
         # floodfill operates on the saved image itself
-        cv.floodFill(self.current_image, mask, (0, 0), 0)
+        cv.floodFill(self._writable_image(), mask, (0, 0), 0)
 
         # append function to logs
         self.logs.add_log('fill holes - opencv')
         return self.current_image
 
+    @_processing_step
     def clear_border_skimage(self, buffer_size=3, bgval=1):
         """clear the borders of the image using a belt of pixels definable in buffer_size and 
 	asign a pixel value of bgval
@@ -249,25 +737,32 @@ class BubbleKicker(object):
 	bgvalue: int
 	all touching objects are set to this value (default is 1)
 	"""
-
-        # perform algorithm
-        image_inv = cv.bitwise_not(self.current_image)
-        image = clear_border(image_inv, buffer_size=buffer_size, bgval=bgval)
+        # perform algorithm, keeping the labels of the bubbles
+        image, labels = clear_border_labels(self.current_image,
+                                            buffer_size=buffer_size,
+                                            bgval=bgval)
 
         # update current image
         self.current_image = image
+        self._labels = (image, labels)
 
         # append function to logs
         self.logs.add_log('clear border with buffer size {} and bgval {} '
                           '-  skimage'.format(buffer_size, bgval))
         return image
 
+    @_processing_step
     def erode_opencv(self, footprintsize=1):
         """erode detected edges with a given footprint. This function is meant to be used after dilation of the edges so to reset the original edge."""
 
-        kernel = np.ones((footprintsize, footprintsize), np.uint8)
+        kernel = square_kernel(footprintsize)
         image = cv.erode(self.current_image, kernel, iterations=1)
 
+        # a 1x1 erosion copies the image unchanged, the labels still apply
+        if (footprintsize == 1 and self._labels is not None and
+                self._labels[0] is self.current_image):
+            self._labels = (image, self._labels[1])
+
         # update current image
         self.current_image = image
 
@@ -276,6 +771,42 @@ class BubbleKicker(object):
                           '- opencv'.format(footprintsize))
         return image
 
+    @classmethod
+    def step_parameters(cls, name, params=None):
+        """complete the parameters of a processing step with its defaults
+
+        :param name: method name of the step, e.g. 'dilate_opencv'
+        :param params: dictionary with the given parameters
+        :return: dictionary with all parameters of the step
+        """
+        step = getattr(cls, name)
+        step = getattr(step, '__wrapped__', step)
+        params = inspect.getcallargs(step, None, **(params or {}))
+        params.pop('self')
+        return params
+
+    def apply_steps(self, steps, executor=None):
+        """apply a sequence of steps on the current image
+
+        :param steps: list of (method name, parameters dict) tuples, e.g.
+            [('dilate_opencv', {'footprintsize': 3}), ...]
+        :param executor: StepExecutor to run the steps in its preallocated
+            buffers instead of allocating an image per step (the step cache
+            is not used). The resulting current image is then an executor
+            buffer, which is overwritten by the next run of the executor.
+        :return: the resulting current image
+        """
+        if executor is not None:
+            self.current_image, _ = executor.run(self.current_image, steps,
+                                                 self.logs)
+            self._labels = (self.current_image,
+                            executor.pop_labels(self.current_image))
+            return self.current_image
+
+        for name, params in steps:
+            getattr(self, name)(**params)
+        return self.current_image
+
     def what_have_i_done(self):
         """ print the current log statements as a sequence of
         performed steps"""
@@ -283,6 +814,8 @@ class BubbleKicker(object):
 
     def plot(self):
         """plot the current image"""
+        import matplotlib.pyplot as plt
+
         fig, ax = plt.subplots()
         ax.imshow(self.current_image, cmap=plt.cm.gray)
         if len(self.logs.log) > 0:
@@ -290,10 +823,118 @@ class BubbleKicker(object):
         return fig, ax
 
 
-def _bubble_properties_table(binary_image):
-    """provide a label for each bubble in the image"""
-
-    nbubbles, marker_image = cv.connectedComponents(1 - binary_image)
+def _label_perimeters(marker_image, nlabels):
+    """calculate the perimeter of all labels in a single pass, using the
+    same 4-connectivity border weighting as the skimage regionprops"""
+    foreground = (marker_image > 0).astype(np.uint8)
+    cross = cv.getStructuringElement(cv.MORPH_CROSS, (3, 3))
+    eroded = cv.erode(foreground, cross, borderType=cv.BORDER_CONSTANT,
+                      borderValue=0)
+    border = foreground - eroded
+    configuration = cv.filter2D(border, -1, PERIMETER_KERNEL,
+                                borderType=cv.BORDER_CONSTANT)
+    # bubbles never touch (8-connectivity), so each border pixel
+    # configuration only depends on the bubble itself
+    on_border = border.astype(bool)
+    return np.bincount(marker_image[on_border],
+                       weights=PERIMETER_WEIGHTS[configuration[on_border]],
+                       minlength=nlabels)
+
+
+def _contour_convex_area(contour, x, y, width, height):
+    """calculate the number of pixels of the convex hull of a bubble
+    contour, counting the pixels in the same way as the skimage
+    convex_hull_image (hull of the pixel edges, pixel centers inside)"""
+    points = contour.reshape(-1, 2)[:, ::-1] - (y, x)
+    hull = cv.convexHull(points.astype(np.float32)).reshape(-1, 2)
+    corners = (hull[:, np.newaxis, :] + DIAMOND_OFFSETS).reshape(-1, 2)
+    vertices = cv.convexHull(corners.astype(np.float32)).reshape(-1, 2)
+    xp = vertices[:, 0].astype(np.double)[:, np.newaxis]
+    yp = vertices[:, 1].astype(np.double)[:, np.newaxis]
+    xq, yq = np.roll(xp, 1, axis=0), np.roll(yp, 1, axis=0)
+
+    # even-odd ray casting of the pixel centers, column by column: an edge
+    # crossing column n flips the rows above its intersection
+    n = np.arange(width, dtype=np.double)
+    crossing = ((yp <= n) & (n < yq)) | ((yq <= n) & (n < yp))
+    edges, columns = np.nonzero(crossing)
+    intersect = ((xq - xp)[edges, 0] * (n[columns] - yp[edges, 0]) /
+                 (yq - yp)[edges, 0] + xp[edges, 0])
+    flipped_rows = np.clip(np.ceil(intersect), 0, height).astype(np.intp)
+    flips = np.zeros((height + 1, width), dtype=np.intp)
+    np.add.at(flips, (np.zeros_like(columns), columns), 1)
+    np.add.at(flips, (flipped_rows, columns), -1)
+    inside = np.cumsum(flips[:height], axis=0) % 2
+    return int(inside.sum())
+
+
+def _opencv_properties(marker_image, stats, centroids):
+    """derive the bubble properties as columnar arrays from the opencv
+    component statistics and a single contour pass"""
+    nlabels = stats.shape[0]
+    area = stats[1:, cv.CC_STAT_AREA].astype(np.int64)
+
+    convex_area = np.zeros(nlabels, dtype=np.int64)
+    contours, hierarchy = cv.findContours(
+        (marker_image > 0).astype(np.uint8), cv.RETR_CCOMP,
+        cv.CHAIN_APPROX_SIMPLE)[-2:]
+    for contour, relation in zip(contours, hierarchy[0]
+                                 if hierarchy is not None else []):
+        if relation[3] != -1:  # boundary of a hole
+            continue
+        label = marker_image[contour[0, 0, 1], contour[0, 0, 0]]
+        x, y, width, height = stats[label, :4]
+        convex_area[label] = _contour_convex_area(contour, x, y,
+                                                  width, height)
+
+    perimeter = _label_perimeters(marker_image, nlabels)[1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        convexity = calculate_convexity(perimeter, area)
+        circularity_reciprocal = \
+            calculate_circularity_reciprocal(perimeter, area)
+    return {"label": np.arange(1, nlabels),
+            "area": area,
+            "centroid": list(zip(centroids[1:, 1], centroids[1:, 0])),
+            "convex_area": convex_area[1:],
+            "equivalent_diameter": np.sqrt(4 * area / np.pi),
+            "perimeter": perimeter,
+            "convexity": convexity,
+            "circularity_reciprocal": circularity_reciprocal}
+
+
+def _bubble_properties_table(binary_image, engine='regionprops',
+                             labels=None):
+    """provide a label for each bubble in the image
+
+    :param binary_image: binary image of the detected bubbles
+    :param engine: regionprops | opencv, the opencv engine derives the
+        same properties as columnar arrays from the connected component
+        statistics instead of a per-bubble regionprops loop
+    :param labels: (nbubbles, marker image, stats, centroids) of the binary
+        image kept by the pipeline (see BubbleKicker.pop_labels), the image
+        is labeled when None
+    """
+    if engine not in PROPERTY_ENGINES:
+        raise ValueError("Not a valid property engine, use one "
+                         "of {}".format(", ".join(PROPERTY_ENGINES)))
+    if labels is None and engine == 'opencv':
+        labels = cv.connectedComponentsWithStats(1 - binary_image)
+
+    if engine == 'opencv':
+        nbubbles, marker_image, stats, centroids = labels
+        columns = _opencv_properties(marker_image, stats, centroids)
+        bubble_properties = pd.DataFrame(
+            columns, columns=["label", "area", "centroid", "convex_area",
+                              "equivalent_diameter", "perimeter",
+                              "convexity", "circularity_reciprocal"])
+        return nbubbles, marker_image, bubble_properties.set_index("label")
+
+    from skimage.measure import regionprops
+
+    if labels is None:
+        nbubbles, marker_image = cv.connectedComponents(1 - binary_image)
+    else:
+        nbubbles, marker_image = labels[:2]
     props = regionprops(marker_image)
     bubble_properties = \
         pd.DataFrame([{"label": bubble.label,
@@ -301,7 +942,9 @@ def _bubble_properties_table(binary_image):
                        "centroid": bubble.centroid,
                        "convex_area": bubble.convex_area,
                        "equivalent_diameter": bubble.equivalent_diameter,
-                       "perimeter": bubble.perimeter} for bubble in props])
+                       "perimeter": bubble.perimeter} for bubble in props],
+                     columns=["area", "centroid", "convex_area",
+                              "equivalent_diameter", "label", "perimeter"])
 
     bubble_properties["convexity"] = \
         calculate_convexity(bubble_properties["perimeter"],
@@ -316,63 +959,157 @@ def _bubble_properties_table(binary_image):
 
 
 def _bubble_properties_filter(property_table, id_image,
-                              rules=DEFAULT_FILTERS):
+                              rules=DEFAULT_FILTERS, relabel=False):
     """exclude bubbles based on a set of rules
 
-    :return:
-    """
-    bubble_props = property_table.copy()
-    all_ids = bubble_props.index.tolist()
+    All rules are combined in a single boolean mask and the rejected
+    bubbles are removed from the label image in one pass with a label
+    lookup table (the label image is updated in place).
 
+    :param property_table: bubble properties indexed by label
+    :param id_image: label image of the bubbles
+    :param rules: dictionary with min and/or max rules for each property
+    :param relabel: if True, number the remaining bubbles as 1..K in both
+        the label image and the index of the returned property table
+    :return: filtered label image and property table
+    """
+    keep = np.ones(len(property_table), dtype=bool)
     for prop_name, ruleset in rules.items():
-        print(ruleset)
+        values = property_table[prop_name].values
         for rule, value in ruleset.items():
             if rule == 'min':
-                bubble_props = \
-                    bubble_props[bubble_props[prop_name] > value]
+                keep &= values > value
             elif rule == 'max':
-                bubble_props = \
-                    bubble_props[bubble_props[prop_name] < value]
+                keep &= values < value
             else:
                 raise Exception("Rule not supported, "
                                 "use min or max as filter")
 
-    removed_ids = [el for el in all_ids if el
-                   not in bubble_props.index.tolist()]
-    for idb in removed_ids:
-        id_image[id_image == idb] = 0
+    bubble_props = property_table[keep].copy()
+
+    # lookup table mapping each label on its new value, 0 if rejected
+    kept_ids = bubble_props.index.values.astype(np.int64)
+    lut = np.zeros(max(int(id_image.max()),
+                       int(kept_ids.max()) if len(kept_ids) else 0) + 1,
+                   dtype=id_image.dtype)
+    if relabel:
+        lut[kept_ids] = np.arange(1, len(kept_ids) + 1)
+        bubble_props.index = pd.Index(np.arange(1, len(kept_ids) + 1),
+                                      name=property_table.index.name)
+    else:
+        lut[kept_ids] = kept_ids
+    np.take(lut, id_image, out=id_image)
 
     return id_image, bubble_props
 
 
 def bubble_properties_calculate(binary_image,
-                                rules=DEFAULT_FILTERS):
+                                rules=DEFAULT_FILTERS, relabel=False,
+                                engine='regionprops', sparse=False,
+                                labels=None):
     """
 
     :param binary_image:
     :param rules:
+    :param relabel: number the remaining bubbles as 1..K after filtering
+    :param engine: regionprops | opencv, property extraction engine
+    :param sparse: return the label image as SparseLabels (bounding box
+        and bit-packed mask of each bubble) instead of a full size image
+    :param labels: labels of the binary image handed over by the pipeline
+        with BubbleKicker.pop_labels, to skip labeling the image again
     :return:
     """
+    if labels is None and engine == 'opencv':
+        labels = cv.connectedComponentsWithStats(1 - binary_image)
     # get the bubble identifications and properties
     nbubbles, id_image, \
-        prop_table = _bubble_properties_table(binary_image)
+        prop_table = _bubble_properties_table(binary_image, engine=engine,
+                                              labels=labels)
     # filter based on the defined rules
     id_image, properties = _bubble_properties_filter(prop_table,
-                                                     id_image, rules)
+                                                     id_image, rules,
+                                                     relabel=relabel)
+    if sparse:
+        # the bounding boxes of the kept bubbles are those of the connected
+        # component statistics, unless the bubbles are numbered again
+        stats = None
+        if labels is not None and len(labels) > 2 and not relabel:
+            stats = labels[2]
+        id_image = SparseLabels.from_label_image(
+            id_image, properties.index.values, stats=stats)
     return id_image, properties
 
 
+def bubble_properties_summary(property_table,
+                              which_property="equivalent_diameter",
+                              percentiles=(10, 50, 90)):
+    """summarize the distribution of a bubble property
+
+    :param property_table: bubble properties as derived by
+        bubble_properties_calculate
+    :param which_property: property to summarize
+    :param percentiles: percentiles of the distribution to include
+    :return: pandas Series with the count, mean, std, min, percentiles
+        (p10, p50,...) and max of the property
+    """
+    values = np.asarray(property_table[which_property], dtype=np.double)
+    names = (["mean", "std", "min"] +
+             ["p{}".format(percentile) for percentile in percentiles] +
+             ["max"])
+    if len(values):
+        stats = ([values.mean(),
+                  values.std(ddof=1) if len(values) > 1 else np.nan,
+                  values.min()] +
+                 list(np.percentile(values, percentiles)) +
+                 [values.max()])
+    else:
+        stats = [np.nan] * len(names)
+    return pd.Series(OrderedDict([("count", len(values))] +
+                                 list(zip(names, stats))))
+
+
 def bubble_properties_plot(property_table,
                            which_property="equivalent_diameter",
                            bins=20):
-    """calculate and create the distribution plot"""
+    """calculate and create the distribution plot
+
+    :param property_table: bubble properties table or PropertyAccumulator,
+        the latter is plotted with its own fixed bins
+    :param which_property: bubble property to plot the distribution of
+    :param bins: number of bins or bin edges of the histogram
+    """
+    import matplotlib.pyplot as plt
+
+    # the histogram is calculated once for both axes
+    if isinstance(property_table, PropertyAccumulator):
+        counts, edges = property_table.histogram(which_property)
+        max_value = property_table.moments[which_property].max
+    else:
+        values = np.asarray(property_table[which_property], dtype=np.double)
+        counts, edges = np.histogram(values, bins)
+        max_value = values.max() if len(values) else -np.inf
+
+    fig, ax1 = plt.subplots()
+    ax1, ax2, _, _ = _distribution_axes(ax1, counts, edges, which_property,
+                                        max_value)
+    return fig, (ax1, ax2)
+
+
+def _distribution_axes(ax1, counts, edges, which_property, max_value):
+    """draw the histogram and cumulative distribution on an axis
+
+    :return: histogram axis, cumulative axis, histogram bars, cumulative
+        line (the latter two can be updated for other counts)
+    """
+    from matplotlib.ticker import FuncFormatter
+
+    cumulative = np.cumsum(counts) / float(max(counts.sum(), 1))
+
     fontsize_labels = 14.
     formatter = FuncFormatter(
         lambda y, pos: "{:d}%".format(int(round(y * 100))))
-    fig, ax1 = plt.subplots()
-    ax1.hist(property_table[which_property], bins,
-             normed=0, cumulative=False, histtype='bar',
-             color='gray', ec='white')
+    bars = ax1.bar(edges[:-1], counts, width=np.diff(edges), align='edge',
+                   color='gray', ec='white')
     ax1.get_xaxis().tick_bottom()
 
     # left axis - histogram
@@ -382,20 +1119,21 @@ def bubble_properties_plot(property_table,
 
     # right axis - cumul distribution
     ax2 = ax1.twinx()
-    ax2.hist(property_table[which_property],
-             bins, normed=1, cumulative=True,
-             histtype='step', color='k', linewidth= 3.)
+    line, = ax2.step(edges, np.r_[0., cumulative], where='pre',
+                     color='k', linewidth=3.)
     ax2.yaxis.set_major_formatter(formatter)
     ax2.set_ylabel(r'Cumulative percentage (%)', color='k',
                    fontsize=fontsize_labels)
     ax2.spines['top'].set_visible(False)
     ax2.set_ylim(0, 1.)
 
-    # additional options
-    ax1.set_xlim(0, property_table[which_property].max())
+    # additional options, without bubbles the range of the bins is shown
+    if not np.isfinite(max_value):
+        max_value = edges[-1]
+    ax1.set_xlim(0, max_value)
     ax1.tick_params(axis='x', which='both', pad=10)
     ax1.set_xlabel(which_property)
 
-    return fig, (ax1, ax2)
+    return ax1, ax2, bars, line
 
 
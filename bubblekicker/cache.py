@@ -0,0 +1,339 @@
+
+import hashlib
+import inspect
+import json
+import os
+from collections import OrderedDict
+
+import bubblekicker
+import executor
+import sparse
+import storage
+import utils
+from storage import ResultStore, STORE_EXTENSION
+
+# fraction of max_bytes to which the result cache is evicted
+EVICTION_TARGET = 0.9
+
+
+class StepCache(object):
+    """
+    Least recently used cache of the intermediate images of BubbleKicker
+    steps, bounded by a memory budget
+    """
+
+    def __init__(self, max_bytes=256 * 2 ** 20):
+        """
+        :param max_bytes: memory budget of the cached images in bytes, the
+            least recently used images are dropped when it is exceeded
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """get the cached (image, message) of a step sequence or None"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        # move to the most recently used end
+        self._entries[key] = entry
+        self.hits += 1
+        return entry
+
+    def put(self, key, image, message):
+        """store the image and log message of a step sequence
+
+        A read-only view of the image is stored, the caller continues with
+        the returned view, so steps working in place copy it instead of
+        changing the cached version. The given image itself is left
+        writable, but should no longer be changed in place.
+
+        :return: the cached read-only view, or the image when it exceeds
+            the memory budget
+        """
+        if key in self._entries:
+            self._remove(key)
+        if image.nbytes > self.max_bytes:
+            return image
+        image = image.view()
+        image.flags.writeable = False
+        self._entries[key] = (image, message)
+        self.nbytes += image.nbytes
+        while self.nbytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        return image
+
+    def _remove(self, key):
+        """drop a single entry"""
+        image, _ = self._entries.pop(key)
+        self.nbytes -= image.nbytes
+
+    def clear(self):
+        """drop all cached images and reset the counters"""
+        self._entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        """summary of the cache usage"""
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": len(self._entries), "nbytes": self.nbytes,
+                "max_bytes": self.max_bytes}
+
+
+def file_digest(filename, chunk_size=2 ** 20):
+    """sha1 hash of the contents of a file"""
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as image_file:
+        for chunk in iter(lambda: image_file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def code_version(pipeline):
+    """hash of the source code of a pipeline class, its BubbleKicker base
+    classes, the step executor and the modules calculating and storing the
+    property tables, which changes when the code producing the cached
+    results is edited"""
+    digest = hashlib.sha1()
+    for source in (list(pipeline.__mro__[:-1]) +
+                   [executor, bubblekicker, utils, sparse, storage]):
+        try:
+            digest.update(inspect.getsource(source).encode('utf-8'))
+        except (IOError, TypeError):
+            # no source available (e.g. classes defined interactively)
+            digest.update(source.__name__.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResultCache(ResultStore):
+    """
+    Persistent cache of the pipeline results of image files, keyed by the
+    hash of the file contents and the pipeline settings
+
+    Each entry is stored as in a ResultStore, the least recently used
+    entries are removed when the cache directory exceeds max_bytes.
+
+    The hits and misses counters only count the lookups of this instance,
+    the batch runs count the lookups of their workers in the parent, which
+    also accounts for the size of the entries written by the workers and
+    evicts the entries beyond the budget.
+    """
+
+    def __init__(self, directory, max_bytes=2 * 2 ** 30, **kwargs):
+        """
+        :param directory: folder of the cache, created if needed
+        :param max_bytes: size budget of the cache files in bytes
+        :param kwargs: rules, engine and labels as in ResultStore
+        """
+        super(ResultCache, self).__init__(directory, **kwargs)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._versions = {}
+        # size of the cache files as known by this instance, the folder is
+        # only scanned again when it exceeds max_bytes (None: not scanned)
+        self._tracked_bytes = None
+
+    def _code_version(self, pipeline):
+        """memoized code version of a pipeline class"""
+        if pipeline not in self._versions:
+            self._versions[pipeline] = code_version(pipeline)
+        return self._versions[pipeline]
+
+    def key(self, filename, pipeline, channel, args, read_mode='channel'):
+        """
+        Cache key of running a pipeline on an image file
+
+        The key combines the file contents, the pipeline class and its code
+        version, the channel, the run arguments and read mode, and the
+        rules and engine of the property table, so changing any of these
+        never returns an outdated result.
+        """
+        settings = json.dumps([pipeline.__name__,
+                               self._code_version(pipeline), channel,
+                               list(args), read_mode, self.rules,
+                               self.engine, self.labels], sort_keys=True)
+        return hashlib.sha1((file_digest(filename) + settings)
+                            .encode('utf-8')).hexdigest()
+
+    def lookup(self, key):
+        """get the cached (binary image, property table) or None, without
+        counting the hit or miss (see count)"""
+        if key not in self:
+            return None
+        try:
+            result = self.read_binary(key), self.read_table(key)
+            # mark as recently used for the eviction
+            os.utime(self._path(key), None)
+        except (KeyError, IOError, OSError):
+            # removed by another process in the meantime
+            return None
+        return result
+
+    def count(self, hit):
+        """count a cache hit (True) or miss (False)"""
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def get(self, key):
+        """get the cached (binary image, property table) or None"""
+        result = self.lookup(key)
+        self.count(result is not None)
+        return result
+
+    def put(self, key, binary_image, metadata=None, pipeline=None,
+            labels=None):
+        """
+        Store a pipeline result and evict the least recently used entries
+        beyond the size budget
+
+        :param pipeline: pipeline class of the result, whose code version
+            is recorded for purge_stale
+        :param labels: labels of the binary image handed over by the
+            pipeline (see BubbleKicker.pop_labels)
+        :return: the property table of the image
+        """
+        property_table, nbytes = self.write_entry(key, binary_image,
+                                                  metadata, pipeline, labels)
+        self.account(nbytes)
+        return property_table
+
+    def write_entry(self, key, binary_image, metadata=None, pipeline=None,
+                    labels=None):
+        """
+        Store a pipeline result without evicting, for the workers of a batch
+        run whose parent process accounts for the size (see account)
+
+        :return: the property table of the image, size change of the cache
+            in bytes
+        """
+        metadata = dict(metadata or {})
+        if pipeline is not None:
+            metadata['code_version'] = self._code_version(pipeline)
+        path = self._path(key)
+        previous_size = self._file_size(path)
+        property_table = self.write(key, binary_image, metadata, labels)
+        return property_table, self._file_size(path) - previous_size
+
+    def account(self, nbytes):
+        """
+        Add the size change of written entries to the tracked size and evict
+        the least recently used entries beyond the size budget
+
+        :param nbytes: size change of the cache in bytes
+        """
+        if self._tracked_bytes is not None:
+            self._tracked_bytes += nbytes
+        self.evict()
+
+    def _entries(self):
+        """(modification time, size, path) of the cache files"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(STORE_EXTENSION):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    @staticmethod
+    def _file_size(path):
+        """size of a cache file, 0 when it does not exist"""
+        try:
+            return os.stat(path).st_size
+        except OSError:
+            return 0
+
+    def _remove_file(self, path):
+        """remove a cache file, ignoring files already removed"""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    @property
+    def nbytes(self):
+        """total size of the cache files in bytes"""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, force=False):
+        """
+        Remove the least recently used entries beyond max_bytes
+
+        The cache folder is only scanned when the size tracked by this
+        instance exceeds max_bytes, the entries are then removed down to
+        EVICTION_TARGET of max_bytes, so the folder is not scanned again
+        for the next entries. Entries written by other processes are
+        accounted for at the next scan (a batch run accounts for the entries
+        of its workers as their results come in, a scan in between may count
+        them twice, which only brings the next scan forward).
+
+        :param force: scan the cache folder regardless of the tracked size
+        """
+        if (not force and self._tracked_bytes is not None and
+                self._tracked_bytes <= self.max_bytes):
+            return
+        entries = sorted(self._entries())
+        nbytes = sum(size for _, size, _ in entries)
+        if nbytes > self.max_bytes:
+            target = int(EVICTION_TARGET * self.max_bytes)
+            for _, size, path in entries:
+                if nbytes <= target:
+                    break
+                self._remove_file(path)
+                nbytes -= size
+        self._tracked_bytes = nbytes
+
+    def purge_stale(self, pipelines):
+        """
+        Remove the entries not created by the current code version of the
+        given pipeline classes (the keys of outdated entries are never
+        requested again, this frees their space directly)
+
+        :return: number of removed entries
+        """
+        versions = set(self._code_version(pipeline)
+                       for pipeline in pipelines)
+        removed = 0
+        for name in self.names():
+            try:
+                version = self.read_metadata(name).get('code_version')
+            except (KeyError, IOError, OSError, ValueError):
+                version = None
+            if version not in versions:
+                self._remove_file(self._path(name))
+                removed += 1
+        self._tracked_bytes = None
+        return removed
+
+    def clear(self):
+        """remove all entries and reset the counters"""
+        for _, _, path in self._entries():
+            self._remove_file(path)
+        self._tracked_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        """summary of the cache usage"""
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": len(self.names()), "nbytes": self.nbytes,
+                "max_bytes": self.max_bytes}
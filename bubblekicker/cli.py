@@ -0,0 +1,247 @@
+"""
+Command line batch runner
+
+Runs a pipeline of pipelines.py on a folder of images or on the images
+listed in a manifest file, e.g.:
+
+    bubblekicker CannyPipeline images/ results/
+        --args "[[120, 180], 3, 3, 1, 1]" --workers 4
+
+The result of each image is written to a ResultStore in the output folder.
+Every finished image is appended to a checkpoint file in the same folder,
+so a rerun with the same settings skips the finished images and resumes
+where an interrupted run stopped. Images that failed are tried again.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import pipelines
+from bubblekicker import (BubbleKicker, BatchFailure, BACKENDS, READ_MODES,
+                          CHANNEL_CODE, ibatchbubblekicker)
+from cache import ResultCache
+from storage import ResultStore
+from utils import wall_time
+
+CHECKPOINT_FILE = 'checkpoint.jsonl'
+
+
+def available_pipelines():
+    """names of the pipeline classes of pipelines.py"""
+    return sorted(name for name, value in vars(pipelines).items()
+                  if isinstance(value, type) and
+                  issubclass(value, BubbleKicker) and value is not BubbleKicker)
+
+
+def read_manifest(manifest):
+    """
+    Image paths of a manifest file, one path per line
+
+    Empty lines and lines starting with # are skipped, relative paths are
+    relative to the folder of the manifest.
+    """
+    folder = os.path.dirname(os.path.abspath(manifest))
+    paths = []
+    with open(manifest) as manifest_file:
+        for line in manifest_file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                paths.append(os.path.join(folder, line))
+    return paths
+
+
+class Checkpoint(object):
+    """
+    Append-only record of the finished images of a batch run
+
+    The first line holds the run settings, each next line the status of
+    a single image. A line cut short by a crash is ignored on reading.
+    """
+
+    def __init__(self, filename, settings, restart=False):
+        """
+        :param filename: checkpoint file, created if needed
+        :param settings: dictionary with the JSON-serializable run settings,
+            an existing checkpoint of other settings is not resumed
+        :param restart: discard an existing checkpoint
+        """
+        self.filename = filename
+        self.finished = set()
+        if os.path.exists(filename) and not restart:
+            previous_settings = self._read()
+            if previous_settings != json.loads(json.dumps(settings)):
+                raise ValueError("The checkpoint {} was written with other "
+                                 "settings, use another output folder or "
+                                 "restart the run".format(filename))
+            self._file = open(filename, 'r+')
+            # drop a line cut short, so the next entries start on a new line
+            self._file.seek(self._complete)
+            self._file.truncate()
+        else:
+            self._file = open(filename, 'w')
+            self._write(settings)
+
+    def _read(self):
+        """load the finished images and return the settings"""
+        settings = None
+        self._complete = 0
+        with open(self.filename) as checkpoint_file:
+            for line in checkpoint_file:
+                if not line.endswith('\n'):
+                    break
+                self._complete += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if settings is None:
+                    settings = entry
+                elif entry['status'] == 'done':
+                    self.finished.add(entry['image'])
+        return settings
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+
+    def add(self, image, error=None):
+        """record an image as done, or as failed with the error message"""
+        if error is None:
+            self.finished.add(image)
+            self._write({'image': image, 'status': 'done'})
+        else:
+            self._write({'image': image, 'status': 'failed',
+                         'error': error})
+
+    def close(self):
+        self._file.close()
+
+
+def _report(message, stream):
+    if stream is not None:
+        stream.write(message + '\n')
+        stream.flush()
+
+
+def run_batch(pipeline, source, output, args=(), channel='red', workers=None,
+              backend='process', read_mode='channel', cache=None,
+              labels=False, restart=False, stream=sys.stdout):
+    """
+    Run a pipeline on all images of a folder or manifest, resuming from
+    the checkpoint in the output folder
+
+    :param pipeline: name of a pipeline class of pipelines.py
+    :param source: folder with the images or manifest file with the image
+        paths
+    :param output: folder of the ResultStore and the checkpoint
+    :param args: arguments of the pipeline run method
+    :param channel: green | red | blue
+    :param workers: number of workers, None uses all cores
+    :param backend: process | thread
+    :param read_mode: how the images are loaded by the pipeline
+    :param cache: folder of a ResultCache shared by several runs
+    :param labels: also store the label images of the bubbles
+    :param restart: process all images, ignoring an existing checkpoint
+    :param stream: file to which the progress is written, None for none
+    :return: dictionary with the number of processed, skipped and failed
+        images and the throughput in images per second
+    """
+    if pipeline not in available_pipelines():
+        raise ValueError("Not a valid pipeline, use one "
+                         "of {}".format(", ".join(available_pipelines())))
+    if os.path.isdir(source):
+        paths = [os.path.join(source, imgfile)
+                 for imgfile in sorted(os.listdir(source))]
+    else:
+        paths = read_manifest(source)
+
+    store = ResultStore(output, labels=labels)
+    store.check_names(paths)
+    settings = {'pipeline': pipeline, 'args': list(args),
+                'channel': channel, 'read_mode': read_mode,
+                'labels': labels}
+    checkpoint = Checkpoint(os.path.join(output, CHECKPOINT_FILE), settings,
+                            restart)
+    todo = [path for path in paths if not (path in checkpoint.finished and
+                                           os.path.basename(path) in store)]
+    _report("{} images, {} to process".format(len(paths), len(todo)),
+            stream)
+
+    if cache is not None:
+        cache = ResultCache(cache)
+
+    failed = 0
+    start = wall_time()
+    try:
+        results = ibatchbubblekicker(
+            todo, channel, getattr(pipelines, pipeline), args,
+            workers=workers, ordered=False, read_mode=read_mode,
+            store=store, cache=cache, backend=backend)
+        for count, (path, result) in enumerate(results, 1):
+            if isinstance(result, BatchFailure):
+                failed += 1
+                checkpoint.add(path, result.error)
+                status = "failed ({})".format(result.error)
+            else:
+                checkpoint.add(path)
+                status = "done"
+            elapsed = wall_time() - start
+            _report("[{}/{}] {} {} - {:.2f} images/s".format(
+                count, len(todo), os.path.basename(path), status,
+                count / elapsed if elapsed > 0 else 0.), stream)
+    finally:
+        checkpoint.close()
+
+    elapsed = wall_time() - start
+    summary = {'processed': len(todo) - failed,
+               'skipped': len(paths) - len(todo), 'failed': failed,
+               'seconds': elapsed,
+               'images_per_second': (len(todo) / elapsed if elapsed > 0
+                                     else 0.)}
+    _report("{processed} processed, {skipped} skipped, {failed} failed in "
+            "{seconds:.1f} s ({images_per_second:.2f} images/s)".format(
+                **summary), stream)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('pipeline', help="pipeline class, one of "
+                                         "{}".format(", ".join(
+                                             available_pipelines())))
+    parser.add_argument('source', help="folder with the images or manifest "
+                                       "file with one image path per line")
+    parser.add_argument('output', help="folder of the results and the "
+                                       "checkpoint")
+    parser.add_argument('--args', type=json.loads, default=[],
+                        help="JSON list with the arguments of the pipeline, "
+                             "e.g. \"[[120, 180], 3, 3, 1, 1]\"")
+    parser.add_argument('--channel', default='red',
+                        choices=sorted(CHANNEL_CODE))
+    parser.add_argument('--workers', type=int,
+                        help="number of workers, all cores by default")
+    parser.add_argument('--backend', default='process', choices=BACKENDS)
+    parser.add_argument('--read-mode', default='channel', choices=READ_MODES)
+    parser.add_argument('--cache', help="folder of a result cache shared "
+                                        "by several runs")
+    parser.add_argument('--labels', action='store_true',
+                        help="also store the label images of the bubbles")
+    parser.add_argument('--restart', action='store_true',
+                        help="process all images again, ignoring the "
+                             "checkpoint")
+    args = parser.parse_args(argv)
+
+    try:
+        summary = run_batch(args.pipeline, args.source, args.output,
+                            args.args, args.channel, args.workers,
+                            args.backend, args.read_mode, args.cache,
+                            args.labels, args.restart)
+    except ValueError as err:
+        parser.error(str(err))
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
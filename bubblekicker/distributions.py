@@ -0,0 +1,230 @@
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# fixed histogram bin edges (in pixels) used when no bins are given
+DEFAULT_BINS = {'equivalent_diameter': np.linspace(0., 100., 101),
+                'area': np.linspace(0., 10000., 101)}
+
+
+class RunningMoments(object):
+    """
+    Count, mean, variance, min and max of a stream of values, mergeable
+    with the moments of other streams
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, values):
+        """add a batch of values"""
+        values = np.asarray(values, dtype=np.double)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        other = RunningMoments()
+        other.count = len(values)
+        other.mean = values.mean()
+        other.m2 = ((values - other.mean) ** 2).sum()
+        other.min, other.max = values.min(), values.max()
+        self.merge(other)
+
+    def merge(self, other):
+        """combine with the moments of another stream (Chan et al.)"""
+        count = self.count + other.count
+        if count == 0:
+            return self
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / float(count)
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / \
+            float(count)
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def variance(self):
+        """sample variance of the values"""
+        if self.count < 2:
+            return np.nan
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        """sample standard deviation of the values"""
+        return np.sqrt(self.variance)
+
+
+class QuantileSketch(object):
+    """
+    Mergeable quantile sketch with a relative accuracy guarantee
+
+    Positive values are counted in logarithmic buckets, such that each
+    quantile estimate is within the relative accuracy of the exact value
+    (the DDSketch approach). Merging two sketches adds the bucket counts.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.zero_count = 0
+        self.buckets = {}
+
+    @property
+    def count(self):
+        """number of values added"""
+        return self.zero_count + sum(self.buckets.values())
+
+    def add(self, values):
+        """add a batch of (non-negative) values"""
+        values = np.asarray(values, dtype=np.double)
+        values = values[~np.isnan(values)]
+        if (values < 0).any():
+            raise ValueError("The quantile sketch only supports "
+                             "non-negative values")
+        positive = values[values > 0]
+        self.zero_count += len(values) - len(positive)
+        keys, counts = np.unique(
+            np.ceil(np.log(positive) / np.log(self.gamma)).astype(np.int64),
+            return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def merge(self, other):
+        """add the bucket counts of another sketch"""
+        if other.gamma != self.gamma:
+            raise ValueError("Only sketches with the same relative "
+                             "accuracy can be merged")
+        self.zero_count += other.zero_count
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        return self
+
+    def quantile(self, q):
+        """estimate the quantile(s) q (between 0 and 1)"""
+        q = np.atleast_1d(np.asarray(q, dtype=np.double))
+        if self.count == 0:
+            estimates = np.full(q.shape, np.nan)
+        else:
+            keys = np.array(sorted(self.buckets), dtype=np.int64)
+            counts = np.array([self.buckets[key] for key in keys])
+            cumulative = self.zero_count + np.cumsum(counts)
+            ranks = q * (self.count - 1)
+            position = np.searchsorted(cumulative, ranks, side='right')
+            position = np.minimum(position, len(keys) - 1)
+            estimates = (2 * self.gamma ** keys[position].astype(np.double) /
+                         (self.gamma + 1))
+            estimates[ranks < self.zero_count] = 0.
+        return estimates if estimates.size > 1 else estimates[0]
+
+
+class PropertyAccumulator(object):
+    """
+    Incremental size distribution statistics over many property tables
+
+    For each property a fixed-bin histogram, the running moments and a
+    quantile sketch are kept, so the campaign-wide distribution is known
+    without keeping all bubbles in memory. Accumulators of parallel
+    workers are combined with merge.
+    """
+
+    def __init__(self, properties=("equivalent_diameter", "area"),
+                 bins=None, relative_accuracy=0.01):
+        """
+        :param properties: bubble properties to accumulate
+        :param bins: dictionary with the histogram bin edges of each
+            property, DEFAULT_BINS are used for missing properties
+        :param relative_accuracy: relative accuracy of the quantiles
+        """
+        bins = bins or {}
+        self.properties = list(properties)
+        self.edges = {}
+        self.counts = {}
+        self.moments = {}
+        self.sketches = {}
+        self.n_images = 0
+        for which_property in self.properties:
+            edges = np.asarray(bins.get(which_property,
+                                        DEFAULT_BINS.get(which_property)),
+                               dtype=np.double)
+            if edges.ndim != 1 or len(edges) < 2:
+                raise ValueError("Provide the bin edges of "
+                                 "{}".format(which_property))
+            self.edges[which_property] = edges
+            # bins of the edges with an underflow and overflow bin
+            self.counts[which_property] = np.zeros(len(edges) + 1,
+                                                   dtype=np.int64)
+            self.moments[which_property] = RunningMoments()
+            self.sketches[which_property] = QuantileSketch(relative_accuracy)
+
+    def add(self, property_table):
+        """add the bubbles of a property table"""
+        for which_property in self.properties:
+            values = np.asarray(property_table[which_property],
+                                dtype=np.double)
+            values = values[~np.isnan(values)]
+            # right-closed last bin, as numpy.histogram
+            edges = self.edges[which_property]
+            index = np.searchsorted(edges, values, side='right')
+            index[values == edges[-1]] = len(edges) - 1
+            self.counts[which_property] += np.bincount(
+                index, minlength=len(edges) + 1)
+            self.moments[which_property].add(values)
+            self.sketches[which_property].add(values)
+        self.n_images += 1
+        return self
+
+    def merge(self, other):
+        """combine with the statistics of another accumulator"""
+        for which_property in self.properties:
+            if not np.array_equal(self.edges[which_property],
+                                  other.edges[which_property]):
+                raise ValueError("Only accumulators with the same bins "
+                                 "can be merged")
+            self.counts[which_property] += other.counts[which_property]
+            self.moments[which_property].merge(
+                other.moments[which_property])
+            self.sketches[which_property].merge(
+                other.sketches[which_property])
+        self.n_images += other.n_images
+        return self
+
+    def histogram(self, which_property="equivalent_diameter"):
+        """histogram counts within the fixed bin edges
+
+        :return: counts, edges (as numpy.histogram)
+        """
+        return (self.counts[which_property][1:-1].copy(),
+                self.edges[which_property])
+
+    def out_of_range(self, which_property="equivalent_diameter"):
+        """number of values below and above the bin edges"""
+        counts = self.counts[which_property]
+        return counts[0], counts[-1]
+
+    def quantile(self, q, which_property="equivalent_diameter"):
+        """estimate the quantile(s) q (between 0 and 1) of a property"""
+        return self.sketches[which_property].quantile(q)
+
+    def summary(self, which_property="equivalent_diameter",
+                percentiles=(10, 50, 90)):
+        """summary of a property, as bubble_properties_summary"""
+        moments = self.moments[which_property]
+        empty = moments.count == 0
+        quantiles = np.atleast_1d(self.quantile(
+            np.asarray(percentiles) / 100., which_property))
+        return pd.Series(OrderedDict(
+            [("count", moments.count),
+             ("mean", np.nan if empty else moments.mean),
+             ("std", moments.std),
+             ("min", np.nan if empty else moments.min)] +
+            [("p{}".format(percentile), value)
+             for percentile, value in zip(percentiles, quantiles)] +
+            [("max", np.nan if empty else moments.max)]))
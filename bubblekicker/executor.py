@@ -0,0 +1,274 @@
+"""
+Execution of step sequences in preallocated image buffers
+
+The BubbleKicker methods allocate a new full-size image for every step. The
+StepExecutor runs the same (method name, parameters) step sequences, as
+returned by the pipeline steps, in two ping-pong buffers: each step reads
+the previous buffer and writes the other one with the dst argument of the
+OpenCV functions, while fill holes works in place. The buffers, the flood
+fill mask and the structuring elements are reused for all images of the
+same size, and the result is bit-identical to the BubbleKicker methods.
+
+The clear border step labels the bubbles once (see clear_border_labels);
+the labels of the result are handed over with pop_labels so the property
+calculation does not label the image again.
+"""
+
+import inspect
+
+import numpy as np
+import cv2 as cv
+
+from utils import wall_time, cpu_time
+
+# structuring elements of the dilation/erosion steps by footprint size
+_KERNELS = {}
+
+
+def square_kernel(footprintsize):
+    """cached square structuring element (read-only) of the given size"""
+    kernel = _KERNELS.get(footprintsize)
+    if kernel is None:
+        kernel = np.ones((footprintsize, footprintsize), np.uint8)
+        kernel.flags.writeable = False
+        _KERNELS[footprintsize] = kernel
+    return kernel
+
+
+def _border_touching(stats, shape, buffer_size):
+    """mask of the components whose bounding box reaches into the border
+    belt of buffer_size + 1 pixels"""
+    ext = buffer_size + 1
+    left, top = stats[:, cv.CC_STAT_LEFT], stats[:, cv.CC_STAT_TOP]
+    right = left + stats[:, cv.CC_STAT_WIDTH]
+    bottom = top + stats[:, cv.CC_STAT_HEIGHT]
+    return ((stats[:, cv.CC_STAT_AREA] > 0) &
+            ((left < ext) | (top < ext) | (right > shape[1] - ext) |
+             (bottom > shape[0] - ext)))
+
+
+def _background_row(stats, centroids, touching):
+    """statistics and centroid of the background of the kept bubbles: the
+    union of the cleared components and the component 0"""
+    area = stats[touching, cv.CC_STAT_AREA]
+    left = stats[touching, cv.CC_STAT_LEFT]
+    top = stats[touching, cv.CC_STAT_TOP]
+    right = left + stats[touching, cv.CC_STAT_WIDTH]
+    bottom = top + stats[touching, cv.CC_STAT_HEIGHT]
+    row = np.zeros((1, stats.shape[1]), stats.dtype)
+    centroid = np.zeros((1, 2), centroids.dtype)
+    if area.sum() > 0:
+        row[0, cv.CC_STAT_LEFT], row[0, cv.CC_STAT_TOP] = left.min(), top.min()
+        row[0, cv.CC_STAT_WIDTH] = right.max() - left.min()
+        row[0, cv.CC_STAT_HEIGHT] = bottom.max() - top.min()
+        row[0, cv.CC_STAT_AREA] = area.sum()
+        centroid[0] = (centroids[touching] * area[:, None]).sum(axis=0) / \
+            area.sum()
+    return row, centroid
+
+
+def clear_border_labels(image, buffer_size=3, bgval=1, out=None):
+    """
+    Clear the objects touching the image border, as skimage clear_border
+    does on the inverted image, and keep the labels of the bubbles
+
+    For 0/255 edge images a single cv.connectedComponentsWithStats of the
+    zero pixels replaces the labeling of clear_border: the objects touching
+    the border belt are found from the component bounding boxes and cleared
+    with a lookup table, and the kept components are renumbered in place
+    into the labels the property calculation would find on the result (see
+    bubble_properties_calculate), so the result is not labeled again. Other
+    images are cleared with skimage.
+
+    :param image: MxN binary image
+    :param buffer_size: belt of pixels along the border to examine
+    :param bgval: value of the cleared objects
+    :param out: MxN uint8 image to write the result in
+    :return: cleared image, (nbubbles, marker image, stats, centroids) of
+        the bubbles as returned by cv.connectedComponentsWithStats on the
+        inverse of the result, or None when they are not shared (other
+        images, bgval other than 1, or edges that are kept and would merge
+        with the bubbles)
+    """
+    if any(buffer_size >= size for size in image.shape):
+        raise ValueError("buffer size may not be greater than image size")
+    histogram = (cv.calcHist([image], [0], None, [256], [0, 256]).ravel()
+                 if image.ndim == 2 and image.dtype == np.uint8 else None)
+    if histogram is None or histogram[1:255].any():
+        from skimage.segmentation import clear_border
+
+        out = cv.bitwise_not(image, dst=out)
+        clear_border(out, buffer_size=buffer_size, bgval=bgval, in_place=True)
+        return out, None
+
+    # components of the zero pixels (the non-zero pixels of the inverted
+    # image), label 0 are the 255 pixels which skimage takes as background
+    zeros = cv.compare(image, 0, cv.CMP_EQ, dst=out)
+    nlabels, labels, stats, centroids = cv.connectedComponentsWithStats(
+        zeros, connectivity=8, ltype=cv.CV_32S)
+    touching = _border_touching(stats, image.shape, buffer_size)
+
+    values = np.full(nlabels, 255, np.uint8)
+    values[0] = 0
+    values[touching] = bgval
+    out = np.take(values, labels, out=zeros, mode='clip')
+
+    if bgval != 1 or (stats[0, cv.CC_STAT_AREA] > 0 and not touching[0]):
+        return out, None
+    # the kept components in label order are numbered in the same raster
+    # order by a new labeling of the result
+    touching[0] = True
+    kept = np.flatnonzero(~touching)
+    renumber = np.zeros(nlabels, labels.dtype)
+    renumber[kept] = np.arange(1, len(kept) + 1)
+    np.take(renumber, labels, out=labels, mode='clip')
+    background, centroid = _background_row(stats, centroids, touching)
+    return out, (len(kept) + 1, labels, np.r_[background, stats[kept]],
+                 np.r_[centroid, centroids[kept]])
+
+
+def _edge_detect_canny_opencv(executor, image, out, threshold=[0.01, 0.5]):
+    cv.Canny(image, threshold[0], threshold[1], edges=out)
+    return out, ('edge-detect with thresholds {} -> {} '
+                 '- opencv'.format(threshold[0], threshold[1]))
+
+
+def _adaptive_threshold_opencv(executor, image, out, blocksize=91,
+                               cvalue=18):
+    cv.adaptiveThreshold(image, 1, cv.ADAPTIVE_THRESH_GAUSSIAN_C,
+                         cv.THRESH_BINARY, blocksize, cvalue, dst=out)
+    return out, ('adaptive threshold bubble detection '
+                 'with blocksize {} and cvalue {} '
+                 '- opencv'.format(blocksize, cvalue))
+
+
+def _dilate_opencv(executor, image, out, footprintsize=3):
+    cv.dilate(image, square_kernel(footprintsize), dst=out, iterations=1)
+    return out, 'dilate with footprintsize {} - opencv'.format(footprintsize)
+
+
+def _fill_holes_opencv(executor, image, out):
+    if not executor.owns(image):
+        # never change the image given to the executor
+        np.copyto(out, image)
+        image = out
+    # the holes are filled in place, the labels no longer apply
+    executor._labels = None
+    executor._mask.fill(0)
+    cv.floodFill(image, executor._mask, (0, 0), 0)
+    return image, 'fill holes - opencv'
+
+
+def _clear_border_skimage(executor, image, out, buffer_size=3, bgval=1):
+    out, labels = clear_border_labels(image, buffer_size, bgval, out=out)
+    executor._labels = (out, labels)
+    return out, ('clear border with buffer size {} and bgval {} '
+                 '-  skimage'.format(buffer_size, bgval))
+
+
+def _erode_opencv(executor, image, out, footprintsize=1):
+    if footprintsize == 1 and executor.owns(image):
+        # a 1x1 erosion leaves the image (and its labels) unchanged
+        return image, ('erode with footprintsize {} '
+                       '- opencv'.format(footprintsize))
+    cv.erode(image, square_kernel(footprintsize), dst=out, iterations=1)
+    return out, 'erode with footprintsize {} - opencv'.format(footprintsize)
+
+
+EXECUTOR_STEPS = {'edge_detect_canny_opencv': _edge_detect_canny_opencv,
+                  'adaptive_threshold_opencv': _adaptive_threshold_opencv,
+                  'dilate_opencv': _dilate_opencv,
+                  'fill_holes_opencv': _fill_holes_opencv,
+                  'clear_border_skimage': _clear_border_skimage,
+                  'erode_opencv': _erode_opencv}
+
+
+class StepExecutor(object):
+    """
+    Run step sequences on 8-bit single channel images in two reused
+    ping-pong buffers
+
+    The returned image is one of the buffers and is overwritten by the next
+    run, copy it to keep the result.
+    """
+
+    def __init__(self):
+        self._buffers = None
+        self._mask = None
+        self._labels = None
+
+    def owns(self, image):
+        """check if the image is one of the executor buffers"""
+        return self._buffers is not None and any(image is buffer
+                                                 for buffer in self._buffers)
+
+    def pop_labels(self, image):
+        """
+        Hand over the bubble labels kept by the clear border step for the
+        image returned by the last run (see clear_border_labels)
+
+        :return: (nbubbles, marker image, stats, centroids) or None when the
+            labels were not kept or no longer apply to the image
+        """
+        kept, self._labels = self._labels, None
+        if kept is not None and kept[0] is image:
+            return kept[1]
+        return None
+
+    def _prepare(self, shape):
+        """(re)allocate the buffers when the image size changes
+
+        :return: number of allocated bytes
+        """
+        if self._buffers is None or self._buffers[0].shape != shape:
+            self._buffers = [np.empty(shape, np.uint8),
+                             np.empty(shape, np.uint8)]
+            self._mask = np.empty((shape[0] + 2, shape[1] + 2), np.uint8)
+            return (sum(buffer.nbytes for buffer in self._buffers) +
+                    self._mask.nbytes)
+        return 0
+
+    def run(self, image, steps, logger=None):
+        """
+        Run a sequence of steps on an image
+
+        :param image: MxN uint8 image, which is left unchanged
+        :param steps: list of (method name, parameters dict) tuples, as
+            returned by the steps method of the pipelines
+        :param logger: Logger to which the log message and record of each
+            step are added (the buffer allocation is counted in the record
+            of the first step)
+        :return: resulting image (an executor buffer), list of the log
+            messages of the steps
+        """
+        if image.ndim != 2 or image.dtype != np.uint8:
+            raise ValueError("The executor only supports MxN uint8 images")
+        for name, _ in steps:
+            if name not in EXECUTOR_STEPS:
+                raise ValueError("Step {} is not supported by the executor, "
+                                 "use one of {}".format(
+                                     name, ", ".join(sorted(EXECUTOR_STEPS))))
+        allocated = 0 if self.owns(image) else self._prepare(image.shape)
+
+        messages = []
+        self._labels = None
+        for name, params in steps:
+            start_wall, start_cpu = wall_time(), cpu_time()
+            out = (self._buffers[1] if image is self._buffers[0]
+                   else self._buffers[0])
+            image, message = EXECUTOR_STEPS[name](self, image, out,
+                                                  **params)
+            if self._labels is not None and self._labels[0] is not image:
+                self._labels = None
+            messages.append(message)
+            if logger is not None:
+                logger.add_log(message)
+                params = inspect.getcallargs(EXECUTOR_STEPS[name], self,
+                                             None, None, **params)
+                for argument in ['executor', 'image', 'out']:
+                    params.pop(argument)
+                logger.add_record(name, params, image,
+                                  wall_time() - start_wall,
+                                  cpu_time() - start_cpu, allocated)
+                allocated = 0
+        return image, messages
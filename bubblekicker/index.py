@@ -0,0 +1,378 @@
+"""
+Queryable index of the unfiltered bubble properties of a campaign
+
+The property tables of all images are stored before filtering in a single
+SQLite database, one row per bubble, with an index on each filterable
+property. Filter rules are translated into SQL conditions, so trying
+another rule set than DEFAULT_FILTERS across millions of bubbles is a query
+on the index instead of a new bubble_properties_calculate of every image.
+
+Besides the min/max rules of _bubble_properties_filter, which keep the
+values strictly between the limits, a query accepts an SQL expression on
+the property columns (and the image name) as extra rule, e.g.
+"area > 4 * perimeter OR convexity BETWEEN 0.9 AND 1.1".
+"""
+
+import sqlite3
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from bubblekicker import (DEFAULT_FILTERS, bubble_properties_calculate,
+                          bubble_properties_summary)
+
+# stored columns of the property tables, the centroid is split in a row
+# and column value
+INDEX_COLUMNS = OrderedDict([("area", "INTEGER"),
+                             ("centroid_row", "REAL"),
+                             ("centroid_col", "REAL"),
+                             ("convex_area", "INTEGER"),
+                             ("equivalent_diameter", "REAL"),
+                             ("perimeter", "REAL"),
+                             ("convexity", "REAL"),
+                             ("circularity_reciprocal", "REAL")])
+
+# properties with a database index, to select on them quickly
+INDEXED_PROPERTIES = ["area", "convex_area", "equivalent_diameter",
+                      "perimeter", "convexity", "circularity_reciprocal"]
+
+# fraction of the bubbles below which selecting them with a property index
+# is faster than scanning the table
+INDEX_SELECTIVITY = 0.05
+
+PROPERTY_COLUMNS = ["area", "centroid", "convex_area", "equivalent_diameter",
+                    "perimeter", "convexity", "circularity_reciprocal"]
+
+
+def _rules_condition(rules, where=None):
+    """SQL condition and parameters of a set of filter rules
+
+    :param rules: dictionary with min and/or max rules for each property
+    :param where: extra SQL expression the bubbles should satisfy
+    :return: condition, list of parameters
+    """
+    conditions, parameters = [], []
+    for prop_name, ruleset in sorted(rules.items()):
+        if prop_name not in INDEX_COLUMNS:
+            raise ValueError("Not an indexed bubble property: "
+                             "{}".format(prop_name))
+        for rule, value in sorted(ruleset.items()):
+            if rule == 'min':
+                conditions.append('"{}" > ?'.format(prop_name))
+            elif rule == 'max':
+                conditions.append('"{}" < ?'.format(prop_name))
+            else:
+                raise Exception("Rule not supported, "
+                                "use min or max as filter")
+            parameters.append(float(value))
+    if where:
+        conditions.append("({})".format(where))
+    return " AND ".join(conditions) or "1", parameters
+
+
+class BubbleIndex(object):
+    """
+    SQLite index of the unfiltered bubble properties of many images
+    """
+
+    def __init__(self, path=':memory:', engine='opencv'):
+        """
+        :param path: database file, created if needed, by default the index
+            is kept in memory
+        :param engine: regionprops | opencv, property extraction engine of
+            the images added with add_binary
+        """
+        self.path = path
+        self.engine = engine
+        self._connection = sqlite3.connect(path)
+        self._indexed = True
+        columns = ", ".join('"{}" {}'.format(column, kind)
+                            for column, kind in INDEX_COLUMNS.items())
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS images ("
+                "image_id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS bubbles ("
+                "image_id INTEGER NOT NULL REFERENCES images(image_id), "
+                "label INTEGER NOT NULL, {})".format(columns))
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS bubbles_image "
+                "ON bubbles(image_id)")
+            self._create_indexes()
+
+    def _create_indexes(self):
+        """create the missing indexes of the filterable properties"""
+        for prop_name in INDEXED_PROPERTIES:
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS bubbles_{0} '
+                'ON bubbles("{0}")'.format(prop_name))
+
+    def close(self):
+        """close the database"""
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        """number of indexed bubbles"""
+        return self._connection.execute(
+            "SELECT COUNT(*) FROM bubbles").fetchone()[0]
+
+    def __contains__(self, name):
+        return self._connection.execute(
+            "SELECT 1 FROM images WHERE name = ?", (name,)).fetchone() \
+            is not None
+
+    def names(self):
+        """sorted names of the indexed images"""
+        return [name for name, in self._connection.execute(
+            "SELECT name FROM images ORDER BY name")]
+
+    def add(self, name, property_table):
+        """
+        Index the unfiltered property table of an image, replacing the
+        bubbles indexed before for the same image
+
+        :param name: name of the image (e.g. the image file name)
+        :param property_table: bubble properties indexed by label, as
+            returned by bubble_properties_calculate with rules={}
+        """
+        centroids = np.array(list(property_table["centroid"]),
+                             dtype=np.double).reshape(-1, 2)
+        values = [property_table.index.values.astype(np.int64).tolist()]
+        for column in INDEX_COLUMNS:
+            if column == "centroid_row":
+                values.append(centroids[:, 0].tolist())
+            elif column == "centroid_col":
+                values.append(centroids[:, 1].tolist())
+            else:
+                values.append([None if value != value else value for value
+                               in property_table[column].values.tolist()])
+
+        with self._connection:
+            self._remove(name)
+            image_id = self._connection.execute(
+                "INSERT INTO images (name) VALUES (?)", (name,)).lastrowid
+            self._connection.executemany(
+                "INSERT INTO bubbles VALUES (?, ?, {})".format(
+                    ", ".join("?" * len(INDEX_COLUMNS))),
+                ([image_id] + list(row) for row in zip(*values)))
+
+    def add_binary(self, name, binary_image, labels=None):
+        """
+        Calculate and index the unfiltered bubble properties of an output
+        binary image of a pipeline
+
+        :param labels: labels of the binary image handed over by the
+            pipeline (see BubbleKicker.pop_labels)
+        :return: the unfiltered property table
+        """
+        _, property_table = bubble_properties_calculate(
+            binary_image, rules={}, engine=self.engine, labels=labels)
+        self.add(name, property_table)
+        return property_table
+
+    def add_store(self, store):
+        """
+        Index all images of a ResultStore
+
+        The stored property tables are filtered, so the properties are
+        calculated again from the stored binary images (the pipelines are
+        not run again). The store should use the engine of the index, so
+        all indexed properties are calculated the same way.
+
+        :return: number of indexed images
+        """
+        if store.engine != self.engine:
+            raise ValueError("The store uses the {} engine and the index the "
+                             "{} engine".format(store.engine, self.engine))
+        names = store.names()
+        with self.bulk():
+            for name in names:
+                self.add_binary(name, store.read_binary(name))
+        return len(names)
+
+    @contextmanager
+    def bulk(self):
+        """
+        Add many images at once: the property indexes are dropped while
+        the images are added and built again at the end, which is about 10
+        times faster than updating them for every bubble
+
+            with index.bulk():
+                for name, binary_image in results:
+                    index.add_binary(name, binary_image)
+        """
+        with self._connection:
+            for prop_name in INDEXED_PROPERTIES:
+                self._connection.execute(
+                    "DROP INDEX IF EXISTS bubbles_{}".format(prop_name))
+        self._indexed = False
+        try:
+            yield self
+        finally:
+            with self._connection:
+                self._create_indexes()
+            self._indexed = True
+            self.optimize()
+
+    def _remove(self, name):
+        """remove the bubbles of an image"""
+        self._connection.execute(
+            "DELETE FROM bubbles WHERE image_id IN "
+            "(SELECT image_id FROM images WHERE name = ?)", (name,))
+        self._connection.execute("DELETE FROM images WHERE name = ?",
+                                 (name,))
+
+    def remove(self, name):
+        """remove an image and its bubbles from the index"""
+        with self._connection:
+            self._remove(name)
+
+    def optimize(self):
+        """update the statistics the query planner uses to choose the
+        property index of a query, e.g. after adding many images"""
+        with self._connection:
+            self._connection.execute("ANALYZE")
+
+    def _bubbles_source(self, rules):
+        """
+        Bubbles table of a query with the index to use
+
+        The SQLite query planner does not know how many bubbles a range
+        selects and uses a property index even when the rules keep most
+        bubbles, which is several times slower than a table scan. The
+        number of bubbles selected by the rules of each indexed property
+        is counted on its (covering) index instead, and the index of the
+        most selective rule is only used when it selects less than
+        INDEX_SELECTIVITY of the bubbles.
+        """
+        if not self._indexed:
+            return "bubbles AS b"
+        total = len(self)
+        best, best_count = None, total
+        for prop_name, ruleset in rules.items():
+            if prop_name not in INDEXED_PROPERTIES or not ruleset:
+                continue
+            condition, parameters = _rules_condition({prop_name: ruleset})
+            count = self._connection.execute(
+                "SELECT COUNT(*) FROM bubbles INDEXED BY bubbles_{} "
+                "WHERE {}".format(prop_name, condition),
+                parameters).fetchone()[0]
+            if count < best_count:
+                best, best_count = prop_name, count
+        if best is not None and best_count < INDEX_SELECTIVITY * total:
+            return "bubbles AS b INDEXED BY bubbles_{}".format(best)
+        return "bubbles AS b NOT INDEXED"
+
+    def _select(self, columns, rules, where, order=""):
+        """rows of the selected columns of the bubbles passing the rules,
+        with the image name available as i.name"""
+        condition, parameters = _rules_condition(rules, where)
+        return self._connection.execute(
+            "SELECT {} FROM {} JOIN images AS i USING (image_id) "
+            "WHERE {} {}".format(columns, self._bubbles_source(rules),
+                                 condition, order), parameters).fetchall()
+
+    def query(self, rules=DEFAULT_FILTERS, where=None):
+        """
+        Bubbles of all images passing the filter rules
+
+        :param rules: dictionary with min and/or max rules for each property
+        :param where: extra SQL expression on the property columns and the
+            image name, e.g. "equivalent_diameter > 10 AND name LIKE 'a%'"
+        :return: property table indexed by image name and label, .loc[name]
+            gives the filtered property table of a single image
+        """
+        columns = ", ".join('b."{}"'.format(column)
+                            for column in INDEX_COLUMNS)
+        rows = self._select("i.name, b.label, " + columns, rules, where,
+                            "ORDER BY i.name, b.label")
+        table = pd.DataFrame.from_records(
+            rows, columns=["image", "label"] + list(INDEX_COLUMNS),
+            coerce_float=True)
+        table["centroid"] = list(zip(table.pop("centroid_row"),
+                                     table.pop("centroid_col")))
+        return table.set_index(["image", "label"])[PROPERTY_COLUMNS]
+
+    def values(self, which_property="equivalent_diameter",
+               rules=DEFAULT_FILTERS, where=None):
+        """values of a property of the bubbles passing the filter rules"""
+        if which_property not in INDEX_COLUMNS:
+            raise ValueError("Not an indexed bubble property: "
+                             "{}".format(which_property))
+        rows = self._select('b."{}"'.format(which_property), rules, where)
+        return np.array([value for value, in rows], dtype=np.double)
+
+    def summary(self, which_property="equivalent_diameter",
+                rules=DEFAULT_FILTERS, where=None, percentiles=(10, 50, 90)):
+        """summary of a property of the filtered bubbles of all images, as
+        bubble_properties_summary"""
+        values = self.values(which_property, rules, where)
+        return bubble_properties_summary({which_property: values},
+                                         which_property, percentiles)
+
+    def histogram(self, which_property="equivalent_diameter",
+                  rules=DEFAULT_FILTERS, where=None, bins=50,
+                  range=None):
+        """histogram of a property of the filtered bubbles of all images
+
+        :return: counts, edges (as numpy.histogram)
+        """
+        values = self.values(which_property, rules, where)
+        return np.histogram(values[~np.isnan(values)], bins=bins,
+                            range=range)
+
+    def counts(self, rules=DEFAULT_FILTERS, where=None):
+        """number of bubbles of each image passing the filter rules
+
+        :return: Series indexed by image name, including the images without
+            remaining bubbles
+        """
+        counts = OrderedDict((name, 0) for name in self.names())
+        counts.update(self._select("i.name, COUNT(*)", rules, where,
+                                   "GROUP BY b.image_id"))
+        return pd.Series(counts, name="count", dtype=np.int64)
+
+    def affected_images(self, rules, reference=DEFAULT_FILTERS, where=None,
+                        reference_where=None):
+        """
+        Images of which the filtered bubbles change when applying other
+        rules than a reference rule set
+
+        :param rules: new filter rules
+        :param reference: filter rules the current results are based on
+        :param where: extra SQL expression of the new rules
+        :param reference_where: extra SQL expression of the reference
+        :return: DataFrame indexed by image name with the number of bubbles
+            with the reference and the new rules and the number of bubbles
+            added and removed by the new rules, only for the changed images
+        """
+        condition, parameters = _rules_condition(rules, where)
+        reference_condition, reference_parameters = _rules_condition(
+            reference, reference_where)
+        # every bubble is compared: scan the table once in image order,
+        # which saves sorting the bubbles for the grouping, and only look
+        # up the image names when an expression may refer to them
+        images = (" JOIN images AS i USING (image_id)"
+                  if where or reference_where else "")
+        rows = self._connection.execute(
+            "SELECT name, n_reference, n_rules, added, removed FROM ("
+            "SELECT image_id, SUM(old) AS n_reference, SUM(new) AS n_rules, "
+            "SUM(new AND NOT old) AS added, SUM(old AND NOT new) AS removed "
+            "FROM (SELECT b.image_id, ({}) IS 1 AS old, ({}) IS 1 AS new "
+            "FROM bubbles AS b INDEXED BY bubbles_image{}) "
+            "GROUP BY image_id HAVING added + removed > 0) "
+            "JOIN images USING (image_id) ORDER BY name".format(
+                reference_condition, condition, images),
+            reference_parameters + parameters).fetchall()
+        return pd.DataFrame.from_records(
+            rows, columns=["image", "n_reference", "n_rules", "added",
+                           "removed"], index="image")
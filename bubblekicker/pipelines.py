@@ -4,8 +4,11 @@ from bubblekicker import BubbleKicker
 
 class CannyPipeline(BubbleKicker):
 
-    def __init__(self, filename, channel='red'):
-        super(CannyPipeline, self).__init__(filename, channel=channel)
+    def __init__(self, filename, channel='red', read_mode='color',
+                 cache=None):
+        super(CannyPipeline, self).__init__(filename, channel=channel,
+                                            read_mode=read_mode,
+                                            cache=cache)
 
     def run(self, threshold, dilate_footprint, border_buffer_size,
             border_bgval, erode_footprint):
@@ -33,20 +36,31 @@ class CannyPipeline(BubbleKicker):
 		at the edge of your object. The bigger it is the more pixels will be eroded 
 		from the edge of the bubble."""
 
-        self.edge_detect_canny_opencv(threshold)
-        self.dilate_opencv(dilate_footprint)
-        self.fill_holes_opencv()
-        self.clear_border_skimage(border_buffer_size, border_bgval)
-        self.erode_opencv(erode_footprint)
+        return self.apply_steps(self.steps(threshold, dilate_footprint,
+                                           border_buffer_size, border_bgval,
+                                           erode_footprint))
 
-        return self.current_image
+    @staticmethod
+    def steps(threshold, dilate_footprint, border_buffer_size,
+              border_bgval, erode_footprint):
+        """sequence of (method name, parameters) of the pipeline, taking the
+        same arguments as the run method"""
+        return [('edge_detect_canny_opencv', {'threshold': threshold}),
+                ('dilate_opencv', {'footprintsize': dilate_footprint}),
+                ('fill_holes_opencv', {}),
+                ('clear_border_skimage', {'buffer_size': border_buffer_size,
+                                          'bgval': border_bgval}),
+                ('erode_opencv', {'footprintsize': erode_footprint})]
 
 
 class AdaptiveThresholdPipeline(BubbleKicker):
 
-    def __init__(self, filename, channel='red'):
+    def __init__(self, filename, channel='red', read_mode='color',
+                 cache=None):
         super(AdaptiveThresholdPipeline, self).__init__(filename,
-                                                        channel=channel)
+                                                        channel=channel,
+                                                        read_mode=read_mode,
+                                                        cache=cache)
 
     def run(self, blocksize, cvalue, dilate_footprint, border_buffer_size,
             border_bgval, erode_footprint):
@@ -78,10 +92,20 @@ class AdaptiveThresholdPipeline(BubbleKicker):
 		at the edge of your object. The bigger it is the more pixels will be eroded 
 		from the edge of the bubble."""
 
-        self.adaptive_threshold_opencv(blocksize, cvalue)
-	self.dilate_opencv(dilate_footprint)
-	self.fill_holes_opencv()
-        self.clear_border_skimage(border_buffer_size, border_bgval)
-        self.erode_opencv(erode_footprint)
+        return self.apply_steps(self.steps(blocksize, cvalue,
+                                           dilate_footprint,
+                                           border_buffer_size, border_bgval,
+                                           erode_footprint))
 
-        return self.current_image
+    @staticmethod
+    def steps(blocksize, cvalue, dilate_footprint, border_buffer_size,
+              border_bgval, erode_footprint):
+        """sequence of (method name, parameters) of the pipeline, taking the
+        same arguments as the run method"""
+        return [('adaptive_threshold_opencv', {'blocksize': blocksize,
+                                               'cvalue': cvalue}),
+                ('dilate_opencv', {'footprintsize': dilate_footprint}),
+                ('fill_holes_opencv', {}),
+                ('clear_border_skimage', {'buffer_size': border_buffer_size,
+                                          'bgval': border_bgval}),
+                ('erode_opencv', {'footprintsize': erode_footprint})]
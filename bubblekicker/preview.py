@@ -0,0 +1,273 @@
+"""
+Fast preview of processing steps on a downscaled image pyramid level
+
+For interactive tuning, the steps are run on the image reduced by a factor
+2 ** level with cv.pyrDown, which takes a fraction (about 1 / 4 ** level) of
+the full resolution time. The size parameters of the steps (footprints,
+blocksize, border buffer, Gaussian sigma) are divided by the same factor,
+while the full resolution steps are kept to apply the confirmed sequence
+on the original image afterwards.
+
+The bubble properties of the preview are converted to full resolution
+pixel units. Their expected error is dominated by the pixel size of the
+preview: the bubble edges are located within about half a preview pixel,
+so diameters are known within about one preview pixel (the factor in full
+resolution pixels) and bubbles smaller than a few preview pixels are
+distorted or missed. The Canny thresholds apply to intensity gradients per
+pixel and are not scaled.
+"""
+
+import inspect
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import cv2 as cv
+
+from bubblekicker import (BubbleKicker, DEFAULT_FILTERS,
+                          _bubble_properties_table, _bubble_properties_filter,
+                          bubble_properties_summary)
+
+# diameter in preview pixels below which bubbles are unreliable
+PREVIEW_MIN_DIAMETER = 3
+
+
+def _scale_size(value, factor, minimum=1):
+    """scale a size in pixels, rounding half up"""
+    return max(minimum, int(np.floor(value / float(factor) + 0.5)))
+
+
+def _scale_blocksize(value, factor):
+    """scale an adaptive threshold blocksize, keeping it odd and >= 3"""
+    return max(3, _scale_size(value, factor) // 2 * 2 + 1)
+
+
+def _scale_footprint(value, factor):
+    """scale a dilation/erosion footprint, keeping footprints of 2 or more
+    at least 2 so the dilation still closes the 1 pixel edge gaps"""
+    return _scale_size(value, factor, min(value, 2))
+
+
+def _scale_buffer(value, factor):
+    """scale a border buffer, keeping a non-zero buffer non-zero"""
+    return _scale_size(value, factor, 1 if value > 0 else 0)
+
+
+# scaling of the size parameters of the steps for a reduction factor
+PREVIEW_SCALED_PARAMS = {
+    'edge_detect_canny_skimage': {'sigma': lambda value, factor:
+                                  value / float(factor)},
+    'adaptive_threshold_opencv': {'blocksize': _scale_blocksize},
+    'dilate_opencv': {'footprintsize': _scale_footprint},
+    'erode_opencv': {'footprintsize': _scale_footprint},
+    'clear_border_skimage': {'buffer_size': _scale_buffer},
+}
+
+# property columns with a length (1) or area (2) dimension
+PROPERTY_DIMENSIONS = {'equivalent_diameter': 1, 'perimeter': 1,
+                       'area': 2, 'convex_area': 2}
+
+
+def pyramid_level(image, level):
+    """reduce an image by a factor 2 ** level with Gaussian pyramid steps"""
+    image = np.ascontiguousarray(image)
+    for _ in range(level):
+        image = cv.pyrDown(image)
+    return image
+
+
+def scale_steps(steps, factor):
+    """
+    Scale the size parameters of a sequence of steps for an image reduced
+    by the given factor
+
+    :param steps: list of (method name, parameters) tuples at full
+        resolution
+    :param factor: reduction factor of the image, e.g. 4
+    :return: list of (method name, parameters) tuples
+    """
+    if factor == 1:
+        # the full resolution runs the steps as given, e.g. an invalid even
+        # blocksize is not made odd
+        return [(name, BubbleKicker.step_parameters(name, params))
+                for name, params in steps]
+    scaled = []
+    for name, params in steps:
+        params = BubbleKicker.step_parameters(name, params)
+        for param, scale in PREVIEW_SCALED_PARAMS.get(name, {}).items():
+            params[param] = scale(params[param], factor)
+        scaled.append((name, params))
+    return scaled
+
+
+def _full_resolution_table(property_table, factor):
+    """convert a property table of a preview to full resolution units"""
+    table = property_table.copy()
+    for column, dimension in PROPERTY_DIMENSIONS.items():
+        table[column] = table[column] * factor ** dimension
+    table["centroid"] = [(row * factor, col * factor)
+                         for row, col in table["centroid"]]
+    return table
+
+
+class PreviewKicker(object):
+    """
+    Run the processing steps of a BubbleKicker on a pyramid level of its
+    raw image
+
+    The step methods of BubbleKicker are available with their full
+    resolution parameters, e.g. preview.dilate_opencv(footprintsize=9), and
+    are recorded in steps. Once the preview looks right, apply_full_resolution
+    runs the recorded steps on the original BubbleKicker.
+    """
+
+    def __init__(self, bubbler, level=2):
+        """
+        :param bubbler: BubbleKicker (or pipeline) object to preview
+        :param level: pyramid level, the image is reduced by 2 ** level
+        """
+        self.bubbler = bubbler
+        self.level = level
+        self.factor = 2 ** level
+        self.preview = BubbleKicker.from_array(
+            pyramid_level(bubbler.raw_image, level))
+        self.steps = []
+
+    def __getattr__(self, name):
+        step = getattr(BubbleKicker, name, None)
+        if step is None or not hasattr(step, '__wrapped__'):
+            raise AttributeError("'PreviewKicker' object has no "
+                                 "attribute '{}'".format(name))
+
+        def preview_step(*args, **kwargs):
+            params = inspect.getcallargs(step.__wrapped__, None, *args,
+                                         **kwargs)
+            params.pop('self')
+            return self.apply_steps([(name, params)])
+        preview_step.__name__ = name
+        preview_step.__doc__ = step.__doc__
+        return preview_step
+
+    @property
+    def current_image(self):
+        """current image of the preview"""
+        return self.preview.current_image
+
+    def apply_steps(self, steps):
+        """
+        Apply a sequence of steps with full resolution parameters on the
+        preview image
+
+        :param steps: list of (method name, parameters) tuples
+        :return: the resulting preview image
+        """
+        steps = [(name, BubbleKicker.step_parameters(name, params))
+                 for name, params in steps]
+        self.preview.apply_steps(scale_steps(steps, self.factor))
+        self.steps.extend(steps)
+        return self.preview.current_image
+
+    def reset_to_raw(self):
+        """make the preview image again the reduced raw image"""
+        self.preview.reset_to_raw()
+        self.steps = []
+
+    def what_have_i_done(self):
+        """print the full resolution steps and their preview logs"""
+        print("Steps undertaken since from raw image "
+              "(preview at 1/{}):".format(self.factor))
+        for (name, params), message in zip(self.steps, self.preview.logs.log):
+            print("{}({}) -> {}".format(
+                name, ", ".join("{}={}".format(key, value)
+                                for key, value in sorted(params.items())),
+                message))
+        print("\n")
+
+    def plot(self):
+        """plot the current preview image"""
+        return self.preview.plot()
+
+    def apply_full_resolution(self):
+        """apply the recorded steps on the full resolution raw image of the
+        previewed BubbleKicker, as the steps were recorded from the raw image
+
+        :return: the resulting full resolution image
+        """
+        self.bubbler.reset_to_raw()
+        return self.bubbler.apply_steps(self.steps)
+
+    def footprint_error(self):
+        """
+        Diameter change in full resolution pixels of the rounded dilation
+        and erosion footprints of the preview
+
+        A footprint f grows or shrinks the bubbles by f - 1 pixels in
+        diameter, the scaled preview footprint by (f_preview - 1) * factor
+        full resolution pixels.
+        """
+        error = 0
+        for name, params in self.steps:
+            if name in ('dilate_opencv', 'erode_opencv'):
+                full = params['footprintsize']
+                scaled = _scale_footprint(full, self.factor)
+                error += abs((scaled - 1) * self.factor - (full - 1))
+        return error
+
+    def bubble_properties(self, rules=DEFAULT_FILTERS, engine='opencv'):
+        """
+        Bubble properties of the current preview image, in full resolution
+        pixel units
+
+        The rules are applied on the converted properties, so size rules
+        are given in full resolution pixels.
+
+        :return: property table
+        """
+        _, id_image, property_table = _bubble_properties_table(
+            self.preview.current_image, engine=engine,
+            labels=self.preview.pop_labels())
+        property_table = _full_resolution_table(property_table, self.factor)
+        _, property_table = _bubble_properties_filter(property_table,
+                                                      id_image, rules)
+        return property_table
+
+    def bubble_statistics(self, which_property="equivalent_diameter",
+                          rules=DEFAULT_FILTERS, engine='opencv',
+                          percentiles=(10, 50, 90)):
+        """
+        Summary of a bubble property of the preview with the expected error
+        of each statistic relative to full resolution
+
+        The expected error of a diameter (or perimeter) is one preview
+        pixel, i.e. the reduction factor in full resolution pixels, plus
+        the diameter change of the rounded footprints (see
+        footprint_error), and of an area pi / 2 * diameter times the
+        diameter error. For the count, the expected error is the number of
+        bubbles smaller than PREVIEW_MIN_DIAMETER preview pixels, which
+        may be missed or merged at full resolution (bubbles missed by the
+        preview altogether are not included).
+
+        :param which_property: property to summarize
+        :param rules: filter rules, in full resolution units
+        :param engine: regionprops | opencv, property extraction engine
+        :param percentiles: percentiles of the distribution to include
+        :return: DataFrame with the preview value and expected error of
+            each statistic (see bubble_properties_summary)
+        """
+        property_table = self.bubble_properties(rules, engine)
+        summary = bubble_properties_summary(property_table, which_property,
+                                            percentiles)
+        diameter_error = float(self.factor + self.footprint_error())
+        dimension = PROPERTY_DIMENSIONS.get(which_property, 0)
+        if dimension == 1:
+            errors = pd.Series(diameter_error, index=summary.index)
+        elif dimension == 2:
+            diameters = np.sqrt(4 * summary.abs() / np.pi)
+            errors = np.pi / 2 * diameters * diameter_error
+        else:
+            errors = pd.Series(np.nan, index=summary.index)
+        small = (property_table["equivalent_diameter"] <
+                 PREVIEW_MIN_DIAMETER * self.factor).sum()
+        errors["count"] = small
+        return pd.DataFrame(OrderedDict([("preview", summary),
+                                         ("expected_error", errors)]))
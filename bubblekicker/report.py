@@ -0,0 +1,247 @@
+"""
+Headless rendering of the size distributions of many images or groups
+
+The histograms of all groups are calculated once with numpy against bin
+edges shared by all groups. They are written as a plot-free CSV or JSON
+table and rendered to PNG/SVG files by worker processes, which each reuse
+a single Agg figure for all their plots (no pyplot figure management nor
+GUI backend involved).
+"""
+
+import json
+import os
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+import pandas as pd
+
+from bubblekicker import _distribution_axes
+
+REPORT_FORMATS = ['png', 'svg']
+TABLE_FORMATS = ['csv', 'json']
+
+# renderer of a report worker process
+_RENDERER = None
+
+
+def _property_values(property_table, which_property):
+    """non-missing values of a bubble property"""
+    values = np.asarray(property_table[which_property], dtype=np.double)
+    return values[~np.isnan(values)]
+
+
+def shared_bin_edges(tables, which_property="equivalent_diameter",
+                     bins=20):
+    """
+    Bin edges covering the property values of all property tables
+
+    :param tables: iterable of property tables
+    :param which_property: bubble property
+    :param bins: number of bins, or the bin edges themselves
+    :return: array of bin edges
+    """
+    if np.ndim(bins) == 1:
+        return np.asarray(bins, dtype=np.double)
+    low, high = np.inf, -np.inf
+    for table in tables:
+        values = _property_values(table, which_property)
+        if len(values):
+            low, high = min(low, values.min()), max(high, values.max())
+    if low > high:
+        low, high = 0., 1.
+    elif low == high:
+        low, high = low - 0.5, high + 0.5
+    return np.linspace(low, high, bins + 1)
+
+
+def _group_items(groups):
+    """(name, property table) tuples of a dictionary or sequence"""
+    items = groups.items() if hasattr(groups, 'items') else groups
+    return [(str(name), table) for name, table in items]
+
+
+def binned_distributions(groups, properties=("equivalent_diameter", "area"),
+                         bins=20):
+    """
+    Histogram of each property of each group against shared bin edges
+
+    :param groups: dictionary or sequence of (name, property table) tuples,
+        e.g. the property tables of the images of a batch run
+    :param properties: bubble properties to bin
+    :param bins: number of bins or bin edges, the same for all groups
+    :return: DataFrame with the group, property, bin_left, bin_right,
+        count and cumulative fraction of each bin
+    """
+    groups = _group_items(groups)
+    records = []
+    for which_property in properties:
+        edges = shared_bin_edges((table for _, table in groups),
+                                 which_property, bins)
+        for name, table in groups:
+            counts, _ = np.histogram(_property_values(table,
+                                                      which_property), edges)
+            cumulative = np.cumsum(counts) / float(max(counts.sum(), 1))
+            records.append(pd.DataFrame(OrderedDict(
+                [("group", name), ("property", which_property),
+                 ("bin_left", edges[:-1]), ("bin_right", edges[1:]),
+                 ("count", counts), ("cumulative", cumulative)])))
+    if not records:
+        return pd.DataFrame(columns=["group", "property", "bin_left",
+                                     "bin_right", "count", "cumulative"])
+    return pd.concat(records, ignore_index=True)
+
+
+class DistributionRenderer(object):
+    """
+    Render distribution plots, as bubble_properties_plot, on a single
+    reused Agg figure
+
+    As long as the property and bin edges stay the same, only the bar
+    heights and the cumulative line are updated between the renders.
+    """
+
+    def __init__(self, figsize=(6.4, 4.8), dpi=100):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self._layout = None
+        self._artists = None
+
+    def render(self, counts, edges, which_property, filenames, title=None):
+        """
+        Draw a histogram and save it
+
+        :param counts: histogram counts
+        :param edges: bin edges of the counts
+        :param which_property: bubble property, the x axis label
+        :param filenames: file name or list of file names, the format
+            follows from the extension (e.g. png, svg)
+        :param title: title of the plot
+        """
+        counts = np.asarray(counts)
+        edges = np.asarray(edges, dtype=np.double)
+        layout = (which_property, tuple(edges))
+        if layout != self._layout:
+            self.figure.clf()
+            ax1 = self.figure.add_subplot(111)
+            self._artists = _distribution_axes(ax1, counts, edges,
+                                               which_property, edges[-1])
+            self._layout = layout
+        else:
+            ax1, _, bars, line = self._artists
+            for bar, count in zip(bars, counts):
+                bar.set_height(count)
+            cumulative = np.cumsum(counts) / float(max(counts.sum(), 1))
+            line.set_ydata(np.r_[0., cumulative])
+            ax1.relim()
+            ax1.autoscale_view(scalex=False)
+        self._artists[0].set_title(title or '')
+
+        if not isinstance(filenames, (list, tuple)):
+            filenames = [filenames]
+        for filename in filenames:
+            self.figure.savefig(filename)
+
+
+def _report_init(figsize, dpi):
+    """initialize the renderer of a report worker process"""
+    from matplotlib import font_manager
+
+    global _RENDERER
+    # font files opened by the parent process share their file position
+    # with the forked workers, so the workers open their own
+    cached_fonts = getattr(font_manager, '_get_font', None)
+    if hasattr(cached_fonts, 'cache_clear'):
+        cached_fonts.cache_clear()
+    _RENDERER = DistributionRenderer(figsize, dpi)
+
+
+def _render_task(task):
+    """render a single plot with the renderer of the worker process"""
+    _RENDERER.render(*task)
+    return task[3]
+
+
+def write_report(groups, directory, properties=("equivalent_diameter",
+                                                "area"),
+                 bins=20, formats=('png',), table_format='csv',
+                 workers=None, figsize=(6.4, 4.8), dpi=100):
+    """
+    Write the size distribution report of many groups
+
+    For each group and property a plot {group}_{property}.{format} is
+    written, together with the binned distributions of all groups in a
+    single distributions.csv or distributions.json file.
+
+    :param groups: dictionary or sequence of (name, property table) tuples
+    :param directory: output folder, created if needed
+    :param properties: bubble properties to report
+    :param bins: number of bins or bin edges, shared by all groups
+    :param formats: plot formats (png | svg), empty for no plots
+    :param table_format: csv | json | None, file format of the binned
+        distributions
+    :param workers: number of worker processes rendering the plots, None
+        uses all cores and 1 renders in the current process
+    :param figsize: figure size in inches
+    :param dpi: resolution of the png plots
+    :return: DataFrame with the binned distributions
+    """
+    for plot_format in formats:
+        if plot_format not in REPORT_FORMATS:
+            raise ValueError("Not a valid plot format, use one "
+                             "of {}".format(", ".join(REPORT_FORMATS)))
+    if table_format is not None and table_format not in TABLE_FORMATS:
+        raise ValueError("Not a valid table format, use one "
+                         "of {}".format(", ".join(TABLE_FORMATS)))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    distributions = binned_distributions(groups, properties, bins)
+    if table_format == 'csv':
+        distributions.to_csv(os.path.join(directory, "distributions.csv"),
+                             index=False)
+    elif table_format == 'json':
+        nested = OrderedDict()
+        for (name, which_property), rows in distributions.groupby(
+                ["group", "property"], sort=False):
+            nested.setdefault(name, OrderedDict())[which_property] = {
+                "edges": rows["bin_left"].tolist() +
+                rows["bin_right"].values[-1:].tolist(),
+                "counts": rows["count"].tolist()}
+        with open(os.path.join(directory, "distributions.json"),
+                  "w") as json_file:
+            json.dump(nested, json_file)
+
+    if not formats:
+        return distributions
+
+    tasks = []
+    for (name, which_property), rows in distributions.groupby(
+            ["group", "property"], sort=False):
+        edges = np.r_[rows["bin_left"].values, rows["bin_right"].values[-1]]
+        filenames = [os.path.join(directory, "{}_{}.{}".format(
+            name, which_property, plot_format)) for plot_format in formats]
+        tasks.append((rows["count"].values, edges, which_property,
+                      filenames, name))
+
+    if workers == 1:
+        renderer = DistributionRenderer(figsize, dpi)
+        for task in tasks:
+            renderer.render(*task)
+        return distributions
+
+    pool = Pool(processes=workers, initializer=_report_init,
+                initargs=(figsize, dpi))
+    try:
+        # larger chunks keep the plots of a property on the same worker
+        chunksize = max(1, len(tasks) // (4 * (workers or cpu_count())))
+        for _ in pool.imap(_render_task, tasks, chunksize):
+            pass
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return distributions
@@ -0,0 +1,155 @@
+"""
+Compact per-bubble representation of a label image
+
+A label image is mostly background when the bubbles are few or small.
+SparseLabels keeps, for each bubble, its bounding box and its mask cropped
+to the box and bit-packed (1 bit per pixel), all bubbles in a few flat
+arrays. A single bubble is unpacked from its own slice of the bits, and
+the full label image is only rasterized on demand.
+"""
+
+import numpy as np
+import cv2 as cv
+
+
+def _label_boxes(id_image, labels):
+    """(row, col, rows, cols) bounding box of each of the sorted labels of
+    a label image"""
+    if len(labels) == 0:
+        return np.zeros((0, 4), np.int64)
+    lut = np.zeros(max(int(id_image.max()), int(labels[-1])) + 1, bool)
+    lut[labels] = True
+    rows, cols = np.nonzero(lut[id_image])
+    values = id_image[rows, cols]
+    order = np.argsort(values, kind='mergesort')
+    rows, cols, values = rows[order], cols[order], values[order]
+    starts = np.searchsorted(values, labels)
+    if np.any(np.r_[starts[1:], len(values)] <= starts):
+        raise ValueError("Not all labels are present in the label image")
+    return np.c_[np.minimum.reduceat(rows, starts),
+                 np.minimum.reduceat(cols, starts),
+                 np.maximum.reduceat(rows, starts) -
+                 np.minimum.reduceat(rows, starts) + 1,
+                 np.maximum.reduceat(cols, starts) -
+                 np.minimum.reduceat(cols, starts) + 1]
+
+
+class SparseLabels(object):
+    """
+    Bubbles of a label image as bounding boxes with bit-packed masks
+    """
+
+    def __init__(self, shape, labels, boxes, offsets, bits):
+        """
+        :param shape: (rows, columns) of the label image
+        :param labels: sorted labels of the bubbles
+        :param boxes: Nx4 array with the (row, col, rows, cols) bounding box
+            of each bubble
+        :param offsets: N + 1 offsets of the packed mask of each bubble in
+            bytes
+        :param bits: bit-packed masks of all bubbles
+        """
+        self.shape = tuple(int(size) for size in shape)
+        self.labels = np.asarray(labels)
+        self.boxes = np.asarray(boxes).reshape(-1, 4)
+        self.offsets = np.asarray(offsets)
+        self.bits = np.asarray(bits, dtype=np.uint8)
+
+    @classmethod
+    def from_label_image(cls, id_image, labels=None, stats=None):
+        """
+        Convert a label image
+
+        :param id_image: MxN label image, 0 is background
+        :param labels: labels of the bubbles to keep, by default all
+            non-zero labels of the image
+        :param stats: statistics of cv.connectedComponentsWithStats of the
+            label image, indexed by label, to take the bounding boxes from
+            instead of deriving them from the label image
+        """
+        if labels is None:
+            labels = np.unique(id_image)
+            labels = labels[labels > 0]
+        labels = np.sort(np.asarray(labels, dtype=np.int64))
+        if stats is not None:
+            stats = np.asarray(stats)[labels]
+            boxes = np.c_[stats[:, cv.CC_STAT_TOP],
+                          stats[:, cv.CC_STAT_LEFT],
+                          stats[:, cv.CC_STAT_HEIGHT],
+                          stats[:, cv.CC_STAT_WIDTH]]
+        else:
+            boxes = _label_boxes(id_image, labels)
+
+        offsets = np.zeros(len(labels) + 1, np.int64)
+        masks = []
+        for index, (label, (row, col, rows, cols)) in enumerate(
+                zip(labels, boxes)):
+            mask = np.packbits(id_image[row:row + rows,
+                                        col:col + cols] == label)
+            masks.append(mask)
+            offsets[index + 1] = offsets[index] + len(mask)
+        bits = (np.concatenate(masks) if masks
+                else np.zeros(0, np.uint8))
+        return cls(id_image.shape, labels, boxes, offsets, bits)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, label):
+        index = np.searchsorted(self.labels, label)
+        return index < len(self.labels) and self.labels[index] == label
+
+    @property
+    def nbytes(self):
+        """memory used by the arrays in bytes"""
+        return (self.labels.nbytes + self.boxes.nbytes +
+                self.offsets.nbytes + self.bits.nbytes)
+
+    def _index(self, label):
+        index = np.searchsorted(self.labels, label)
+        if index >= len(self.labels) or self.labels[index] != label:
+            raise KeyError("No bubble with label {}".format(label))
+        return index
+
+    def bbox(self, label):
+        """(row, col, rows, cols) bounding box of a bubble"""
+        return tuple(int(value) for value in self.boxes[self._index(label)])
+
+    def _mask(self, index):
+        rows, cols = self.boxes[index, 2:]
+        bits = self.bits[self.offsets[index]:self.offsets[index + 1]]
+        return np.unpackbits(bits)[:rows * cols].reshape(rows,
+                                                         cols).astype(bool)
+
+    def mask(self, label):
+        """boolean mask of a bubble cropped to its bounding box"""
+        return self._mask(self._index(label))
+
+    def area(self):
+        """number of pixels of each bubble, in the order of labels"""
+        counts = np.unpackbits(self.bits)
+        areas = np.zeros(len(self.labels), np.int64)
+        for index, (rows, cols) in enumerate(self.boxes[:, 2:]):
+            start = self.offsets[index] * 8
+            areas[index] = counts[start:start + rows * cols].sum()
+        return areas
+
+    def rasterize(self, dtype=np.int32):
+        """full label image of the bubbles"""
+        id_image = np.zeros(self.shape, dtype)
+        for index, (row, col, rows, cols) in enumerate(self.boxes):
+            region = id_image[row:row + rows, col:col + cols]
+            region[self._mask(index)] = self.labels[index]
+        return id_image
+
+    def to_arrays(self):
+        """dictionary of arrays, e.g. to store with numpy.savez"""
+        return {'shape': np.array(self.shape), 'labels': self.labels,
+                'boxes': self.boxes, 'offsets': self.offsets,
+                'bits': self.bits}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """restore from the arrays of to_arrays"""
+        return cls(arrays['shape'], arrays['labels'], arrays['boxes'],
+                   arrays['offsets'], arrays['bits'])
@@ -0,0 +1,231 @@
+"""
+Compact on-disk storage of batch results
+
+Each image of a campaign is stored in its own compressed npz file, so the
+bubbles of a single image are read back without loading the campaign:
+
+* the property table as one array per column (the centroid tuples are
+  split in a row and column array);
+* the binary image bit-packed on its few distinct values;
+* optionally the label image of the filtered bubbles, as the bounding
+  boxes and bit-packed masks of SparseLabels;
+* the pipeline, its arguments and the Logger step history as JSON
+  metadata.
+"""
+
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from bubblekicker import DEFAULT_FILTERS, bubble_properties_calculate
+from sparse import SparseLabels
+
+STORE_EXTENSION = '.npz'
+
+
+def _value_bits(nvalues):
+    """number of bits needed to index the given number of values"""
+    return max(1, int(np.ceil(np.log2(max(nvalues, 1)))))
+
+
+def pack_binary(image):
+    """bit-pack an image with a few distinct values
+
+    A pipeline output contains the bubble and background values, and the
+    value 0 where clear_border keeps the unlabeled pixels, so 1 or 2 bits
+    per pixel are stored instead of 8.
+
+    :return: dictionary with the packed bits, shape and the values
+    """
+    values, index = np.unique(image, return_inverse=True)
+    nbits = _value_bits(len(values))
+    planes = [(index >> bit) & 1 for bit in range(nbits)]
+    return {'bits': np.packbits(np.concatenate(planes).astype(np.uint8)),
+            'shape': np.array(image.shape), 'values': values}
+
+
+def unpack_binary(bits, shape, values):
+    """restore a bit-packed image (see pack_binary)"""
+    size = int(np.prod(shape))
+    nbits = _value_bits(len(values))
+    planes = np.unpackbits(bits)[:nbits * size].reshape(nbits, size)
+    index = np.zeros(size, dtype=np.intp)
+    for bit in range(nbits):
+        index |= planes[bit].astype(np.intp) << bit
+    return values[index].reshape(tuple(shape))
+
+
+def replace_file(source, destination):
+    """rename a file, replacing an existing destination (os.rename does not
+    replace it on Windows and Python 2 has no os.replace)"""
+    if os.name != 'nt':
+        os.rename(source, destination)
+        return
+    import ctypes
+    # MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH
+    if not ctypes.windll.kernel32.MoveFileExW(unicode(source),
+                                              unicode(destination), 0x9):
+        raise ctypes.WinError()
+
+
+class ResultStore(object):
+    """
+    Directory with the stored results of the images of a campaign
+    """
+
+    def __init__(self, directory, rules=DEFAULT_FILTERS, engine='opencv',
+                 labels=False):
+        """
+        :param directory: folder of the stored results, created if needed
+        :param rules: filter rules used to derive the stored property tables
+        :param engine: regionprops | opencv, property extraction engine
+        :param labels: also store the label image of the filtered bubbles
+        """
+        self.directory = directory
+        self.rules = rules
+        self.engine = engine
+        self.labels = labels
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, name):
+        """file of the stored result of an image, keyed by its file name"""
+        return os.path.join(self.directory,
+                            os.path.basename(name) + STORE_EXTENSION)
+
+    def check_names(self, paths):
+        """
+        Check the results of the given images are stored under distinct
+        names, as images of different folders with the same file name would
+        overwrite each other's result
+
+        :param paths: image file paths
+        :raise ValueError: when two paths have the same file name
+        """
+        seen = {}
+        for path in paths:
+            other = seen.setdefault(os.path.basename(path), path)
+            if other != path:
+                raise ValueError("The images {} and {} would both be stored "
+                                 "as {}, rename one of them or use separate "
+                                 "stores".format(other, path,
+                                                 os.path.basename(path)))
+
+    def names(self):
+        """sorted names of the stored images"""
+        return sorted(os.path.basename(path)[:-len(STORE_EXTENSION)]
+                      for path in glob.glob(os.path.join(
+                          self.directory, '*' + STORE_EXTENSION)))
+
+    def __contains__(self, name):
+        return os.path.exists(self._path(name))
+
+    def write(self, name, binary_image, metadata=None, labels=None,
+              property_table=None, sparse_labels=None):
+        """
+        Store the result of an image
+
+        :param name: name of the image (e.g. the image file name)
+        :param binary_image: output binary image of a pipeline
+        :param metadata: dictionary with JSON-serializable information,
+            e.g. the pipeline arguments and the Logger step history
+        :param labels: labels of the binary image handed over by the
+            pipeline (see BubbleKicker.pop_labels)
+        :param property_table: property table of the binary image already
+            calculated with the rules and engine of the store (e.g. read
+            from a ResultCache), which is then not calculated again
+        :param sparse_labels: SparseLabels of the property table, needed
+            to skip the calculation when the store keeps the labels
+        :return: the property table of the image
+        """
+        if property_table is not None and (not self.labels or
+                                           sparse_labels is not None):
+            id_image = sparse_labels
+        else:
+            id_image, property_table = bubble_properties_calculate(
+                binary_image, rules=self.rules, engine=self.engine,
+                sparse=self.labels, labels=labels)
+
+        metadata = dict(metadata or {})
+        metadata.update({'rules': self.rules, 'engine': self.engine,
+                         'columns': list(property_table.columns)})
+        arrays = {'metadata': np.array(json.dumps(metadata)),
+                  'table_label': property_table.index.values}
+        for column in property_table.columns:
+            values = property_table[column].values
+            if column == 'centroid':
+                centroids = np.array(values.tolist(),
+                                     dtype=np.double).reshape(-1, 2)
+                arrays['table_centroid_row'] = centroids[:, 0]
+                arrays['table_centroid_col'] = centroids[:, 1]
+            else:
+                arrays['table_' + column] = values
+        for key, value in pack_binary(binary_image).items():
+            arrays['binary_' + key] = value
+        if self.labels:
+            for key, value in id_image.to_arrays().items():
+                arrays['labels_' + key] = value
+
+        # write to a temporary file first, so an interrupted write never
+        # leaves a truncated result
+        path = self._path(name)
+        with open(path + '.tmp', 'wb') as store_file:
+            np.savez_compressed(store_file, **arrays)
+        replace_file(path + '.tmp', path)
+        return property_table
+
+    def _load(self, name):
+        """lazy npz file of a stored image"""
+        path = self._path(name)
+        if not os.path.exists(path):
+            raise KeyError("No result stored for {}".format(name))
+        return np.load(path)
+
+    def read_metadata(self, name):
+        """metadata of a stored image"""
+        with self._load(name) as stored:
+            return json.loads(stored['metadata'].item())
+
+    def read_table(self, name):
+        """property table of a stored image"""
+        with self._load(name) as stored:
+            metadata = json.loads(stored['metadata'].item())
+            columns = {}
+            for column in metadata['columns']:
+                if column == 'centroid':
+                    columns[column] = list(zip(
+                        stored['table_centroid_row'].tolist(),
+                        stored['table_centroid_col'].tolist()))
+                else:
+                    columns[column] = stored['table_' + column]
+            index = pd.Index(stored['table_label'], name='label')
+        return pd.DataFrame(columns, index=index,
+                            columns=metadata['columns'])
+
+    def read_binary(self, name):
+        """binary image of a stored image"""
+        with self._load(name) as stored:
+            return unpack_binary(stored['binary_bits'],
+                                 stored['binary_shape'],
+                                 stored['binary_values'])
+
+    def read_sparse_labels(self, name):
+        """SparseLabels of the bubbles of a stored image, when stored"""
+        with self._load(name) as stored:
+            if 'labels_bits' not in stored.files:
+                raise KeyError("No label image stored for {}".format(name))
+            return SparseLabels.from_arrays(
+                dict((key, stored['labels_' + key]) for key in
+                     ['shape', 'labels', 'boxes', 'offsets', 'bits']))
+
+    def read_labels(self, name):
+        """label image of a stored image, when stored"""
+        return self.read_sparse_labels(name).rasterize()
+
+    def iter_tables(self):
+        """generate the (name, property table) of all stored images"""
+        for name in self.names():
+            yield name, self.read_table(name)
@@ -0,0 +1,165 @@
+
+import glob
+import re
+import threading
+import traceback
+
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:
+    from queue import Queue, Empty, Full
+
+import cv2 as cv
+
+from bubblekicker import (DEFAULT_FILTERS, BatchFailure,
+                          bubble_properties_calculate)
+
+# time (in seconds) between checks for a stopped stream in blocking calls
+_POLL_INTERVAL = 0.1
+
+
+def _natural_key(filename):
+    """sort key handling frame numbers without leading zeros"""
+    return [int(part) if part.isdigit() else part
+            for part in re.split(r'(\d+)', filename)]
+
+
+def read_frames(source):
+    """
+    Generate the frames of a video file or an image sequence
+
+    :param source: video file name (anything cv.VideoCapture can open), a
+        glob pattern of image files (e.g. 'frames/img_*.png') or a list of
+        image file names
+    :return: generator of (frame index, MxNx3 frame) tuples
+    """
+    if isinstance(source, (list, tuple)) or glob.has_magic(source):
+        filenames = (source if isinstance(source, (list, tuple))
+                     else sorted(glob.glob(source), key=_natural_key))
+        for index, filename in enumerate(filenames):
+            frame = cv.imread(filename)
+            if frame is None:
+                raise IOError("Could not read image file "
+                              "{}".format(filename))
+            yield index, frame
+        return
+
+    capture = cv.VideoCapture(source)
+    if not capture.isOpened():
+        raise IOError("Could not open video {}".format(source))
+    try:
+        index = 0
+        while True:
+            grabbed, frame = capture.read()
+            if not grabbed:
+                break
+            yield index, frame
+            index += 1
+    finally:
+        capture.release()
+
+
+def _put(queue, item, stop):
+    """put an item on a bounded queue unless the stream is stopped"""
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=_POLL_INTERVAL)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def _decode(source, frames, workers, stop):
+    """decoding thread: read the frames into the bounded frame queue"""
+    try:
+        for frame in read_frames(source):
+            if not _put(frames, frame, stop):
+                return
+    except Exception as err:
+        _put(frames, err, stop)
+    for _ in range(workers):
+        _put(frames, None, stop)
+
+
+def _process(frames, results, pipeline, args, channel, rules, engine,
+             stop):
+    """processing thread: run the pipeline on the queued frames"""
+    while not stop.is_set():
+        try:
+            frame = frames.get(timeout=_POLL_INTERVAL)
+        except Empty:
+            continue
+        if frame is None or isinstance(frame, Exception):
+            _put(results, frame, stop)
+            return
+        index, image = frame
+        try:
+            bubbler = pipeline.from_array(image, channel=channel)
+            _, property_table = bubble_properties_calculate(
+                bubbler.run(*args), rules=rules, engine=engine,
+                labels=bubbler.pop_labels())
+        except Exception as err:
+            property_table = BatchFailure(index,
+                                          "{}: {}".format(type(err).__name__,
+                                                          err),
+                                          traceback.format_exc())
+        if not _put(results, (index, property_table), stop):
+            return
+
+
+def stream_bubble_properties(source, pipeline, args, channel='red',
+                             rules=DEFAULT_FILTERS, engine='opencv',
+                             workers=2, queue_size=8):
+    """
+    Process a video or image sequence while it is being decoded and yield
+    the bubble property table of each frame as soon as it is ready
+
+    The frames are decoded in a single thread and handed over through a
+    bounded queue to the processing threads (OpenCV releases the GIL), so
+    at most queue_size frames wait in memory and long recordings are
+    processed without extracting the frames to disk.
+
+    :param source: video file name, glob pattern of image files or list
+        of image file names (see read_frames)
+    :param pipeline: class from pipelines.py to use as processing sequence
+    :param args: sequence of arguments required by the pipeline
+    :param channel: green | red | blue
+    :param rules: filter rules applied on the detected bubbles
+    :param engine: regionprops | opencv, property extraction engine
+    :param workers: number of processing threads
+    :param queue_size: maximum number of decoded frames waiting
+    :return: generator of (frame index, property table) tuples in the
+        order the frames are finished, with a BatchFailure instead of the
+        table when processing the frame failed
+    """
+    frames = Queue(maxsize=queue_size)
+    results = Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    threads = [threading.Thread(target=_decode,
+                                args=(source, frames, workers, stop))]
+    threads += [threading.Thread(target=_process,
+                                 args=(frames, results, pipeline,
+                                       tuple(args), channel, rules, engine,
+                                       stop))
+                for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        finished = 0
+        while finished < workers:
+            result = results.get()
+            if result is None:
+                finished += 1
+            elif isinstance(result, Exception):
+                raise result
+            else:
+                yield result
+    finally:
+        # also stops the threads when the generator is closed early
+        stop.set()
+        for thread in threads:
+            thread.join()
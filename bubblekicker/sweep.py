@@ -0,0 +1,140 @@
+
+import inspect
+import itertools
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+
+import pandas as pd
+
+from bubblekicker import (DEFAULT_FILTERS, bubble_properties_calculate,
+                          bubble_properties_summary)
+from cache import StepCache
+
+# pipeline instance of a sweep worker process, loaded once per process
+_SWEEP_STATE = {}
+
+
+def pipeline_arguments(pipeline):
+    """get the names of the arguments of the run method of a pipeline"""
+    return inspect.getargspec(pipeline.run).args[1:]
+
+
+def parameter_combinations(pipeline, grid):
+    """list all parameter combinations of a grid in the argument order of
+    the pipeline run method, so combinations sharing the first steps of
+    the pipeline follow each other
+
+    :param pipeline: class from pipelines.py
+    :param grid: dictionary with for each argument of the pipeline run
+        method a list of values to try
+    :return: list of OrderedDicts with the arguments of each combination
+    """
+    arguments = pipeline_arguments(pipeline)
+    missing = [argument for argument in arguments if argument not in grid]
+    unknown = [argument for argument in grid if argument not in arguments]
+    if missing or unknown:
+        raise ValueError("The grid should provide a list of values for "
+                         "each of the pipeline arguments {} (missing: {}, "
+                         "unknown: {})".format(arguments, missing, unknown))
+    return [OrderedDict(zip(arguments, values)) for values in
+            itertools.product(*[grid[argument] for argument in arguments])]
+
+
+def _sweep_init(filename, pipeline, channel, read_mode, cache_bytes,
+                rules, engine, properties):
+    """load the image once in each sweep worker process"""
+    _SWEEP_STATE["bubbler"] = pipeline(filename, channel=channel,
+                                       read_mode=read_mode,
+                                       cache=StepCache(cache_bytes))
+    _SWEEP_STATE["settings"] = rules, engine, properties
+
+
+def _sweep_evaluate(params):
+    """run a single parameter combination on the loaded image and
+    summarize the resulting bubble size distribution"""
+    bubbler = _SWEEP_STATE["bubbler"]
+    rules, engine, properties = _SWEEP_STATE["settings"]
+
+    record = OrderedDict((name, tuple(value) if isinstance(value, list)
+                          else value) for name, value in params.items())
+    bubbler.reset_to_raw()
+    try:
+        binary_image = bubbler.run(**params)
+        _, property_table = bubble_properties_calculate(
+            binary_image, rules=rules, engine=engine,
+            labels=bubbler.pop_labels())
+    except Exception as err:
+        record["n_bubbles"] = 0
+        record["error"] = "{}: {}".format(type(err).__name__, err)
+        return record
+
+    record["n_bubbles"] = len(property_table)
+    for which_property in properties:
+        summary = bubble_properties_summary(property_table, which_property)
+        for stat, value in summary.drop("count").items():
+            record["{}_{}".format(which_property, stat)] = value
+    record["error"] = None
+    return record
+
+
+def parameter_sweep(filename, pipeline, grid, channel='red',
+                    rules=DEFAULT_FILTERS, workers=None,
+                    properties=("equivalent_diameter", "area"),
+                    engine='opencv', read_mode='channel',
+                    cache_bytes=256 * 2 ** 20):
+    """
+    Run a pipeline for all parameter combinations of a grid on an image
+    and summarize the bubble size distribution of each combination
+
+    Each worker process loads the image once and keeps a StepCache, while
+    the combinations are handed out in contiguous chunks in the argument
+    order of the pipeline. Combinations sharing the first arguments hence
+    reuse the images of the steps they have in common.
+
+    :param filename: image file name
+    :param pipeline: class from pipelines.py to use as processing sequence
+    :param grid: dictionary with for each argument of the pipeline run
+        method a list of values to try, e.g. {'threshold': [[120, 180]],
+        'dilate_footprint': [3, 5],...}
+    :param channel: green | red | blue
+    :param rules: filter rules applied on the detected bubbles
+    :param workers: number of worker processes, None uses all cores and
+        1 runs the sweep in the current process
+    :param properties: bubble properties to summarize
+    :param engine: regionprops | opencv, property extraction engine
+    :param read_mode: how the image is loaded by the pipeline
+    :param cache_bytes: memory budget of the step cache of each worker
+    :return: DataFrame with a row for each combination with the
+        parameters, the number of bubbles, the summary statistics (mean,
+        std, min, p10, p50, p90, max) of each property and the error
+        message of failed combinations
+    """
+    combinations = parameter_combinations(pipeline, grid)
+    settings = (filename, pipeline, channel, read_mode, cache_bytes,
+                rules, engine, properties)
+
+    if workers == 1:
+        _sweep_init(*settings)
+        try:
+            records = [_sweep_evaluate(params) for params in combinations]
+        finally:
+            _SWEEP_STATE.clear()
+    else:
+        pool = Pool(processes=workers, initializer=_sweep_init,
+                    initargs=settings)
+        try:
+            chunksize = max(1, len(combinations) //
+                            (4 * (workers or cpu_count())))
+            records = list(pool.imap(_sweep_evaluate, combinations,
+                                     chunksize))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    stats = bubble_properties_summary(pd.DataFrame({"x": []}), "x").index
+    columns = (pipeline_arguments(pipeline) + ["n_bubbles"] +
+               ["{}_{}".format(which_property, stat)
+                for which_property in properties for stat in stats[1:]] +
+               ["error"])
+    return pd.DataFrame.from_records(records, columns=columns)
@@ -0,0 +1,117 @@
+"""
+Synthetic bubble images with known bubble sizes
+
+The images mimic backlit (shadowgraph) bubble recordings: dark bubbles,
+optionally with a bright center spot, on a bright, slightly uneven
+background with Gaussian noise. The ground truth table gives the center
+and diameter of each bubble, to measure the accuracy of the pipelines.
+"""
+
+import numpy as np
+import pandas as pd
+import cv2 as cv
+
+
+def synthetic_bubble_image(shape=(600, 800), n_bubbles=50,
+                           diameter_range=(10., 50.), overlap=0.,
+                           noise=5., highlight=0., seed=None,
+                           max_attempts=100):
+    """
+    Generate a synthetic bubble image
+
+    :param shape: (rows, columns) of the image
+    :param n_bubbles: number of bubbles to place
+    :param diameter_range: (min, max) of the uniformly drawn diameters in
+        pixels
+    :param overlap: allowed overlap of neighbouring bubbles as a fraction
+        of the smallest radius, 0 keeps a gap of at least 2 pixels between
+        the bubbles and 1 allows bubble centers on the edge of others
+    :param noise: standard deviation of the Gaussian noise
+    :param highlight: radius of the bright center spot of the bubbles as a
+        fraction of the bubble radius, 0 draws uniformly dark bubbles
+    :param seed: seed of the random generator
+    :param max_attempts: placement attempts per bubble, bubbles that do
+        not fit are left out (so dense settings give fewer bubbles)
+    :return: MxNx3 uint8 image (opencv BGR order), ground truth table with
+        the row, col, diameter and area of each bubble
+    """
+    random = np.random.RandomState(seed)
+    rows, cols = shape
+    diameters = np.sort(random.uniform(diameter_range[0], diameter_range[1],
+                                       n_bubbles))[::-1]
+
+    # place the largest bubbles first
+    placed = []
+    for diameter in diameters:
+        radius = diameter / 2.
+        for _ in range(max_attempts):
+            row = random.uniform(radius, rows - radius)
+            col = random.uniform(radius, cols - radius)
+            if all(np.hypot(row - other_row, col - other_col) >=
+                   radius + other_radius -
+                   overlap * min(radius, other_radius) +
+                   (2. if overlap == 0 else 0.)
+                   for other_row, other_col, other_radius in placed):
+                placed.append((row, col, radius))
+                break
+
+    # uneven background illumination
+    row_grid, col_grid = np.mgrid[0:rows, 0:cols]
+    image = 170. + 20. * np.sin(np.pi * row_grid / rows) * \
+        np.cos(np.pi * col_grid / cols)
+
+    # draw with 4 bits subpixel precision
+    shift = 4
+    for row, col, radius in placed:
+        center = (int(round(col * 2 ** shift)), int(round(row * 2 ** shift)))
+        cv.circle(image, center, int(round(radius * 2 ** shift)), 50., -1,
+                  cv.LINE_AA, shift)
+        if highlight > 0:
+            cv.circle(image, center,
+                      int(round(highlight * radius * 2 ** shift)), 140., -1,
+                      cv.LINE_AA, shift)
+
+    image = cv.GaussianBlur(image, (0, 0), 1.)
+    image += random.normal(0., noise, image.shape)
+    image = np.clip(np.round(image), 0, 255).astype(np.uint8)
+
+    truth = pd.DataFrame(placed, columns=["row", "col", "radius"])
+    truth["diameter"] = 2 * truth.pop("radius")
+    truth["area"] = np.pi * truth["diameter"] ** 2 / 4.
+    return cv.merge([image, image, image]), truth
+
+
+def ks_statistic(sample, reference):
+    """two-sample Kolmogorov-Smirnov statistic of two samples"""
+    sample = np.sort(np.asarray(sample, dtype=np.double))
+    reference = np.sort(np.asarray(reference, dtype=np.double))
+    if len(sample) == 0 or len(reference) == 0:
+        return 1.
+    values = np.concatenate([sample, reference])
+    cdf_sample = np.searchsorted(sample, values, side='right') / \
+        float(len(sample))
+    cdf_reference = np.searchsorted(reference, values, side='right') / \
+        float(len(reference))
+    return np.abs(cdf_sample - cdf_reference).max()
+
+
+def compare_distributions(property_table, truth,
+                          which_property="equivalent_diameter"):
+    """
+    Compare the detected bubble sizes with the ground truth
+
+    :param property_table: property table of the detected bubbles
+    :param truth: ground truth table of synthetic_bubble_image
+    :param which_property: equivalent_diameter | area, compared with the
+        diameter or area of the ground truth
+    :return: dictionary with the number of detected and true bubbles, the
+        Kolmogorov-Smirnov statistic and the relative error of the median
+    """
+    detected = np.asarray(property_table[which_property], dtype=np.double)
+    expected = np.asarray(truth["area" if which_property == "area"
+                                else "diameter"], dtype=np.double)
+    median_error = (np.median(detected) / np.median(expected) - 1.
+                    if len(detected) and len(expected) else np.nan)
+    return {"detected": len(detected), "expected": len(expected),
+            "ks": ks_statistic(detected, expected),
+            "median_error": median_error}
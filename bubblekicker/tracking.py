@@ -0,0 +1,251 @@
+"""
+Frame-to-frame tracking of bubbles
+
+The bubbles of consecutive frames are linked on their centroid and
+equivalent diameter, as given by bubble_properties_calculate. For each
+active track the position in the new frame is predicted from its last
+velocity, and a KD-tree of the new bubbles returns the nearest candidates
+within max_distance of each prediction, so no all-pairs distances are
+calculated. The candidate pairs are gated on the diameter change and
+assigned one-to-one in rounds of mutual best matches, all vectorized over
+the bubbles of a frame.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from bubblekicker import BatchFailure
+
+TRACK_COLUMNS = ["frame", "label", "track", "row", "col",
+                 "equivalent_diameter", "velocity_row", "velocity_col",
+                 "speed"]
+
+
+def _frame_arrays(property_table):
+    """labels, (row, col) centroids and diameters of a property table"""
+    labels = np.asarray(property_table.index.values)
+    centroids = np.array(list(property_table["centroid"]),
+                         dtype=np.double).reshape(-1, 2)
+    diameters = np.asarray(property_table["equivalent_diameter"],
+                           dtype=np.double)
+    return labels, centroids, diameters
+
+
+def match_bubbles(predicted, predicted_diameters, centroids, diameters,
+                  max_distance, max_size_change=0.5, neighbours=4):
+    """
+    Match predicted bubble positions to the bubbles of a frame
+
+    :param predicted: Nx2 array with the predicted (row, col) positions
+    :param predicted_diameters: N diameters of the predicted bubbles
+    :param centroids: Mx2 array with the (row, col) centroids of the frame
+    :param diameters: M diameters of the bubbles of the frame
+    :param max_distance: maximum distance in pixels between a prediction
+        and its match
+    :param max_size_change: maximum relative change of the diameter
+    :param neighbours: number of nearest candidates considered for each
+        prediction
+    :return: arrays with the matched indices of the predictions and of the
+        bubbles of the frame
+    """
+    if len(predicted) == 0 or len(centroids) == 0:
+        return np.zeros(0, np.intp), np.zeros(0, np.intp)
+    neighbours = min(neighbours, len(centroids))
+    distances, candidates = cKDTree(centroids).query(
+        predicted, k=neighbours, distance_upper_bound=max_distance)
+    distances = distances.reshape(len(predicted), neighbours)
+    candidates = candidates.reshape(len(predicted), neighbours)
+
+    # gate the candidate pairs on distance and diameter change
+    sources = np.repeat(np.arange(len(predicted)), neighbours)
+    targets = candidates.ravel()
+    distances = distances.ravel()
+    valid = np.isfinite(distances)
+    sources, targets, distances = (sources[valid], targets[valid],
+                                   distances[valid])
+    size_change = (np.abs(diameters[targets] - predicted_diameters[sources]) /
+                   np.maximum(predicted_diameters[sources], 1e-12))
+    valid = size_change <= max_size_change
+    sources, targets = sources[valid], targets[valid]
+    costs = distances[valid] / max_distance + size_change[valid]
+
+    # assign the mutual best pairs, remove them and repeat
+    matched_sources, matched_targets = [], []
+    while len(costs):
+        order = np.lexsort((costs, sources))
+        best_of_source = order[np.r_[True, sources[order][1:] !=
+                                     sources[order][:-1]]]
+        order = np.lexsort((costs, targets))
+        best_of_target = order[np.r_[True, targets[order][1:] !=
+                                     targets[order][:-1]]]
+        mutual = np.intersect1d(best_of_source, best_of_target)
+        matched_sources.append(sources[mutual])
+        matched_targets.append(targets[mutual])
+        remaining = (~np.in1d(sources, sources[mutual]) &
+                     ~np.in1d(targets, targets[mutual]))
+        sources, targets, costs = (sources[remaining], targets[remaining],
+                                   costs[remaining])
+    if not matched_sources:
+        return np.zeros(0, np.intp), np.zeros(0, np.intp)
+    return np.concatenate(matched_sources), np.concatenate(matched_targets)
+
+
+class BubbleTracker(object):
+    """
+    Link the bubbles of consecutive frames into tracks
+
+    Feed the property tables frame by frame with update; the detections of
+    all frames are collected as arrays, so long sequences with thousands
+    of bubbles per frame stay cheap.
+    """
+
+    def __init__(self, max_distance=20., max_size_change=0.5, memory=0,
+                 frame_interval=1., neighbours=4):
+        """
+        :param max_distance: maximum distance in pixels between the
+            predicted and the detected position of a bubble
+        :param max_size_change: maximum relative change of the equivalent
+            diameter between linked detections
+        :param memory: number of frames a bubble may be missing before its
+            track is closed
+        :param frame_interval: time between frames, the velocities are in
+            pixels per frame_interval units (e.g. seconds)
+        :param neighbours: candidates considered for each track
+        """
+        self.max_distance = max_distance
+        self.max_size_change = max_size_change
+        self.memory = memory
+        self.frame_interval = frame_interval
+        self.neighbours = neighbours
+        self._next_track = 0
+        self._frame = None
+        # state of the active tracks: id, last frame, position, diameter
+        # and velocity in pixels per frame
+        self._tracks = np.zeros(0, np.int64)
+        self._last_frame = np.zeros(0, np.int64)
+        self._positions = np.zeros((0, 2))
+        self._diameters = np.zeros(0)
+        self._velocities = np.zeros((0, 2))
+        self._detections = []
+
+    def update(self, frame, property_table):
+        """
+        Link the bubbles of the next frame to the active tracks
+
+        :param frame: frame index, increasing between the updates
+        :param property_table: bubble properties of the frame with the
+            centroid and equivalent_diameter columns
+        :return: DataFrame with the track of each bubble of the frame (see
+            TRACK_COLUMNS)
+        """
+        if self._frame is not None and frame <= self._frame:
+            raise ValueError("The frames should be given in increasing "
+                             "order, got frame {} after "
+                             "{}".format(frame, self._frame))
+        self._frame = frame
+        labels, centroids, diameters = _frame_arrays(property_table)
+
+        gaps = frame - self._last_frame
+        predicted = self._positions + self._velocities * gaps[:, None]
+        sources, targets = match_bubbles(
+            predicted, self._diameters, centroids, diameters,
+            self.max_distance, self.max_size_change, self.neighbours)
+
+        tracks = np.empty(len(labels), np.int64)
+        tracks[targets] = self._tracks[sources]
+        new = np.ones(len(labels), bool)
+        new[targets] = False
+        tracks[new] = np.arange(self._next_track,
+                                self._next_track + new.sum())
+        self._next_track += new.sum()
+
+        velocities = np.full((len(labels), 2), np.nan)
+        velocities[targets] = ((centroids[targets] -
+                                self._positions[sources]) /
+                               gaps[sources][:, None])
+
+        # matched tracks move on, unmatched tracks wait up to memory frames
+        waiting = np.ones(len(self._tracks), bool)
+        waiting[sources] = False
+        waiting &= gaps <= self.memory
+        known = np.where(np.isnan(velocities), 0., velocities)
+        self._tracks = np.r_[self._tracks[waiting], tracks]
+        self._last_frame = np.r_[self._last_frame[waiting],
+                                 np.full(len(labels), frame, np.int64)]
+        self._positions = np.r_[self._positions[waiting], centroids]
+        self._diameters = np.r_[self._diameters[waiting], diameters]
+        self._velocities = np.r_[self._velocities[waiting], known]
+
+        velocities /= self.frame_interval
+        detections = pd.DataFrame(OrderedDict([
+            ("frame", np.full(len(labels), frame, np.int64)),
+            ("label", labels), ("track", tracks),
+            ("row", centroids[:, 0]), ("col", centroids[:, 1]),
+            ("equivalent_diameter", diameters),
+            ("velocity_row", velocities[:, 0]),
+            ("velocity_col", velocities[:, 1]),
+            ("speed", np.hypot(velocities[:, 0], velocities[:, 1]))]),
+            columns=TRACK_COLUMNS)
+        self._detections.append(detections)
+        return detections
+
+    def tracks(self):
+        """detections of all frames so far with their track (see
+        TRACK_COLUMNS)"""
+        if not self._detections:
+            return pd.DataFrame(columns=TRACK_COLUMNS)
+        return pd.concat(self._detections, ignore_index=True)
+
+
+def track_statistics(tracks, min_length=2):
+    """
+    Size and velocity statistics of each track
+
+    :param tracks: detections with their track, as returned by
+        BubbleTracker.tracks or track_bubbles
+    :param min_length: minimum number of detections of a reported track
+    :return: DataFrame indexed by track with the number of detections, the
+        first and last frame, the mean, std and change of the equivalent
+        diameter and the mean velocity and speed
+    """
+    grouped = tracks.groupby("track")
+    statistics = pd.DataFrame(OrderedDict([
+        ("length", grouped.size()),
+        ("first_frame", grouped["frame"].min()),
+        ("last_frame", grouped["frame"].max()),
+        ("diameter_mean", grouped["equivalent_diameter"].mean()),
+        ("diameter_std", grouped["equivalent_diameter"].std()),
+        ("diameter_change", grouped["equivalent_diameter"].last() -
+         grouped["equivalent_diameter"].first()),
+        ("velocity_row", grouped["velocity_row"].mean()),
+        ("velocity_col", grouped["velocity_col"].mean()),
+        ("speed", grouped["speed"].mean())]))
+    return statistics[statistics["length"] >= min_length]
+
+
+def track_bubbles(frames, max_distance=20., max_size_change=0.5, memory=0,
+                  frame_interval=1.):
+    """
+    Track the bubbles of a sequence of frames
+
+    :param frames: iterable of (frame index, property table) tuples in
+        frame order, e.g. the sorted output of stream_bubble_properties
+        (frames with a BatchFailure are skipped)
+    :param max_distance: maximum distance in pixels between the predicted
+        and the detected position of a bubble
+    :param max_size_change: maximum relative change of the diameter
+    :param memory: number of frames a bubble may be missing
+    :param frame_interval: time between frames
+    :return: DataFrame with the detections and their track (see
+        TRACK_COLUMNS), DataFrame with the statistics of each track
+    """
+    tracker = BubbleTracker(max_distance, max_size_change, memory,
+                            frame_interval)
+    for frame, property_table in frames:
+        if not isinstance(property_table, BatchFailure):
+            tracker.update(frame, property_table)
+    tracks = tracker.tracks()
+    return tracks, track_statistics(tracks)
@@ -0,0 +1,179 @@
+"""
+Automatic tuning of the pipeline parameters against reference images
+
+The candidates of a parameter grid are compared with the expected bubble
+size distributions of a few reference images by successive halving: all
+candidates are scored on a coarse pyramid level of the references (see
+preview.py), only the best 1 / eta of them go on to the next, finer level,
+and the last level is the full resolution. Within a level, the scoring of a
+candidate stops as soon as it can no longer end up among the candidates
+going on, so poor candidates are dropped after a single reference image.
+
+The score of a candidate is the Kolmogorov-Smirnov statistic between its
+detected and the expected size distribution, averaged over the reference
+images (0 is a perfect match), optionally with a penalty for the relative
+error of the number of bubbles.
+
+The pyramid levels reduce the image noise as well as the bubble size, so
+the ranking on a coarse level only approximates the full resolution
+ranking: use coarse levels on which the bubbles keep a diameter of several
+pixels and a smaller eta to keep more candidates when in doubt.
+"""
+
+import math
+from collections import OrderedDict
+
+import cv2 as cv
+import numpy as np
+import pandas as pd
+
+from bubblekicker import DEFAULT_FILTERS
+from preview import PreviewKicker
+from sweep import parameter_combinations, pipeline_arguments
+from synthetic import ks_statistic
+
+# errors of running a pipeline with parameters it does not support, which
+# disqualify the candidate
+RUN_ERRORS = (cv.error, TypeError, ValueError)
+
+
+def _expected_values(expected, which_property):
+    """expected property values of a reference, given as values or as a
+    table with the property column (or the diameter or area column of a
+    synthetic ground truth)"""
+    if isinstance(expected, pd.DataFrame):
+        if which_property not in expected.columns:
+            which_property = ("area" if which_property == "area"
+                              else "diameter")
+        expected = expected[which_property]
+    return np.asarray(expected, dtype=np.double)
+
+
+def _reference_bubbler(image, pipeline, channel):
+    """BubbleKicker of a reference image file name or array"""
+    if isinstance(image, np.ndarray):
+        return pipeline.from_array(image, channel=channel)
+    return pipeline(image, channel=channel, read_mode='channel')
+
+
+def _candidate_score(preview, steps, expected, which_property, rules,
+                     engine, count_weight):
+    """score of a step sequence on a single reference preview, inf when
+    the steps can not be run"""
+    preview.reset_to_raw()
+    try:
+        preview.apply_steps(steps)
+    except RUN_ERRORS:
+        return np.inf
+    property_table = preview.bubble_properties(rules, engine)
+    if which_property not in property_table.columns:
+        raise ValueError("{} is not a bubble property, use one "
+                         "of {}".format(which_property, ", ".join(
+                             property_table.columns)))
+    detected = np.asarray(property_table[which_property], dtype=np.double)
+    score = ks_statistic(detected, expected)
+    if count_weight:
+        score += count_weight * abs(len(detected) /
+                                    float(max(len(expected), 1)) - 1.)
+    return score
+
+
+def tune_parameters(references, pipeline, grid, channel='red',
+                    which_property="equivalent_diameter", levels=(2, 1, 0),
+                    eta=3, rules=DEFAULT_FILTERS, engine='opencv',
+                    count_weight=0.):
+    """
+    Search the pipeline parameters best matching the expected size
+    distributions of reference images with successive halving over
+    pyramid levels
+
+    :param references: list of (image, expected) tuples, with image a file
+        name or image array and expected the expected property values of
+        the bubbles, e.g. annotated diameters or the ground truth table of
+        synthetic_bubble_image
+    :param pipeline: class from pipelines.py to tune
+    :param grid: dictionary with for each argument of the pipeline run
+        method a list of values to try (see parameter_sweep)
+    :param channel: green | red | blue
+    :param which_property: bubble property compared with the expected
+        values, in full resolution pixel units
+    :param levels: pyramid levels of the successive rungs, coarse to fine
+        (0 is the full resolution)
+    :param eta: reduction factor, 1 / eta of the candidates of a rung go
+        on to the next rung
+    :param rules: filter rules applied on the detected bubbles
+    :param engine: regionprops | opencv, property extraction engine
+    :param count_weight: weight of the relative bubble count error in the
+        score, 0 only compares the shape of the distributions
+        (candidates whose steps can not be run get an infinite score)
+    :return: OrderedDict with the best parameters, DataFrame with the score
+        history: a row per scored candidate and rung with the rung, level,
+        parameters, number of scored images, score (mean over the scored
+        images), whether the candidate was stopped early and whether it
+        went on to the next rung
+    """
+    if eta < 2:
+        raise ValueError("The reduction factor eta should be at least 2")
+    candidates = parameter_combinations(pipeline, grid)
+    references = [(_reference_bubbler(image, pipeline, channel),
+                   _expected_values(expected, which_property))
+                  for image, expected in references]
+
+    history = []
+    for rung, level in enumerate(levels):
+        previews = [PreviewKicker(bubbler, level)
+                    for bubbler, _ in references]
+        last_rung = rung == len(levels) - 1
+        n_keep = 1 if last_rung else max(1, int(math.ceil(
+            len(candidates) / float(eta))))
+
+        scores = []
+        for params in candidates:
+            total, stopped = 0., False
+            try:
+                steps = pipeline.steps(**params)
+            except RUN_ERRORS:
+                steps = None
+            for index, (preview, (_, expected)) in enumerate(
+                    zip(previews, references)):
+                if steps is None:
+                    total = np.inf
+                    break
+                total += _candidate_score(preview, steps, expected,
+                                          which_property, rules, engine,
+                                          count_weight)
+                if np.isinf(total):
+                    break
+                # the scores are positive, so the mean over all images is
+                # at least the sum so far divided by the number of images
+                finished = sorted(score for score, images, _ in scores
+                                  if images == len(references))
+                if (index + 1 < len(references) and
+                        len(finished) >= n_keep and
+                        total / len(references) > finished[n_keep - 1]):
+                    stopped = True
+                    break
+            scores.append((total / (index + 1), index + 1, stopped))
+        if not any(np.isfinite(score) for score, _, _ in scores):
+            raise ValueError("None of the candidates could be run on the "
+                             "references at level {}".format(level))
+
+        # early stopped candidates are ranked behind the finished ones
+        ranking = sorted(range(len(candidates)),
+                         key=lambda number: (scores[number][2],
+                                             scores[number][0]))
+        kept = set(ranking[:n_keep])
+        for number, params in enumerate(candidates):
+            record = OrderedDict([("rung", rung), ("level", level)])
+            record.update((name, tuple(value) if isinstance(value, list)
+                           else value) for name, value in params.items())
+            score, images, stopped = scores[number]
+            record.update([("images", images), ("score", score),
+                           ("stopped_early", stopped),
+                           ("kept", number in kept)])
+            history.append(record)
+        candidates = [candidates[number] for number in ranking[:n_keep]]
+
+    columns = (["rung", "level"] + pipeline_arguments(pipeline) +
+               ["images", "score", "stopped_early", "kept"])
+    return candidates[0], pd.DataFrame.from_records(history, columns=columns)
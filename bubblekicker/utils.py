@@ -1,6 +1,17 @@
 
+import time
+import timeit
+
 import numpy as np
 
+# clocks of the step records: elapsed time and processor time of the process
+wall_time = timeit.default_timer
+try:
+    cpu_time = time.process_time
+except AttributeError:
+    # python 2, time.clock is the processor time on Unix
+    cpu_time = time.clock
+
 
 def calculate_circularity_reciprocal(perimeter, area):
     """calculate the circularity based on the perimeter and area"""
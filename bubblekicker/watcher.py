@@ -0,0 +1,199 @@
+"""
+Online processing of the images written to a drop folder
+
+A scanning thread lists the folder and hands each new image, once its size
+no longer changes, to dispatching threads that run the pipeline in a pool
+of worker processes (or threads). The property table of each image is
+yielded as soon as it is ready, together with its timing: the time the
+image waited after being detected, its processing time and the latency
+from detection to result.
+
+Backpressure: at most queue_size detected images wait for a worker and at
+most queue_size results wait to be consumed. When these queues are full
+the scanner stops picking up files, which simply stay in the folder until
+the workers catch up, instead of piling up in memory.
+"""
+
+import fnmatch
+import os
+import threading
+import traceback
+from multiprocessing import cpu_count
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+from bubblekicker import (DEFAULT_FILTERS, BatchFailure, worker_pool,
+                          bubble_properties_calculate, _batch_executor)
+from streaming import _put, _POLL_INTERVAL
+from utils import wall_time
+
+
+def _watch_process(path, pipeline, args, channel, read_mode, rules, engine,
+                   store):
+    """run the pipeline on a single image of the drop folder
+
+    :return: property table or BatchFailure, processing time in seconds
+    """
+    start = wall_time()
+    try:
+        bubbler = pipeline(path, channel=channel, read_mode=read_mode)
+        if hasattr(pipeline, 'steps'):
+            result = bubbler.apply_steps(pipeline.steps(*args),
+                                         executor=_batch_executor()).copy()
+        else:
+            result = bubbler.run(*args)
+        labels = bubbler.pop_labels()
+        if store is not None:
+            property_table = store.write(
+                path, result, {'filename': path, 'channel': channel,
+                               'pipeline': pipeline.__name__,
+                               'args': list(args),
+                               'steps': bubbler.logs.log}, labels)
+        else:
+            _, property_table = bubble_properties_calculate(
+                result, rules=rules, engine=engine, labels=labels)
+    except Exception as err:
+        property_table = BatchFailure(os.path.basename(path),
+                                      "{}: {}".format(type(err).__name__,
+                                                      err),
+                                      traceback.format_exc())
+    return property_table, wall_time() - start
+
+
+def _scan(folder, pattern, existing, settle_polls, poll_interval, pending,
+          stop):
+    """scanning thread: queue the new files once their size is stable"""
+    seen = set()
+    candidates = {}
+    first = True
+    while not stop.is_set():
+        try:
+            filenames = sorted(fnmatch.filter(os.listdir(folder), pattern))
+        except OSError:
+            filenames = []
+        for filename in filenames:
+            if filename in seen:
+                continue
+            path = os.path.join(folder, filename)
+            if first and not existing:
+                seen.add(filename)
+                continue
+            try:
+                status = os.stat(path)
+            except OSError:
+                continue
+            size, detected, polls = candidates.get(
+                filename, (None, wall_time(), -1))
+            polls = polls + 1 if status.st_size == size else 0
+            candidates[filename] = (status.st_size, detected, polls)
+            if status.st_size > 0 and polls >= settle_polls:
+                if not _put(pending, (path, detected), stop):
+                    return
+                seen.add(filename)
+                del candidates[filename]
+        # forget the files removed before they were settled
+        for filename in set(candidates) - set(filenames):
+            del candidates[filename]
+        first = False
+        stop.wait(poll_interval)
+
+
+def _dispatch(pool, pending, results, task_args, stop):
+    """dispatching thread: process the queued images in the pool"""
+    while not stop.is_set():
+        try:
+            path, detected = pending.get(timeout=_POLL_INTERVAL)
+        except Empty:
+            continue
+        started = wall_time()
+        try:
+            property_table, seconds = pool.apply(_watch_process,
+                                                 (path,) + task_args)
+        except Exception as err:
+            if stop.is_set():
+                return
+            property_table = BatchFailure(os.path.basename(path),
+                                          "{}: {}".format(
+                                              type(err).__name__, err))
+            seconds = wall_time() - started
+        finished = wall_time()
+        timing = {'detected': detected, 'finished': finished,
+                  'queue_time': started - detected,
+                  'processing_time': seconds,
+                  'latency': finished - detected}
+        if not _put(results, (path, property_table, timing), stop):
+            return
+
+
+def watch_folder(folder, pipeline, args, channel='red', pattern='*',
+                 rules=DEFAULT_FILTERS, engine='opencv', workers=2,
+                 queue_size=8, poll_interval=0.5, settle_polls=1,
+                 existing=False, read_mode='channel', store=None,
+                 backend='process', stop=None):
+    """
+    Watch a folder and yield the bubble property table of each new image
+    as soon as it is processed
+
+    The generator runs until it is closed (e.g. by breaking out of the
+    loop) or until the stop event is set.
+
+    :param folder: drop folder to watch
+    :param pipeline: class from pipelines.py to use as processing sequence
+    :param args: sequence of arguments required by the pipeline
+    :param channel: green | red | blue
+    :param pattern: file name pattern of the images, e.g. '*.tif'
+    :param rules: filter rules applied on the detected bubbles
+    :param engine: regionprops | opencv, property extraction engine
+    :param workers: number of workers, None uses all cores
+    :param queue_size: maximum number of images waiting for a worker and
+        of results waiting to be consumed
+    :param poll_interval: time in seconds between two scans of the folder
+    :param settle_polls: number of scans the file size should stay the
+        same before the image is processed, 0 processes the files as soon
+        as they appear (when they are moved into the folder at once)
+    :param existing: also process the files already in the folder when
+        the watcher starts
+    :param read_mode: how the images are loaded by the pipeline
+    :param store: ResultStore in which the workers save the results, its
+        rules and engine are used instead
+    :param backend: process | thread
+    :param stop: threading.Event to stop the watcher from another thread
+    :return: generator of (path, property table, timing) tuples, with a
+        BatchFailure instead of the table when processing failed and
+        timing a dictionary with the detected and finished wall clock
+        times and the queue_time, processing_time and latency in seconds
+    """
+    workers = workers or cpu_count()
+    stop = stop or threading.Event()
+    pending = Queue(maxsize=queue_size)
+    results = Queue(maxsize=queue_size)
+    task_args = (pipeline, tuple(args), channel, read_mode, rules, engine,
+                 store)
+
+    with worker_pool(workers, backend) as pool:
+        threads = [threading.Thread(target=_scan,
+                                    args=(folder, pattern, existing,
+                                          settle_polls, poll_interval,
+                                          pending, stop))]
+        threads += [threading.Thread(target=_dispatch,
+                                     args=(pool, pending, results,
+                                           task_args, stop))
+                    for _ in range(workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            while not stop.is_set():
+                try:
+                    yield results.get(timeout=_POLL_INTERVAL)
+                except Empty:
+                    continue
+        finally:
+            # also stops the threads when the generator is closed early
+            stop.set()
+            for thread in threads:
+                thread.join()
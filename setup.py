@@ -10,5 +10,8 @@ setup(
     author_email='',
     description='',
     install_requires=['matplotlib', 'scikit-image', 
-                      'numpy', 'pandas']
+                      'numpy', 'pandas', 'scipy'],
+    entry_points={
+        'console_scripts': ['bubblekicker=bubblekicker.cli:main']
+    }
 )
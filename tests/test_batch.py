@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import cv2 as cv
+
+from bubblekicker.bubblekicker import (batchbubblekicker, ibatchbubblekicker,
+                                       BatchFailure)
+from bubblekicker.pipelines import CannyPipeline
+
+
+def _write_bubble_image(filename, centers, radius=12):
+    """write a dark image with bright bubbles at the given centers"""
+    image = np.zeros((120, 160, 3), np.uint8)
+    for center in centers:
+        cv.circle(image, center, radius, (200, 200, 200), -1)
+    cv.imwrite(filename, image)
+
+
+class TestBatchBubbleKicker(unittest.TestCase):
+
+    def setUp(self):
+        self.data_path = tempfile.mkdtemp()
+        _write_bubble_image(os.path.join(self.data_path, "a.png"),
+                            [(40, 40), (100, 70)])
+        _write_bubble_image(os.path.join(self.data_path, "b.png"),
+                            [(60, 60)])
+        self.args = ([120, 180], 3, 3, 1, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+
+    def test_parallel_matches_serial(self):
+        """test the process-pool results against the serial batch"""
+        serial = batchbubblekicker(self.data_path, 'red',
+                                   CannyPipeline, *self.args)
+        parallel = dict(ibatchbubblekicker(self.data_path, 'red',
+                                           CannyPipeline, self.args,
+                                           workers=2, ordered=False))
+        self.assertEqual(sorted(serial), sorted(parallel))
+        for imgfile in serial:
+            np.testing.assert_array_equal(serial[imgfile],
+                                          parallel[imgfile])
+
+    def test_ordered_file_list(self):
+        """test the order of the yielded results for a list of files"""
+        files = [os.path.join(self.data_path, name)
+                 for name in ["b.png", "a.png"]]
+        names = [imgfile for imgfile, _ in
+                 ibatchbubblekicker(files, 'red', CannyPipeline,
+                                    self.args, workers=2)]
+        self.assertEqual(names, files)
+
+    def test_failure_does_not_stop_run(self):
+        """test a non-image file is reported and the run continues"""
+        with open(os.path.join(self.data_path, "notes.txt"), "w") as txt:
+            txt.write("not an image")
+        results = dict(ibatchbubblekicker(self.data_path, 'red',
+                                          CannyPipeline, self.args,
+                                          workers=1))
+        self.assertIsInstance(results["notes.txt"], BatchFailure)
+        self.assertIsInstance(results["a.png"], np.ndarray)
+
+    def test_step_records(self):
+        """test the step records of the workers are collected"""
+        records = []
+        list(ibatchbubblekicker(self.data_path, 'red', CannyPipeline,
+                                self.args, workers=2, records=records))
+        self.assertEqual(len(records), 10)
+        self.assertEqual(sorted(set(record["filename"]
+                                    for record in records)),
+                         ["a.png", "b.png"])
+
+    def test_thread_backend(self):
+        """test the thread backend against the process backend"""
+        threads = cv.getNumThreads()
+        processes = dict(ibatchbubblekicker(self.data_path, 'red',
+                                            CannyPipeline, self.args,
+                                            workers=2))
+        threaded = dict(ibatchbubblekicker(self.data_path, 'red',
+                                           CannyPipeline, self.args,
+                                           workers=2, backend='thread'))
+        for imgfile in processes:
+            np.testing.assert_array_equal(processes[imgfile],
+                                          threaded[imgfile])
+        # the number of OpenCV threads is restored after the run
+        self.assertEqual(cv.getNumThreads(), threads)
+        with self.assertRaises(ValueError):
+            list(ibatchbubblekicker(self.data_path, 'red', CannyPipeline,
+                                    self.args, workers=2, backend='fiber'))
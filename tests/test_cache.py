@@ -0,0 +1,196 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import cv2 as cv
+
+from bubblekicker.bubblekicker import BubbleKicker, ibatchbubblekicker
+from bubblekicker.cache import StepCache, ResultCache
+from bubblekicker.pipelines import CannyPipeline, AdaptiveThresholdPipeline
+from bubblekicker.storage import ResultStore
+
+SAMPLE_IMAGE = os.path.join(os.path.dirname(__file__), '..', 'drafts',
+                            '0325097m_0305.tif')
+
+
+class TestStepCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        """test the least recently used image is dropped first"""
+        cache = StepCache(max_bytes=250)
+        for key in ["a", "b"]:
+            cache.put(key, np.zeros(100, np.uint8), key)
+        cache.get("a")
+        cache.put("c", np.zeros(100, np.uint8), "c")
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.nbytes, 200)
+
+    def test_read_only_view(self):
+        """test the cached image is read-only, not the given image"""
+        cache = StepCache()
+        image = np.zeros(100, np.uint8)
+        cached = cache.put("a", image, "a")
+        self.assertTrue(image.flags.writeable)
+        self.assertFalse(cached.flags.writeable)
+        self.assertIs(cache.get("a")[0], cached)
+
+    def test_too_large(self):
+        """test an image larger than the budget is not stored"""
+        cache = StepCache(max_bytes=50)
+        cache.put("a", np.zeros(100, np.uint8), "a")
+        self.assertEqual(len(cache), 0)
+
+    def test_counters(self):
+        """test the hit and miss counters"""
+        cache = StepCache()
+        cache.put("a", np.zeros(10, np.uint8), "a")
+        cache.get("a")
+        cache.get("b")
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+
+class TestBubbleKickerCache(unittest.TestCase):
+
+    def test_shared_prefix(self):
+        """test rerunning a shared step prefix after a reset is a hit"""
+        cache = StepCache()
+        bubbler = BubbleKicker(SAMPLE_IMAGE, channel='red', cache=cache)
+        bubbler.edge_detect_canny_opencv([30, 80])
+        first = bubbler.dilate_opencv(3)
+        bubbler.reset_to_raw()
+        bubbler.edge_detect_canny_opencv(threshold=[30, 80])
+        self.assertEqual(cache.hits, 1)
+        second = bubbler.dilate_opencv(footprintsize=3)
+        self.assertIs(first, second)
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(len(bubbler.logs.log), 2)
+
+    def test_same_result(self):
+        """test the pipeline result with a cache, also after a reset"""
+        args = ([120, 180], 3, 3, 1, 1)
+        reference = CannyPipeline(SAMPLE_IMAGE)
+        expected = reference.run(*args)
+        bubbler = CannyPipeline(SAMPLE_IMAGE, cache=StepCache())
+        np.testing.assert_array_equal(bubbler.run(*args), expected)
+        bubbler.reset_to_raw()
+        np.testing.assert_array_equal(bubbler.run(*args), expected)
+        self.assertEqual(bubbler.logs.log, reference.logs.log)
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.data_path = os.path.join(self.tempdir, "images")
+        os.makedirs(self.data_path)
+        for name, center in [("a.png", (40, 40)), ("b.png", (90, 60))]:
+            self._write_image(name, center)
+        self.cache_path = os.path.join(self.tempdir, "cache")
+        self.args = ([120, 180], 3, 3, 1, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _write_image(self, name, center):
+        image = np.zeros((120, 160, 3), np.uint8)
+        cv.circle(image, center, 12, (200, 200, 200), -1)
+        cv.imwrite(os.path.join(self.data_path, name), image)
+
+    def _run(self, cache, workers=1):
+        return dict(ibatchbubblekicker(self.data_path, 'red', CannyPipeline,
+                                       self.args, workers=workers,
+                                       cache=cache))
+
+    def test_rerun_hits(self):
+        """test a rerun only processes the new and changed images"""
+        first = ResultCache(self.cache_path)
+        expected = self._run(first, workers=2)
+        self.assertEqual((first.hits, first.misses), (0, 2))
+        self._write_image("b.png", (100, 70))
+        self._write_image("c.png", (60, 60))
+        cache = ResultCache(self.cache_path)
+        results = self._run(cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        np.testing.assert_array_equal(results["a.png"], expected["a.png"])
+        self.assertEqual(len(cache.names()), 4)
+
+    def test_batch_eviction(self):
+        """test the parent of a batch run tracks the size of the entries
+        written by the workers and evicts beyond the budget"""
+        for name, center in [("c.png", (60, 60)), ("d.png", (120, 80))]:
+            self._write_image(name, center)
+        cache = ResultCache(self.cache_path)
+        self._run(cache, workers=2)
+        self.assertEqual(cache._tracked_bytes, cache.nbytes)
+        entry_size = cache.nbytes // 4
+        cache = ResultCache(self.cache_path, max_bytes=int(2.5 * entry_size))
+        cache.clear()
+        self._run(cache, workers=2)
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+        self.assertGreaterEqual(cache._tracked_bytes, cache.nbytes)
+
+    def test_hit_store(self):
+        """test a hit is written into the store as when processed"""
+        for name in ["first", "second"]:
+            store = ResultStore(os.path.join(self.tempdir, name))
+            list(ibatchbubblekicker(self.data_path, 'red', CannyPipeline,
+                                    self.args, workers=1, store=store,
+                                    cache=ResultCache(self.cache_path)))
+        first = ResultStore(os.path.join(self.tempdir, "first"))
+        for name in store.names():
+            np.testing.assert_array_equal(store.read_binary(name),
+                                          first.read_binary(name))
+            self.assertEqual(store.read_table(name).to_dict(),
+                             first.read_table(name).to_dict())
+
+    def test_key(self):
+        """test the key depends on the contents and the settings"""
+        cache = ResultCache(self.cache_path)
+        path = os.path.join(self.data_path, "a.png")
+        key = cache.key(path, CannyPipeline, 'red', self.args)
+        shutil.copy(path, os.path.join(self.tempdir, "copy.png"))
+        self.assertEqual(cache.key(os.path.join(self.tempdir, "copy.png"),
+                                   CannyPipeline, 'red', self.args), key)
+        self.assertNotEqual(cache.key(path, CannyPipeline, 'green',
+                                      self.args), key)
+        self.assertNotEqual(cache.key(path, CannyPipeline, 'red',
+                                      ([120, 181], 3, 3, 1, 1)), key)
+
+    def test_hit_result(self):
+        """test a hit returns the binary image and property table"""
+        cache = ResultCache(self.cache_path)
+        binary = CannyPipeline(os.path.join(self.data_path,
+                                            "a.png")).run(*self.args)
+        table = cache.put("k", binary, {'steps': []}, CannyPipeline)
+        cached_binary, cached_table = cache.get("k")
+        np.testing.assert_array_equal(cached_binary, binary)
+        self.assertEqual(list(cached_table["area"]), list(table["area"]))
+        self.assertIsNone(cache.get("other"))
+
+    def test_size_eviction(self):
+        """test the least recently used entries are evicted"""
+        cache = ResultCache(self.cache_path)
+        binary = np.where(np.random.RandomState(6).rand(100, 100) > 0.5,
+                          255, 1).astype(np.uint8)
+        cache.put("a", binary)
+        size = cache.nbytes
+        cache.max_bytes = int(2.5 * size)
+        cache.put("b", binary)
+        # make a the most recently used entry
+        os.utime(cache._path("b"), (0, 0))
+        cache.get("a")
+        cache.put("c", binary)
+        self.assertEqual(cache.names(), ["a", "c"])
+
+    def test_purge_stale(self):
+        """test entries of other code versions are purged"""
+        cache = ResultCache(self.cache_path)
+        binary = np.ones((20, 20), np.uint8)
+        cache.put("a", binary, pipeline=CannyPipeline)
+        cache.put("b", binary, pipeline=AdaptiveThresholdPipeline)
+        cache.put("c", binary)
+        self.assertEqual(cache.purge_stale([CannyPipeline]), 2)
+        self.assertEqual(cache.names(), ["a"])
@@ -0,0 +1,118 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import cv2 as cv
+
+from bubblekicker.cli import (CHECKPOINT_FILE, available_pipelines, main,
+                              run_batch)
+from bubblekicker.pipelines import CannyPipeline
+from bubblekicker.storage import ResultStore
+
+
+def _write_bubble_image(filename, centers, radius=12):
+    """write a dark image with bright bubbles at the given centers"""
+    image = np.zeros((120, 160, 3), np.uint8)
+    for center in centers:
+        cv.circle(image, center, radius, (200, 200, 200), -1)
+    cv.imwrite(filename, image)
+
+
+class TestCommandLine(unittest.TestCase):
+
+    def setUp(self):
+        self.data_path = tempfile.mkdtemp()
+        self.output = os.path.join(self.data_path, "results")
+        self.images = os.path.join(self.data_path, "images")
+        os.makedirs(self.images)
+        _write_bubble_image(os.path.join(self.images, "a.png"),
+                            [(40, 40), (100, 70)])
+        _write_bubble_image(os.path.join(self.images, "b.png"),
+                            [(60, 60)])
+        self.args = [[120, 180], 3, 3, 1, 1]
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+
+    def _checkpoint(self):
+        with open(os.path.join(self.output, CHECKPOINT_FILE)) as checkpoint:
+            return [json.loads(line) for line in checkpoint]
+
+    def test_pipelines(self):
+        """test the pipeline classes are found"""
+        self.assertEqual(available_pipelines(),
+                         ["AdaptiveThresholdPipeline", "CannyPipeline"])
+
+    def test_results_and_resume(self):
+        """test the stored results and the skipped images of a rerun"""
+        summary = run_batch("CannyPipeline", self.images, self.output,
+                            self.args, workers=1, stream=None)
+        self.assertEqual((summary['processed'], summary['skipped']), (2, 0))
+        store = ResultStore(self.output)
+        self.assertEqual(store.names(), ["a.png", "b.png"])
+        expected = CannyPipeline(os.path.join(self.images, "a.png"),
+                                 channel='red').run(*self.args)
+        np.testing.assert_array_equal(store.read_binary("a.png"), expected)
+
+        _write_bubble_image(os.path.join(self.images, "c.png"), [(80, 60)])
+        summary = run_batch("CannyPipeline", self.images, self.output,
+                            self.args, workers=2, stream=None)
+        self.assertEqual((summary['processed'], summary['skipped']), (1, 2))
+        entries = self._checkpoint()
+        self.assertEqual(entries[0]['pipeline'], "CannyPipeline")
+        self.assertEqual(sorted(os.path.basename(entry['image'])
+                                for entry in entries[1:]),
+                         ["a.png", "b.png", "c.png"])
+
+    def test_interrupted_checkpoint(self):
+        """test a truncated checkpoint line and failed images are redone"""
+        run_batch("CannyPipeline", self.images, self.output, self.args,
+                  workers=1, stream=None)
+        lines = open(os.path.join(self.output, CHECKPOINT_FILE)).readlines()
+        with open(os.path.join(self.output, CHECKPOINT_FILE), 'w') as cut:
+            cut.writelines(lines[:2] + [lines[2][:10]])
+        with open(os.path.join(self.images, "notes.txt"), "w") as txt:
+            txt.write("not an image")
+        summary = run_batch("CannyPipeline", self.images, self.output,
+                            self.args, workers=1, stream=None)
+        self.assertEqual((summary['processed'], summary['skipped'],
+                          summary['failed']), (1, 1, 1))
+        summary = run_batch("CannyPipeline", self.images, self.output,
+                            self.args, workers=1, stream=None)
+        self.assertEqual((summary['processed'], summary['skipped'],
+                          summary['failed']), (0, 2, 1))
+
+    def test_other_settings(self):
+        """test a checkpoint of other settings is not resumed"""
+        run_batch("CannyPipeline", self.images, self.output, self.args,
+                  workers=1, stream=None)
+        self.assertRaises(ValueError, run_batch, "CannyPipeline",
+                          self.images, self.output, [[100, 180], 3, 3, 1, 1],
+                          workers=1, stream=None)
+        summary = run_batch("CannyPipeline", self.images, self.output,
+                            [[100, 180], 3, 3, 1, 1], workers=1,
+                            restart=True, stream=None)
+        self.assertEqual(summary['processed'], 2)
+
+    def test_manifest(self):
+        """test the command line with a manifest of relative paths"""
+        manifest = os.path.join(self.data_path, "manifest.txt")
+        with open(manifest, "w") as manifest_file:
+            manifest_file.write("# images\nimages/b.png\n\n")
+        self.assertEqual(main(["CannyPipeline", manifest, self.output,
+                               "--args", json.dumps(self.args),
+                               "--workers", "1"]), 0)
+        self.assertEqual(ResultStore(self.output).names(), ["b.png"])
+
+        other = os.path.join(self.data_path, "other")
+        os.makedirs(other)
+        shutil.copy(os.path.join(self.images, "a.png"),
+                    os.path.join(other, "b.png"))
+        with open(manifest, "w") as manifest_file:
+            manifest_file.write("images/b.png\nother/b.png\n")
+        with self.assertRaises(ValueError):
+            run_batch("CannyPipeline", manifest, self.output, self.args,
+                      workers=1, stream=None)
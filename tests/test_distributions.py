@@ -0,0 +1,101 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from bubblekicker.bubblekicker import bubble_properties_plot
+from bubblekicker.distributions import (RunningMoments, QuantileSketch,
+                                        PropertyAccumulator)
+
+
+def _property_table(values):
+    """property table with the given equivalent diameters"""
+    return pd.DataFrame({"equivalent_diameter": values,
+                         "area": np.pi * np.asarray(values) ** 2 / 4.})
+
+
+class TestRunningMoments(unittest.TestCase):
+
+    def test_merge(self):
+        """test merged moments against the moments of all values"""
+        values = np.random.RandomState(1).gamma(2., 5., 1000)
+        first, second = RunningMoments(), RunningMoments()
+        first.add(values[:300])
+        second.add(values[300:])
+        first.merge(second)
+        self.assertEqual(first.count, 1000)
+        self.assertAlmostEqual(first.mean, values.mean())
+        self.assertAlmostEqual(first.std, values.std(ddof=1))
+        self.assertEqual(first.max, values.max())
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+    def test_relative_accuracy(self):
+        """test the quantiles are within the relative accuracy"""
+        values = np.random.RandomState(2).lognormal(2., 0.5, 5000)
+        sketch = QuantileSketch(relative_accuracy=0.01)
+        sketch.add(values)
+        for q in [0.1, 0.5, 0.9, 0.99]:
+            exact = np.percentile(values, 100 * q, interpolation='lower')
+            self.assertLess(abs(sketch.quantile(q) - exact) / exact, 0.0101)
+
+    def test_zeros(self):
+        """test zero values are handled separately"""
+        sketch = QuantileSketch()
+        sketch.add([0., 0., 0., 5.])
+        self.assertEqual(sketch.quantile(0.5), 0.)
+
+
+class TestPropertyAccumulator(unittest.TestCase):
+
+    def setUp(self):
+        values = np.random.RandomState(3).gamma(3., 4., 2000)
+        self.tables = [_property_table(part)
+                       for part in np.array_split(values, 4)]
+        self.values = values
+
+    def test_histogram(self):
+        """test the fixed bin histogram against numpy"""
+        accumulator = PropertyAccumulator()
+        for table in self.tables:
+            accumulator.add(table)
+        counts, edges = accumulator.histogram("equivalent_diameter")
+        expected, _ = np.histogram(self.values, edges)
+        np.testing.assert_array_equal(counts, expected)
+        self.assertEqual(accumulator.n_images, 4)
+
+    def test_merge(self):
+        """test merging accumulators of parallel workers"""
+        full, first, second = (PropertyAccumulator(), PropertyAccumulator(),
+                               PropertyAccumulator())
+        for index, table in enumerate(self.tables):
+            full.add(table)
+            (first if index % 2 else second).add(table)
+        first.merge(second)
+        pd.testing.assert_series_equal(first.summary("area"),
+                                       full.summary("area"))
+        np.testing.assert_array_equal(first.histogram("area")[0],
+                                      full.histogram("area")[0])
+
+    def test_different_bins(self):
+        """test accumulators with different bins cannot be merged"""
+        with self.assertRaises(ValueError):
+            PropertyAccumulator(bins={"area": [0, 1, 2]}).merge(
+                PropertyAccumulator())
+
+    def test_plot(self):
+        """test the distribution plot from an accumulator and a table"""
+        accumulator = PropertyAccumulator()
+        accumulator.add(self.tables[0])
+        fig, (ax1, ax2) = bubble_properties_plot(accumulator)
+        self.assertEqual(len(ax1.patches), 100)
+        fig, (ax1, ax2) = bubble_properties_plot(self.tables[0], bins=20)
+        self.assertEqual(len(ax1.patches), 20)
+        for empty in [PropertyAccumulator(), self.tables[0].iloc[:0]]:
+            fig, (ax1, ax2) = bubble_properties_plot(empty)
+            self.assertTrue(np.isfinite(ax1.get_xlim()).all())
+        plt.close('all')
@@ -0,0 +1,145 @@
+import os
+import unittest
+
+import numpy as np
+import cv2 as cv
+from skimage.segmentation import clear_border
+
+from bubblekicker.bubblekicker import BubbleKicker, bubble_properties_calculate
+from bubblekicker.executor import StepExecutor, clear_border_labels
+from bubblekicker.pipelines import CannyPipeline, AdaptiveThresholdPipeline
+
+SAMPLE_IMAGE = os.path.join(os.path.dirname(__file__), '..', 'drafts',
+                            '0325097m_0305.tif')
+
+
+class TestStepExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = StepExecutor()
+
+    def _compare(self, pipeline, steps, read_mode='color'):
+        """compare the executor with the BubbleKicker methods"""
+        expected = pipeline(SAMPLE_IMAGE, read_mode=read_mode)
+        expected.apply_steps(steps)
+        bubbler = pipeline(SAMPLE_IMAGE, read_mode=read_mode)
+        raw = bubbler.raw_image.copy()
+        result = bubbler.apply_steps(steps, executor=self.executor)
+        np.testing.assert_array_equal(result, expected.current_image)
+        self.assertEqual(result.dtype, expected.current_image.dtype)
+        self.assertEqual(bubbler.logs.log, expected.logs.log)
+        # the raw image is never changed
+        np.testing.assert_array_equal(bubbler.raw_image, raw)
+        return result
+
+    def test_canny_pipeline(self):
+        """test the Canny pipeline is bit-identical"""
+        for threshold in [[120, 180], [30, 80]]:
+            self._compare(CannyPipeline,
+                          CannyPipeline.steps(threshold, 3, 3, 1, 1))
+
+    def test_adaptive_threshold_pipeline(self):
+        """test the adaptive threshold pipeline is bit-identical"""
+        self._compare(AdaptiveThresholdPipeline,
+                      AdaptiveThresholdPipeline.steps(91, 18, 3, 1, 1, 1),
+                      read_mode='channel')
+
+    def test_in_place_first_step(self):
+        """test in-place steps on the input image work on a copy"""
+        self._compare(BubbleKicker, [('fill_holes_opencv', {}),
+                                     ('clear_border_skimage', {}),
+                                     ('dilate_opencv', {})])
+
+    def test_buffers_reused(self):
+        """test the buffers are reused and reallocated on a new size"""
+        image = np.random.RandomState(4).randint(0, 255, (60, 80))
+        image = image.astype(np.uint8)
+        steps = CannyPipeline.steps([30, 80], 3, 3, 1, 1)
+        first, _ = self.executor.run(image, steps)
+        self.assertTrue(self.executor.owns(first))
+        second, _ = self.executor.run(image, steps)
+        self.assertIs(second, first)
+        third, _ = self.executor.run(image[:, :70].copy(), steps)
+        self.assertEqual(third.shape, (60, 70))
+        self.assertFalse(self.executor.owns(first))
+
+    def test_unsupported_step(self):
+        """test steps without buffered implementation are refused"""
+        image = np.zeros((10, 10), np.uint8)
+        with self.assertRaises(ValueError):
+            self.executor.run(image, [('dilate_skimage', {})])
+
+
+class TestClearBorderLabels(unittest.TestCase):
+
+    def setUp(self):
+        bubbler = CannyPipeline(SAMPLE_IMAGE, read_mode='channel')
+        self.steps = CannyPipeline.steps([120, 180], 3, 3, 1, 1)
+        self.edges = bubbler.apply_steps(self.steps[:3]).copy()
+
+    def _check_labels(self, result, labels):
+        nbubbles, marker_image, stats, centroids = \
+            cv.connectedComponentsWithStats(1 - result)
+        self.assertEqual(labels[0], nbubbles)
+        np.testing.assert_array_equal(labels[1], marker_image)
+        np.testing.assert_array_equal(labels[2], stats)
+        np.testing.assert_array_equal(labels[3][1:], centroids[1:])
+
+    def test_skimage_identical(self):
+        """test the result is bit-identical to skimage clear_border"""
+        binary = (self.edges > 0).astype(np.uint8)
+        for image in [self.edges, binary]:
+            for buffer_size, bgval in [(3, 1), (0, 1), (5, 0), (1, 7)]:
+                expected = clear_border(cv.bitwise_not(image),
+                                        buffer_size=buffer_size,
+                                        bgval=bgval)
+                result, labels = clear_border_labels(image, buffer_size,
+                                                     bgval)
+                np.testing.assert_array_equal(result, expected)
+                self.assertEqual(result.dtype, expected.dtype)
+                if labels is not None:
+                    self._check_labels(result, labels)
+        with self.assertRaises(ValueError):
+            clear_border_labels(self.edges, max(self.edges.shape))
+
+    def test_shared_labels(self):
+        """test the labels are shared only when they match the result"""
+        result, labels = clear_border_labels(self.edges, 3, 1)
+        self._check_labels(result, labels)
+        # cleared objects of value 0 are labeled as bubbles
+        self.assertIsNone(clear_border_labels(self.edges, 3, 0)[1])
+        # 0/1 images are cleared with skimage
+        binary = (self.edges > 0).astype(np.uint8)
+        self.assertIsNone(clear_border_labels(binary, 3, 1)[1])
+        # edges away from the border are kept and merge with the bubbles
+        ring = np.zeros((20, 20), np.uint8)
+        cv.circle(ring, (10, 10), 5, 255)
+        result, labels = clear_border_labels(ring, 2, 1)
+        self.assertIn(0, result)
+        self.assertIsNone(labels)
+
+    def test_pipeline_labels(self):
+        """test the pipelines hand over the labels of their result"""
+        for executor in [None, StepExecutor()]:
+            bubbler = CannyPipeline(SAMPLE_IMAGE, read_mode='channel')
+            result = bubbler.apply_steps(self.steps, executor=executor)
+            labels = bubbler.pop_labels()
+            self._check_labels(result, labels)
+            self.assertIsNone(bubbler.pop_labels())
+            for engine in ['opencv', 'regionprops']:
+                id_image, table = bubble_properties_calculate(
+                    result, engine=engine)
+                shared = bubble_properties_calculate(
+                    result, engine=engine,
+                    labels=(labels[0], labels[1].copy(), labels[2],
+                            labels[3]))
+                np.testing.assert_array_equal(shared[0], id_image)
+                self.assertTrue(shared[1].equals(table))
+
+        # the labels no longer apply after a step changing the image
+        bubbler = CannyPipeline(SAMPLE_IMAGE, read_mode='channel')
+        bubbler.apply_steps(CannyPipeline.steps([120, 180], 3, 3, 1, 3))
+        self.assertIsNone(bubbler.pop_labels())
+        bubbler.reset_to_raw()
+        bubbler.apply_steps(self.steps[:4] + [('fill_holes_opencv', {})])
+        self.assertIsNone(bubbler.pop_labels())
@@ -1,7 +1,13 @@
 
+import os
+import shutil
+import tempfile
 import unittest
 
-from bubblekicker.bubblekicker import BubbleKicker
+import numpy as np
+import cv2 as cv
+
+from bubblekicker.bubblekicker import BubbleKicker, NotAllowedChannel
 
 
 class TestBubbleKicker(unittest.TestCase):
@@ -16,4 +22,62 @@ class TestBubbleKicker(unittest.TestCase):
     #     # outcome:
     #
     #     self.assertEquals()
-    #
\ No newline at end of file
+    #
+
+
+class TestReadModes(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.image = np.zeros((40, 60, 3), np.uint8)
+        self.image[:, :, 0] = 10
+        self.image[:, :, 1] = 20
+        self.image[10:30, 10:30, 2] = 200
+        self.filename = os.path.join(self.tempdir, "bubbles.png")
+        cv.imwrite(self.filename, self.image)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_channel_mode(self):
+        """test only the requested channel is kept in memory"""
+        bubbler = BubbleKicker(self.filename, channel='red',
+                               read_mode='channel')
+        self.assertEqual(bubbler.raw_file.shape, (40, 60))
+        np.testing.assert_array_equal(bubbler.raw_image, self.image[:, :, 2])
+        bubbler.switch_channel('green')
+        np.testing.assert_array_equal(bubbler.current_image,
+                                      self.image[:, :, 1])
+
+    def test_grayscale_mode(self):
+        """test the grayscale read has no channels to switch"""
+        bubbler = BubbleKicker(self.filename, read_mode='grayscale')
+        self.assertEqual(bubbler.raw_image.shape, (40, 60))
+        with self.assertRaises(NotAllowedChannel):
+            bubbler.switch_channel('green')
+
+    def test_mmap_mode(self):
+        """test the memory-mapped read of a numpy file"""
+        npy_file = os.path.join(self.tempdir, "bubbles.npy")
+        np.save(npy_file, self.image)
+        bubbler = BubbleKicker(npy_file, channel='green', read_mode='mmap')
+        self.assertIsInstance(bubbler.raw_file, np.memmap)
+        np.testing.assert_array_equal(bubbler.raw_image, self.image[:, :, 1])
+        bubbler.fill_holes_opencv()
+        self.assertFalse(np.may_share_memory(bubbler.current_image,
+                                             bubbler.raw_image))
+
+    def test_copy_on_write(self):
+        """test the raw image is shared until a step changes it in place"""
+        bubbler = BubbleKicker(self.filename, channel='blue')
+        self.assertIs(bubbler.current_image, bubbler.raw_image)
+        bubbler.fill_holes_opencv()
+        np.testing.assert_array_equal(bubbler.raw_image, self.image[:, :, 0])
+        self.assertTrue((bubbler.current_image == 0).all())
+        bubbler.reset_to_raw()
+        self.assertIs(bubbler.current_image, bubbler.raw_image)
+
+    def test_unknown_read_mode(self):
+        """test an unknown read mode raises"""
+        with self.assertRaises(ValueError):
+            BubbleKicker(self.filename, read_mode='lazy')
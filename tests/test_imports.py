@@ -0,0 +1,46 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'benchmarks'))
+
+from import_time import MODULES, ROOT, import_time
+
+# clear border with both implementations in a fresh interpreter, reporting
+# whether scikit-image was loaded before and after the first call
+_LAZY_SCRIPT = """
+import json, sys
+import numpy as np
+from bubblekicker.bubblekicker import BubbleKicker
+from bubblekicker.executor import StepExecutor
+
+image = np.zeros((20, 20), np.uint8)
+image[5:10, 5:10] = 1
+before = 'skimage' in sys.modules
+expected = BubbleKicker.from_array(image).clear_border_skimage(3, 1)
+after = 'skimage' in sys.modules
+result, _ = StepExecutor().run(image, [('clear_border_skimage', {})])
+print(json.dumps({"before": before, "after": after,
+                  "equal": bool((result == expected).all())}))
+"""
+
+
+class TestLazyImports(unittest.TestCase):
+
+    def test_no_lazy_dependencies(self):
+        """importing the modules leaves pyplot and scikit-image unloaded"""
+        for module in MODULES:
+            _, loaded = import_time(module, repeat=1)
+            self.assertEqual(loaded, [], "{} imports {}".format(
+                module, ", ".join(loaded)))
+
+    def test_lazy_functions(self):
+        """the lazily imported dependencies are loaded on first use"""
+        output = subprocess.check_output([sys.executable, '-c',
+                                          _LAZY_SCRIPT], cwd=ROOT)
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        self.assertEqual(result, {"before": False, "after": True,
+                                  "equal": True})
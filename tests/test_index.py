@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from bubblekicker.bubblekicker import (DEFAULT_FILTERS,
+                                       _bubble_properties_filter,
+                                       bubble_properties_calculate,
+                                       bubble_properties_summary)
+from bubblekicker.index import BubbleIndex, INDEXED_PROPERTIES
+from bubblekicker.pipelines import CannyPipeline
+from bubblekicker.storage import ResultStore
+from bubblekicker.synthetic import synthetic_bubble_image
+
+
+class TestBubbleIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.binaries = {}
+        self.tables = {}
+        for seed in range(3):
+            image, _ = synthetic_bubble_image((200, 260), 25, seed=seed)
+            name = "frame_{}.png".format(seed)
+            self.binaries[name] = CannyPipeline.from_array(image).run(
+                [120, 180], 3, 3, 1, 1)
+            self.tables[name] = bubble_properties_calculate(
+                self.binaries[name], rules={}, engine='opencv')[1]
+        self.index = BubbleIndex(os.path.join(self.tempdir, "bubbles.db"))
+        for name, table in self.tables.items():
+            self.index.add(name, table)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tempdir)
+
+    def _filtered(self, rules):
+        """filtered property tables of the images"""
+        filtered = {}
+        for name, table in self.tables.items():
+            filtered[name] = _bubble_properties_filter(
+                table, np.zeros((1, 1), np.int32), rules)[1]
+        return filtered
+
+    def _assert_tables_equal(self, result, expected):
+        self.assertEqual(list(result.index), list(expected.index))
+        self.assertEqual(list(result.columns), list(expected.columns))
+        self.assertEqual(list(result["centroid"]),
+                         list(expected["centroid"]))
+        np.testing.assert_allclose(
+            result.drop("centroid", axis=1).values.astype(np.double),
+            expected.drop("centroid", axis=1).values.astype(np.double),
+            rtol=0, atol=0)
+
+    def test_rules(self):
+        """test the queries give the filtered property tables"""
+        for rules in [DEFAULT_FILTERS, {}, {"area": {"min": 50},
+                                            "convexity": {"max": 1.1}}]:
+            query = self.index.query(rules)
+            counts = self.index.counts(rules)
+            for name, expected in self._filtered(rules).items():
+                self.assertEqual(counts[name], len(expected))
+                if len(expected) == 0:
+                    self.assertNotIn(name, query.index.get_level_values(0))
+                    continue
+                self._assert_tables_equal(query.loc[name], expected)
+        with self.assertRaises(ValueError):
+            self.index.query({"colour": {"min": 1}})
+        with self.assertRaises(Exception):
+            self.index.query({"area": {"above": 1}})
+
+    def test_expression_rules(self):
+        """test the extra SQL expression of a query"""
+        query = self.index.query(
+            {}, where="area > 4 * perimeter AND name != 'frame_0.png'")
+        self.assertNotIn("frame_0.png", query.index.get_level_values(0))
+        for name in ["frame_1.png", "frame_2.png"]:
+            table = self.tables[name]
+            expected = table[table["area"] > 4 * table["perimeter"]]
+            self._assert_tables_equal(query.loc[name], expected)
+        counts = self.index.counts(DEFAULT_FILTERS,
+                                   "equivalent_diameter > 1e6")
+        self.assertEqual(list(counts), [0, 0, 0])
+        self.assertEqual(list(counts.index), sorted(self.tables))
+
+    def test_affected_images(self):
+        """test the changes of the bubble selection of each image"""
+        rules = {"convexity": {"min": 0.95}}
+        reference = self._filtered(DEFAULT_FILTERS)
+        new = self._filtered(rules)
+        affected = self.index.affected_images(rules)
+        for name in self.tables:
+            added = len(set(new[name].index) - set(reference[name].index))
+            removed = len(set(reference[name].index) - set(new[name].index))
+            if added + removed == 0:
+                self.assertNotIn(name, affected.index)
+                continue
+            self.assertEqual(list(affected.loc[name]),
+                             [len(reference[name]), len(new[name]), added,
+                              removed])
+        self.assertEqual(len(self.index.affected_images(DEFAULT_FILTERS)), 0)
+
+    def test_distributions(self):
+        """test the summary and histogram of the filtered bubbles"""
+        values = pd.concat(self._filtered(DEFAULT_FILTERS).values())
+        pd.testing.assert_series_equal(
+            self.index.summary(),
+            bubble_properties_summary(values))
+        counts, edges = self.index.histogram("area", bins=10)
+        expected_counts, expected_edges = np.histogram(values["area"],
+                                                       bins=10)
+        np.testing.assert_array_equal(counts, expected_counts)
+        np.testing.assert_allclose(edges, expected_edges)
+
+    def test_selective_rules(self):
+        """test a selective rule uses its property index"""
+        self.assertIn("INDEXED BY bubbles_area",
+                      self.index._bubbles_source({"area": {"max": 2},
+                                                  "convexity": {"min": 0}}))
+        self.assertIn("NOT INDEXED",
+                      self.index._bubbles_source(DEFAULT_FILTERS))
+
+    def test_persistence(self):
+        """test the index is reopened, replaced and removed per image"""
+        path = self.index.path
+        self.index.close()
+        self.index = BubbleIndex(path)
+        self.assertEqual(self.index.names(), sorted(self.tables))
+        self.assertEqual(len(self.index),
+                         sum(len(table) for table in self.tables.values()))
+        table = self.tables["frame_1.png"]
+        self.index.add("frame_1.png", table.iloc[:3])
+        self.assertEqual(self.index.counts({})["frame_1.png"], 3)
+        self.index.remove("frame_1.png")
+        self.assertNotIn("frame_1.png", self.index)
+        self.assertEqual(len(self.index),
+                         len(self.tables["frame_0.png"]) +
+                         len(self.tables["frame_2.png"]))
+
+    def test_add_store(self):
+        """test indexing a result store in bulk"""
+        store = ResultStore(os.path.join(self.tempdir, "store"))
+        for name, binary in self.binaries.items():
+            store.write(name, binary)
+        with BubbleIndex() as index:
+            self.assertEqual(index.add_store(store), 3)
+            indexes = [name for name, in index._connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index'")]
+            for prop_name in INDEXED_PROPERTIES:
+                self.assertIn("bubbles_" + prop_name, indexes)
+            query = index.query()
+            for name in store.names():
+                self._assert_tables_equal(query.loc[name],
+                                          store.read_table(name))
+        with BubbleIndex(engine='regionprops') as index:
+            self.assertRaises(ValueError, index.add_store, store)
@@ -1,6 +1,13 @@
+import os
+import json
 import unittest
 
-from bubblekicker.bubblekicker import Logger
+from bubblekicker.bubblekicker import Logger, STEP_HOOKS, step_profile
+from bubblekicker.executor import StepExecutor
+from bubblekicker.pipelines import CannyPipeline
+
+SAMPLE_IMAGE = os.path.join(os.path.dirname(__file__), '..', 'drafts',
+                            '0325097m_0305.tif')
 
 class TestLogger(unittest.TestCase):
 
@@ -26,3 +33,64 @@ class TestLogger(unittest.TestCase):
         self.assertEqual(self.testlog.log, [])
 
 
+class TestStepRecords(unittest.TestCase):
+
+    def setUp(self):
+        self.bubbler = CannyPipeline(SAMPLE_IMAGE, read_mode='channel')
+
+    def test_records(self):
+        """test each pipeline step adds a record with its log message"""
+        result = self.bubbler.run([120, 180], 3, 3, 1, 1)
+        logs = self.bubbler.logs
+        self.assertEqual([record["message"] for record in logs.records],
+                         logs.log)
+        last = logs.records[-1]
+        self.assertEqual(last["step"], "erode_opencv")
+        self.assertEqual(last["params"], {"footprintsize": 1})
+        self.assertEqual(last["shape"], result.shape)
+        self.assertEqual(last["dtype"], "uint8")
+        self.assertEqual(last["allocated"], result.nbytes)
+        self.assertGreaterEqual(last["wall_time"], 0.)
+        # flood fill works in place on the edge image
+        self.assertEqual(logs.records[2]["allocated"], 0)
+
+    def test_export(self):
+        """test the records are exported as DataFrame and JSON"""
+        self.bubbler.run([120, 180], 3, 3, 1, 1)
+        table = self.bubbler.logs.to_dataframe()
+        self.assertEqual(list(table["step"])[:2],
+                         ["edge_detect_canny_opencv", "dilate_opencv"])
+        self.assertEqual(len(json.loads(self.bubbler.logs.to_json())), 5)
+        self.bubbler.reset_to_raw()
+        self.assertEqual(len(self.bubbler.logs.to_dataframe()), 0)
+
+    def test_executor_records(self):
+        """test the executor adds the same step records"""
+        self.bubbler.apply_steps(CannyPipeline.steps([120, 180], 3, 3, 1, 1),
+                                 executor=StepExecutor())
+        records = self.bubbler.logs.records
+        self.assertEqual(len(records), 5)
+        self.assertEqual(records[0]["params"], {"threshold": [120, 180]})
+        self.assertGreater(records[0]["allocated"], 0)
+        self.assertEqual(records[1]["allocated"], 0)
+
+    def test_hook(self):
+        """test the step hooks receive the records"""
+        received = []
+        STEP_HOOKS.append(received.append)
+        try:
+            self.bubbler.dilate_opencv(3)
+        finally:
+            STEP_HOOKS.remove(received.append)
+        self.assertEqual(received, self.bubbler.logs.records)
+
+    def test_step_profile(self):
+        """test the aggregation of the records per step"""
+        records = []
+        for _ in range(2):
+            self.bubbler.reset_to_raw()
+            self.bubbler.run([120, 180], 3, 3, 1, 1)
+            records.extend(self.bubbler.logs.records)
+        profile = step_profile(records)
+        self.assertEqual(len(profile), 5)
+        self.assertTrue((profile["count"] == 2).all())
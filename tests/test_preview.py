@@ -0,0 +1,89 @@
+import unittest
+
+import numpy as np
+
+from bubblekicker.bubblekicker import (bubble_properties_calculate,
+                                       bubble_properties_summary)
+from bubblekicker.pipelines import CannyPipeline
+from bubblekicker.preview import PreviewKicker, pyramid_level, scale_steps
+from bubblekicker.synthetic import synthetic_bubble_image
+
+
+class TestPreview(unittest.TestCase):
+
+    def setUp(self):
+        self.image, self.truth = synthetic_bubble_image(
+            (400, 600), 60, diameter_range=(20., 60.), seed=2)
+        self.args = ([120, 180], 3, 3, 1, 1)
+
+    def test_scale_steps(self):
+        """test the size parameters are scaled and kept valid"""
+        steps = scale_steps([('adaptive_threshold_opencv',
+                              {'blocksize': 91, 'cvalue': 18}),
+                             ('dilate_opencv', {'footprintsize': 9}),
+                             ('erode_opencv', {'footprintsize': 1}),
+                             ('clear_border_skimage', {'buffer_size': 1}),
+                             ('fill_holes_opencv', {})], 4)
+        self.assertEqual(steps,
+                         [('adaptive_threshold_opencv',
+                           {'blocksize': 23, 'cvalue': 18}),
+                          ('dilate_opencv', {'footprintsize': 2}),
+                          ('erode_opencv', {'footprintsize': 1}),
+                          ('clear_border_skimage', {'buffer_size': 1,
+                                                    'bgval': 1}),
+                          ('fill_holes_opencv', {})])
+        self.assertEqual(scale_steps([('adaptive_threshold_opencv',
+                                       {'blocksize': 5})], 8)[0][1]
+                         ['blocksize'], 3)
+
+    def test_pyramid_level(self):
+        """test the size of the reduced image"""
+        self.assertEqual(pyramid_level(self.image[:, :, 2], 2).shape,
+                         (100, 150))
+
+    def test_full_resolution_steps(self):
+        """test the recorded steps reproduce the pipeline at full
+        resolution"""
+        bubbler = CannyPipeline.from_array(self.image)
+        preview = PreviewKicker(bubbler, level=1)
+        preview.edge_detect_canny_opencv(self.args[0])
+        preview.apply_steps(CannyPipeline.steps(*self.args)[1:])
+        self.assertEqual(preview.current_image.shape, (200, 300))
+        self.assertEqual(preview.steps,
+                         [(name, CannyPipeline.step_parameters(name, params))
+                          for name, params in
+                          CannyPipeline.steps(*self.args)])
+        self.assertEqual(bubbler.logs.log, [])
+        result = preview.apply_full_resolution()
+        expected = CannyPipeline.from_array(self.image).run(*self.args)
+        np.testing.assert_array_equal(result, expected)
+        np.testing.assert_array_equal(preview.apply_full_resolution(),
+                                      expected)
+        self.assertEqual(len(bubbler.logs.log),
+                         len(CannyPipeline.steps(*self.args)))
+
+        preview.reset_to_raw()
+        self.assertEqual(preview.steps, [])
+        self.assertRaises(AttributeError, getattr, preview, 'no_step')
+
+    def test_statistics_within_expected_error(self):
+        """test the preview statistics against full resolution"""
+        bubbler = CannyPipeline.from_array(self.image)
+        _, table = bubble_properties_calculate(bubbler.run(*self.args),
+                                               engine='opencv')
+        full = bubble_properties_summary(table)
+
+        bubbler.reset_to_raw()
+        preview = PreviewKicker(bubbler, level=1)
+        preview.apply_steps(CannyPipeline.steps(*self.args))
+        statistics = preview.bubble_statistics()
+        self.assertEqual(list(statistics.columns),
+                         ["preview", "expected_error"])
+        for statistic in ["mean", "p50"]:
+            self.assertLessEqual(abs(statistics.loc[statistic, "preview"] -
+                                     full[statistic]),
+                                 statistics.loc[statistic, "expected_error"])
+        self.assertLessEqual(abs(statistics.loc["count", "preview"] -
+                                 full["count"]),
+                             max(statistics.loc["count", "expected_error"],
+                                 0.05 * full["count"]))
@@ -0,0 +1,117 @@
+import os
+import unittest
+
+import numpy as np
+import pandas as pd
+import cv2 as cv
+
+from bubblekicker.bubblekicker import (_bubble_properties_filter,
+                                       _bubble_properties_table,
+                                       bubble_properties_calculate)
+from bubblekicker.pipelines import CannyPipeline
+
+SAMPLE_IMAGE = os.path.join(os.path.dirname(__file__), '..', 'drafts',
+                            '0325097m_0305.tif')
+
+
+class TestBubblePropertiesFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.id_image = np.array([[1, 1, 0, 2],
+                                  [0, 3, 0, 2],
+                                  [4, 0, 5, 5]], dtype=np.int32)
+        self.table = pd.DataFrame({"area": [2, 2, 1, 1, 2],
+                                   "convexity": [0.5, 1.0, 0.95, 0.8, 1.2]},
+                                  index=pd.Index([1, 2, 3, 4, 5],
+                                                 name="label"))
+
+    def test_min_max_rules(self):
+        """test the combined min and max rules and the label removal"""
+        rules = {"convexity": {"min": 0.9, "max": 1.1}}
+        id_image, props = _bubble_properties_filter(self.table,
+                                                    self.id_image.copy(),
+                                                    rules)
+        self.assertEqual(props.index.tolist(), [2, 3])
+        np.testing.assert_array_equal(id_image,
+                                      [[0, 0, 0, 2],
+                                       [0, 3, 0, 2],
+                                       [0, 0, 0, 0]])
+
+    def test_relabel(self):
+        """test the compaction of the remaining labels to 1..K"""
+        rules = {"area": {"min": 1}}
+        id_image, props = _bubble_properties_filter(self.table,
+                                                    self.id_image.copy(),
+                                                    rules, relabel=True)
+        self.assertEqual(props.index.tolist(), [1, 2, 3])
+        self.assertEqual(props["convexity"].tolist(), [0.5, 1.0, 1.2])
+        np.testing.assert_array_equal(id_image,
+                                      [[1, 1, 0, 2],
+                                       [0, 0, 0, 2],
+                                       [0, 0, 3, 3]])
+
+    def test_no_rules(self):
+        """test an empty ruleset keeps all bubbles"""
+        id_image, props = _bubble_properties_filter(self.table,
+                                                    self.id_image.copy(),
+                                                    {})
+        pd.testing.assert_frame_equal(props, self.table)
+        np.testing.assert_array_equal(id_image, self.id_image)
+
+    def test_unsupported_rule(self):
+        """test an unknown rule raises"""
+        with self.assertRaises(Exception):
+            _bubble_properties_filter(self.table, self.id_image.copy(),
+                                      {"area": {"mean": 1}})
+
+
+class TestBubblePropertiesEngine(unittest.TestCase):
+
+    def assert_same_properties(self, binary_image):
+        """compare the opencv engine against the regionprops output"""
+        n_ref, labels_ref, props_ref = _bubble_properties_table(binary_image)
+        n_cv, labels_cv, props_cv = \
+            _bubble_properties_table(binary_image, engine='opencv')
+        self.assertEqual(n_ref, n_cv)
+        np.testing.assert_array_equal(labels_ref, labels_cv)
+        self.assertEqual(list(props_ref.columns), list(props_cv.columns))
+        np.testing.assert_array_equal(props_ref.index, props_cv.index)
+        for column in ["area", "convex_area"]:
+            np.testing.assert_array_equal(props_ref[column],
+                                          props_cv[column])
+        for column in ["equivalent_diameter", "perimeter", "convexity",
+                       "circularity_reciprocal"]:
+            np.testing.assert_allclose(props_ref[column], props_cv[column])
+        np.testing.assert_allclose(np.array(props_ref["centroid"].tolist()),
+                                   np.array(props_cv["centroid"].tolist()))
+
+    def test_parity_shapes(self):
+        """test the engines on disks, ellipses and a bubble with a hole"""
+        binary_image = np.ones((80, 120), np.uint8)
+        cv.circle(binary_image, (20, 20), 9, 0, -1)
+        cv.ellipse(binary_image, (70, 30), (25, 8), 30, 0, 360, 0, -1)
+        cv.circle(binary_image, (60, 60), 12, 0, -1)
+        cv.circle(binary_image, (60, 60), 5, 1, -1)
+        cv.circle(binary_image, (60, 60), 2, 0, -1)
+        cv.rectangle(binary_image, (100, 50), (110, 52), 0, -1)
+        self.assert_same_properties(binary_image)
+
+    def test_parity_pipeline(self):
+        """test the engines on the bubbles of the sample image"""
+        bubbler = CannyPipeline(SAMPLE_IMAGE, channel='red')
+        self.assert_same_properties(bubbler.run([30, 80], 3, 3, 1, 1))
+
+    def test_filter_engine(self):
+        """test the filtered output of both engines"""
+        bubbler = CannyPipeline(SAMPLE_IMAGE, channel='red')
+        result = bubbler.run([120, 180], 3, 3, 1, 1)
+        id_ref, props_ref = bubble_properties_calculate(result.copy())
+        id_cv, props_cv = bubble_properties_calculate(result.copy(),
+                                                      engine='opencv')
+        np.testing.assert_array_equal(id_ref, id_cv)
+        np.testing.assert_array_equal(props_ref.index, props_cv.index)
+
+    def test_unknown_engine(self):
+        """test an unknown engine raises"""
+        with self.assertRaises(ValueError):
+            _bubble_properties_table(np.ones((5, 5), np.uint8), engine='x')
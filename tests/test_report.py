@@ -0,0 +1,89 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.image as mpimg
+
+from bubblekicker.report import (DistributionRenderer, binned_distributions,
+                                 shared_bin_edges, write_report)
+
+
+class TestReport(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        random = np.random.RandomState(7)
+        self.groups = [("image_{}".format(index),
+                        pd.DataFrame({"equivalent_diameter":
+                                      random.gamma(3., 4., 50 * index + 10),
+                                      "area": random.gamma(2., 50.,
+                                                           50 * index + 10)}))
+                       for index in range(3)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_shared_edges(self):
+        """test the binned distributions use the same edges for all
+        groups"""
+        edges = shared_bin_edges([table for _, table in self.groups],
+                                 bins=10)
+        distributions = binned_distributions(self.groups,
+                                             ["equivalent_diameter"], 10)
+        self.assertEqual(len(distributions), 30)
+        for name, table in self.groups:
+            rows = distributions[distributions["group"] == name]
+            np.testing.assert_array_equal(rows["bin_left"], edges[:-1])
+            expected, _ = np.histogram(table["equivalent_diameter"], edges)
+            np.testing.assert_array_equal(rows["count"], expected)
+            self.assertEqual(rows["cumulative"].values[-1], 1.)
+
+    def test_renderer_reuse(self):
+        """test updating the reused figure equals a fresh render"""
+        edges = np.linspace(0, 10, 11)
+        first = os.path.join(self.tempdir, "first.png")
+        second = os.path.join(self.tempdir, "second.png")
+        renderer = DistributionRenderer()
+        renderer.render(np.arange(10), edges, "area", first, "a")
+        renderer.render(np.arange(10)[::-1] * 3, edges, "area", first, "b")
+        DistributionRenderer().render(np.arange(10)[::-1] * 3, edges,
+                                      "area", second, "b")
+        np.testing.assert_array_equal(mpimg.imread(first),
+                                      mpimg.imread(second))
+
+    def test_write_report(self):
+        """test the plots and tables of a report are written"""
+        distributions = write_report(self.groups, self.tempdir,
+                                     formats=('png', 'svg'), workers=2)
+        for name, _ in self.groups:
+            for which_property in ["equivalent_diameter", "area"]:
+                for plot_format in ['png', 'svg']:
+                    self.assertTrue(os.path.exists(os.path.join(
+                        self.tempdir, "{}_{}.{}".format(
+                            name, which_property, plot_format))))
+        table = pd.read_csv(os.path.join(self.tempdir, "distributions.csv"))
+        np.testing.assert_array_equal(table["count"],
+                                      distributions["count"])
+
+    def test_json_table(self):
+        """test the plot-free JSON output of the distributions"""
+        write_report(self.groups, self.tempdir, formats=(),
+                     table_format='json', bins=5)
+        with open(os.path.join(self.tempdir,
+                               "distributions.json")) as json_file:
+            report = json.load(json_file)
+        self.assertEqual(sorted(report), ["image_0", "image_1", "image_2"])
+        self.assertEqual(len(report["image_1"]["area"]["edges"]), 6)
+        self.assertEqual(sum(report["image_1"]["area"]["counts"]), 60)
+        self.assertEqual(os.listdir(self.tempdir), ["distributions.json"])
+
+    def test_invalid_format(self):
+        """test unsupported plot formats are refused"""
+        with self.assertRaises(ValueError):
+            write_report(self.groups, self.tempdir, formats=('gif',))
@@ -0,0 +1,79 @@
+import unittest
+
+import numpy as np
+import cv2 as cv
+
+from bubblekicker.bubblekicker import bubble_properties_calculate
+from bubblekicker.pipelines import CannyPipeline
+from bubblekicker.sparse import SparseLabels
+from bubblekicker.synthetic import synthetic_bubble_image
+
+
+class TestSparseLabels(unittest.TestCase):
+
+    def setUp(self):
+        image, _ = synthetic_bubble_image((300, 400), 40, seed=4)
+        self.binary = CannyPipeline.from_array(image).run([120, 180], 3, 3,
+                                                          1, 1)
+        self.id_image, self.table = bubble_properties_calculate(
+            self.binary, engine='opencv')
+
+    def test_round_trip(self):
+        """test the label image is rasterized back"""
+        sparse = SparseLabels.from_label_image(self.id_image)
+        np.testing.assert_array_equal(sparse.rasterize(), self.id_image)
+        np.testing.assert_array_equal(sparse.area(), self.table["area"])
+        self.assertLess(sparse.nbytes, self.id_image.nbytes / 20)
+        restored = SparseLabels.from_arrays(sparse.to_arrays())
+        np.testing.assert_array_equal(restored.rasterize(), self.id_image)
+
+    def test_bubble_access(self):
+        """test the bounding box and mask of a single bubble"""
+        sparse = SparseLabels.from_label_image(self.id_image)
+        label = self.table.index[3]
+        row, col, rows, cols = sparse.bbox(label)
+        rows_in, cols_in = np.nonzero(self.id_image == label)
+        self.assertEqual((row, col), (rows_in.min(), cols_in.min()))
+        self.assertEqual((rows, cols), (rows_in.ptp() + 1, cols_in.ptp() + 1))
+        np.testing.assert_array_equal(
+            sparse.mask(label),
+            self.id_image[row:row + rows, col:col + cols] == label)
+        self.assertIn(label, sparse)
+        self.assertNotIn(0, sparse)
+        self.assertRaises(KeyError, sparse.mask, 0)
+
+    def test_selected_labels_and_stats(self):
+        """test a selection of labels with connected component stats"""
+        _, marker_image, stats, _ = cv.connectedComponentsWithStats(
+            1 - self.binary)
+        labels = self.table.index.values[::2]
+        expected = np.where(np.in1d(marker_image, labels).reshape(
+            marker_image.shape), marker_image, 0)
+        for sparse in [SparseLabels.from_label_image(marker_image, labels),
+                       SparseLabels.from_label_image(marker_image, labels,
+                                                     stats)]:
+            np.testing.assert_array_equal(sparse.rasterize(), expected)
+
+    def test_calculate_sparse(self):
+        """test the sparse output of bubble_properties_calculate"""
+        binary = np.ones((50, 60), np.uint8)
+        cv.circle(binary, (20, 20), 8, 0, -1)
+        sparse, table = bubble_properties_calculate(binary, rules={},
+                                                    engine='opencv',
+                                                    sparse=True)
+        id_image, _ = bubble_properties_calculate(binary, rules={},
+                                                  engine='opencv')
+        self.assertEqual(list(sparse.labels), list(table.index))
+        np.testing.assert_array_equal(sparse.rasterize(), id_image)
+        for relabel in [False, True]:
+            sparse, _ = bubble_properties_calculate(
+                self.binary, relabel=relabel, engine='opencv', sparse=True)
+            id_image, _ = bubble_properties_calculate(
+                self.binary, relabel=relabel, engine='opencv')
+            np.testing.assert_array_equal(
+                sparse.boxes, SparseLabels.from_label_image(id_image).boxes)
+
+    def test_empty(self):
+        sparse = SparseLabels.from_label_image(np.zeros((10, 10), np.int32))
+        self.assertEqual(len(sparse), 0)
+        np.testing.assert_array_equal(sparse.rasterize(), 0)
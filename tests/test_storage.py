@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+import cv2 as cv
+
+from bubblekicker.bubblekicker import (ibatchbubblekicker,
+                                       bubble_properties_calculate)
+from bubblekicker.pipelines import CannyPipeline
+from bubblekicker.storage import ResultStore, pack_binary, unpack_binary
+
+
+class TestResultStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.data_path = os.path.join(self.tempdir, "images")
+        os.makedirs(self.data_path)
+        for name, centers in [("a.png", [(40, 40), (100, 70)]),
+                              ("b.png", [(60, 60)])]:
+            image = np.zeros((120, 160, 3), np.uint8)
+            for center in centers:
+                cv.circle(image, center, 12, (200, 200, 200), -1)
+            cv.imwrite(os.path.join(self.data_path, name), image)
+        self.args = ([120, 180], 3, 3, 1, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_pack_binary(self):
+        """test bit-packing restores the image and its values"""
+        image = np.where(np.random.RandomState(5).rand(13, 7) > 0.5,
+                         255, 1).astype(np.uint8)
+        restored = unpack_binary(**pack_binary(image))
+        np.testing.assert_array_equal(restored, image)
+        self.assertEqual(restored.dtype, np.uint8)
+        image[3:5, 2] = 0
+        restored = unpack_binary(**pack_binary(image))
+        np.testing.assert_array_equal(restored, image)
+        self.assertEqual(len(pack_binary(image)['bits']), 23)
+
+    def test_round_trip(self):
+        """test the stored table, images and metadata are read back"""
+        bubbler = CannyPipeline(os.path.join(self.data_path, "a.png"))
+        binary = bubbler.run(*self.args)
+        id_image, expected = bubble_properties_calculate(binary,
+                                                         engine='opencv')
+        store = ResultStore(os.path.join(self.tempdir, "store"),
+                            labels=True)
+        store.write("a.png", binary, {'steps': bubbler.logs.log})
+
+        self.assertEqual(store.names(), ["a.png"])
+        self.assertIn("a.png", store)
+        pd.testing.assert_frame_equal(store.read_table("a.png"), expected)
+        np.testing.assert_array_equal(store.read_binary("a.png"), binary)
+        np.testing.assert_array_equal(store.read_labels("a.png"), id_image)
+        self.assertEqual(list(store.read_sparse_labels("a.png").labels),
+                         list(expected.index))
+        self.assertEqual(store.read_metadata("a.png")['steps'],
+                         bubbler.logs.log)
+        with self.assertRaises(KeyError):
+            store.read_table("c.png")
+
+    def test_rewrite(self):
+        """test the result of an image is replaced when written again"""
+        store = ResultStore(os.path.join(self.tempdir, "store"))
+        for name in ["a.png", "b.png"]:
+            binary = CannyPipeline(os.path.join(self.data_path,
+                                                name)).run(*self.args)
+            store.write("a.png", binary)
+        self.assertEqual(store.names(), ["a.png"])
+        np.testing.assert_array_equal(store.read_binary("a.png"), binary)
+        self.assertEqual(len(store.read_table("a.png")), 1)
+
+    def test_batch_store(self):
+        """test the batch workers write the results in the store"""
+        store = ResultStore(os.path.join(self.tempdir, "store"))
+        results = dict(ibatchbubblekicker(self.data_path, 'red',
+                                          CannyPipeline, self.args,
+                                          workers=2, store=store))
+        self.assertEqual(store.names(), ["a.png", "b.png"])
+        np.testing.assert_array_equal(store.read_binary("b.png"),
+                                      results["b.png"])
+        self.assertEqual(len(store.read_table("a.png")), 2)
+        metadata = store.read_metadata("a.png")
+        self.assertEqual(metadata['pipeline'], 'CannyPipeline')
+        self.assertEqual(len(metadata['steps']), 5)
+        with self.assertRaises(KeyError):
+            store.read_labels("a.png")
+        duplicates = [os.path.join(self.data_path, "a.png"),
+                      os.path.join(self.tempdir, "a.png")]
+        with self.assertRaises(ValueError):
+            list(ibatchbubblekicker(duplicates, 'red', CannyPipeline,
+                                    self.args, workers=1, store=store))
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+import cv2 as cv
+
+from bubblekicker.bubblekicker import bubble_properties_calculate
+from bubblekicker.pipelines import CannyPipeline
+from bubblekicker.streaming import read_frames, stream_bubble_properties
+
+
+def _bubble_frame(index):
+    """dark frame with bright bubbles rising with the frame index"""
+    frame = np.zeros((120, 160, 3), np.uint8)
+    for col in [40, 100]:
+        cv.circle(frame, (col, 90 - 5 * index), 12, (200, 200, 200), -1)
+    return frame
+
+
+class _ReadCounter(list):
+    """list of image file names counting the names taken from it"""
+
+    def __iter__(self):
+        self.taken = 0
+        for filename in list.__iter__(self):
+            self.taken += 1
+            yield filename
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.frames = [_bubble_frame(index) for index in range(12)]
+        for index, frame in enumerate(self.frames):
+            cv.imwrite(os.path.join(self.tempdir,
+                                    "frame_{}.png".format(index)), frame)
+        self.args = ([120, 180], 3, 3, 1, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_read_sequence_order(self):
+        """test the numbered frames are read in frame order"""
+        frames = list(read_frames(os.path.join(self.tempdir, "frame_*.png")))
+        self.assertEqual([index for index, _ in frames], list(range(12)))
+        np.testing.assert_array_equal(frames[10][1], self.frames[10])
+
+    def test_stream_sequence(self):
+        """test the streamed property tables against a direct run"""
+        results = dict(stream_bubble_properties(
+            os.path.join(self.tempdir, "frame_*.png"), CannyPipeline,
+            self.args, workers=3, queue_size=2))
+        self.assertEqual(sorted(results), list(range(12)))
+        bubbler = CannyPipeline.from_array(self.frames[4])
+        _, expected = bubble_properties_calculate(bubbler.run(*self.args),
+                                                  engine='opencv')
+        np.testing.assert_array_equal(results[4]["area"], expected["area"])
+
+    def test_stream_video(self):
+        """test the frames of a video file are all processed"""
+        video_file = os.path.join(self.tempdir, "bubbles.avi")
+        writer = cv.VideoWriter(video_file, cv.VideoWriter_fourcc(*'MJPG'),
+                                10, (160, 120))
+        if not writer.isOpened():
+            self.skipTest("no video codec available")
+        for frame in self.frames:
+            writer.write(frame)
+        writer.release()
+        results = list(stream_bubble_properties(video_file, CannyPipeline,
+                                                self.args, workers=2))
+        self.assertEqual(sorted(index for index, _ in results),
+                         list(range(12)))
+
+    def test_early_close(self):
+        """test the stream can be stopped before all frames are done"""
+        threads = threading.active_count()
+        source = _ReadCounter(os.path.join(self.tempdir,
+                                           "frame_{}.png".format(index))
+                              for index in range(len(self.frames)))
+        stream = stream_bubble_properties(source, CannyPipeline, self.args,
+                                          workers=2, queue_size=1)
+        next(stream)
+        stream.close()
+        # the decoding and processing threads have stopped, before the
+        # decoding reached the last frames
+        self.assertEqual(threading.active_count(), threads)
+        self.assertLess(source.taken, len(self.frames))
+
+    def test_missing_video(self):
+        """test a video that cannot be opened raises"""
+        with self.assertRaises(IOError):
+            list(stream_bubble_properties(os.path.join(self.tempdir,
+                                                       "none.avi"),
+                                          CannyPipeline, self.args))
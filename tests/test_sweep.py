@@ -0,0 +1,55 @@
+import os
+import unittest
+
+import pandas as pd
+
+from bubblekicker.bubblekicker import bubble_properties_calculate
+from bubblekicker.pipelines import CannyPipeline
+from bubblekicker.sweep import parameter_combinations, parameter_sweep
+
+SAMPLE_IMAGE = os.path.join(os.path.dirname(__file__), '..', 'drafts',
+                            '0325097m_0305.tif')
+
+
+class TestParameterSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.grid = {'threshold': [[30, 80], [120, 180]],
+                     'dilate_footprint': [3, 5],
+                     'border_buffer_size': [3],
+                     'border_bgval': [1],
+                     'erode_footprint': [1, 3]}
+
+    def test_combination_order(self):
+        """test the combinations follow the pipeline argument order"""
+        combinations = parameter_combinations(CannyPipeline, self.grid)
+        self.assertEqual(len(combinations), 8)
+        self.assertEqual(list(combinations[0].keys()),
+                         ['threshold', 'dilate_footprint',
+                          'border_buffer_size', 'border_bgval',
+                          'erode_footprint'])
+        self.assertEqual([params['erode_footprint']
+                          for params in combinations[:2]], [1, 3])
+
+    def test_incomplete_grid(self):
+        """test a grid without all pipeline arguments raises"""
+        del self.grid['erode_footprint']
+        with self.assertRaises(ValueError):
+            parameter_combinations(CannyPipeline, self.grid)
+
+    def test_sweep_results(self):
+        """test the sweep against a direct run and the parallel version"""
+        serial = parameter_sweep(SAMPLE_IMAGE, CannyPipeline, self.grid,
+                                 workers=1)
+        parallel = parameter_sweep(SAMPLE_IMAGE, CannyPipeline, self.grid,
+                                   workers=2)
+        pd.testing.assert_frame_equal(serial, parallel)
+
+        bubbler = CannyPipeline(SAMPLE_IMAGE)
+        _, props = bubble_properties_calculate(
+            bubbler.run([120, 180], 5, 3, 1, 3))
+        row = serial[(serial["threshold"] == (120, 180)) &
+                     (serial["dilate_footprint"] == 5) &
+                     (serial["erode_footprint"] == 3)].iloc[0]
+        self.assertEqual(row["n_bubbles"], len(props))
+        self.assertAlmostEqual(row["area_mean"], props["area"].mean())
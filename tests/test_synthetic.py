@@ -0,0 +1,51 @@
+import unittest
+
+import numpy as np
+
+from bubblekicker.bubblekicker import bubble_properties_calculate
+from bubblekicker.pipelines import CannyPipeline
+from bubblekicker.synthetic import (synthetic_bubble_image, ks_statistic,
+                                    compare_distributions)
+
+
+class TestSyntheticImages(unittest.TestCase):
+
+    def test_ground_truth(self):
+        """test the bubbles are placed within the image without touching"""
+        image, truth = synthetic_bubble_image((200, 300), 30,
+                                              diameter_range=(10, 20),
+                                              seed=1)
+        self.assertEqual(image.shape, (200, 300, 3))
+        self.assertEqual(len(truth), 30)
+        self.assertTrue(truth["diameter"].between(10, 20).all())
+        self.assertTrue((truth["row"] >= truth["diameter"] / 2).all())
+        distances = np.hypot(truth["row"].values[:, None] -
+                             truth["row"].values[None, :],
+                             truth["col"].values[:, None] -
+                             truth["col"].values[None, :])
+        gaps = distances - (truth["diameter"].values[:, None] +
+                            truth["diameter"].values[None, :]) / 2.
+        self.assertGreaterEqual(gaps[~np.eye(30, dtype=bool)].min(), 2.)
+
+    def test_seed(self):
+        """test the same seed gives the same image"""
+        first, _ = synthetic_bubble_image((100, 100), 5, seed=3)
+        second, _ = synthetic_bubble_image((100, 100), 5, seed=3)
+        np.testing.assert_array_equal(first, second)
+
+    def test_ks_statistic(self):
+        """test the Kolmogorov-Smirnov statistic of known samples"""
+        self.assertEqual(ks_statistic([1, 2, 3], [1, 2, 3]), 0.)
+        self.assertEqual(ks_statistic([1, 2], [3, 4]), 1.)
+        self.assertAlmostEqual(ks_statistic([1, 2, 3, 4], [3, 4, 5, 6]), 0.5)
+
+    def test_canny_accuracy(self):
+        """test the Canny pipeline recovers the synthetic bubble sizes"""
+        image, truth = synthetic_bubble_image((600, 800), 60, seed=1)
+        bubbler = CannyPipeline.from_array(image)
+        _, property_table = bubble_properties_calculate(
+            bubbler.run([120, 180], 3, 3, 1, 1), engine='opencv')
+        comparison = compare_distributions(property_table, truth)
+        self.assertGreaterEqual(comparison["detected"], 55)
+        self.assertLess(comparison["ks"], 0.25)
+        self.assertLess(abs(comparison["median_error"]), 0.2)
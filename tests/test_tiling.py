@@ -0,0 +1,75 @@
+import os
+import unittest
+
+import numpy as np
+
+from bubblekicker.pipelines import CannyPipeline, AdaptiveThresholdPipeline
+from bubblekicker.tiling import (image_tiles, split_steps, steps_halo,
+                                 tiled_apply_steps, tiled_run)
+
+SAMPLE_IMAGE = os.path.join(os.path.dirname(__file__), '..', 'drafts',
+                            '0325097m_0305.tif')
+
+
+class TestTiling(unittest.TestCase):
+
+    def test_tiles_cover_image(self):
+        """test the tile cores cover each pixel exactly once"""
+        coverage = np.zeros((70, 95), np.int32)
+        for core, padded, inner in image_tiles(coverage.shape, 32, 5):
+            coverage[core] += 1
+            padded_tile = np.arange(coverage.size).reshape(
+                coverage.shape)[padded]
+            np.testing.assert_array_equal(
+                padded_tile[inner],
+                np.arange(coverage.size).reshape(coverage.shape)[core])
+        self.assertTrue((coverage == 1).all())
+
+    def test_empty_image(self):
+        """test an empty image is rejected"""
+        bubbler = CannyPipeline.from_array(np.zeros((0, 40), np.uint8))
+        self.assertRaises(ValueError, tiled_apply_steps, bubbler,
+                          AdaptiveThresholdPipeline.steps(91, 18, 3, 1, 1, 3),
+                          workers=1)
+
+    def test_split_steps(self):
+        """test the grouping of local and global steps"""
+        segments = split_steps(AdaptiveThresholdPipeline.steps(91, 18, 3, 3,
+                                                               1, 5))
+        self.assertEqual([(local, len(steps)) for local, steps in segments],
+                         [(True, 2), (False, 1), (False, 1), (True, 1)])
+        self.assertEqual(steps_halo(segments[0][1]), 45 + 1)
+
+    def test_adaptive_threshold_identical(self):
+        """test the tiled adaptive threshold pipeline against the whole
+        image processing"""
+        args = (91, 18, 3, 1, 1, 3)
+        expected = AdaptiveThresholdPipeline(SAMPLE_IMAGE).run(*args)
+        result = tiled_run(AdaptiveThresholdPipeline, SAMPLE_IMAGE, args,
+                           tile_size=(150, 200), workers=2)
+        np.testing.assert_array_equal(result, expected)
+        result = tiled_run(AdaptiveThresholdPipeline, SAMPLE_IMAGE, args,
+                           tile_size=(150, 200), workers=3, backend='thread')
+        np.testing.assert_array_equal(result, expected)
+
+    def test_step_records(self):
+        """test a record is added for every step, also the tiled ones"""
+        bubbler = AdaptiveThresholdPipeline(SAMPLE_IMAGE)
+        steps = AdaptiveThresholdPipeline.steps(91, 18, 3, 1, 1, 3)
+        tiled_apply_steps(bubbler, steps, tile_size=(150, 200), workers=2)
+        records = bubbler.logs.records
+        self.assertEqual([record["step"] for record in records],
+                         [name for name, _ in steps])
+        self.assertEqual([record["message"] for record in records],
+                         bubbler.logs.log)
+        self.assertTrue(all(record["wall_time"] >= 0 and
+                            record["shape"] == bubbler.current_image.shape
+                            for record in records))
+
+    def test_canny_tolerance(self):
+        """test the tiled Canny pipeline within the documented tolerance"""
+        args = ([10, 40], 3, 3, 1, 1)
+        expected = CannyPipeline(SAMPLE_IMAGE).run(*args)
+        result = tiled_run(CannyPipeline, SAMPLE_IMAGE, args,
+                           tile_size=100, workers=1)
+        self.assertLess((result != expected).mean(), 0.01)
@@ -0,0 +1,99 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+import cv2 as cv
+
+from bubblekicker.bubblekicker import bubble_properties_calculate
+from bubblekicker.tracking import (BubbleTracker, match_bubbles,
+                                   track_bubbles)
+
+
+def _property_table(centroids, diameters):
+    """property table with the centroid and diameter of each bubble"""
+    return pd.DataFrame({"centroid": [tuple(centroid)
+                                      for centroid in centroids],
+                         "equivalent_diameter": diameters},
+                        index=pd.Index(np.arange(1, len(diameters) + 1),
+                                       name="label"))
+
+
+class TestTracking(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        # bubbles on a grid rising with a size dependent velocity
+        rows, cols = np.mgrid[0:40, 0:50]
+        self.start = np.c_[rows.ravel() * 25. + 500, cols.ravel() * 25.]
+        self.diameters = random.uniform(5, 15, len(self.start))
+        self.velocity = np.c_[-0.5 * self.diameters,
+                              random.normal(0, 1, len(self.start))]
+        self.order = [random.permutation(len(self.start)) for _ in range(6)]
+
+    def _frames(self, missing=()):
+        for frame, order in enumerate(self.order):
+            keep = np.array([index not in missing or frame != 3
+                             for index in order])
+            order = order[keep]
+            yield frame, _property_table(
+                self.start[order] + frame * self.velocity[order],
+                self.diameters[order])
+
+    def test_match_bubbles(self):
+        """test the one-to-one matching with distance and size gating"""
+        predicted = np.array([[0., 0.], [0., 3.], [50., 50.]])
+        centroids = np.array([[0., 2.], [0., 1.], [51., 50.]])
+        sources, targets = match_bubbles(
+            predicted, np.array([10., 10., 10.]), centroids,
+            np.array([10., 10., 30.]), max_distance=5.)
+        self.assertEqual(sorted(zip(sources, targets)), [(0, 1), (1, 0)])
+
+    def test_tracks(self):
+        """test 2000 bubbles per frame are linked into complete tracks"""
+        tracks, statistics = track_bubbles(self._frames(), max_distance=10.,
+                                           frame_interval=0.5)
+        self.assertEqual(tracks["track"].nunique(), len(self.start))
+        self.assertTrue((statistics["length"] == len(self.order)).all())
+        # each track follows a single bubble
+        first = tracks[tracks["frame"] == 0].set_index("track")
+        last = tracks[tracks["frame"] == 5].set_index("track")
+        np.testing.assert_allclose(last["equivalent_diameter"],
+                                   first.loc[last.index,
+                                             "equivalent_diameter"])
+        velocity_row = statistics["velocity_row"].values
+        expected = -0.5 * first.loc[statistics.index,
+                                    "equivalent_diameter"].values / 0.5
+        np.testing.assert_allclose(velocity_row, expected)
+        self.assertTrue(np.isnan(tracks[tracks["frame"] == 0]["speed"]).all())
+
+    def test_memory(self):
+        """test bubbles missing in a frame keep their track with memory"""
+        missing = set(range(0, 2000, 10))
+        tracks, _ = track_bubbles(self._frames(missing), max_distance=10.)
+        self.assertEqual(tracks["track"].nunique(),
+                         len(self.start) + len(missing))
+        tracks, statistics = track_bubbles(self._frames(missing),
+                                           max_distance=10., memory=1)
+        self.assertEqual(tracks["track"].nunique(), len(self.start))
+        self.assertEqual((statistics["length"] == 5).sum(), len(missing))
+
+    def test_frame_order(self):
+        tracker = BubbleTracker()
+        frames = list(self._frames())
+        tracker.update(*frames[1])
+        self.assertRaises(ValueError, tracker.update, *frames[0])
+
+    def test_binary_images(self):
+        """test tracking the property tables of detected bubbles"""
+        frames = []
+        for frame in range(4):
+            binary = np.ones((200, 200), np.uint8)
+            cv.circle(binary, (50, 150 - 20 * frame), 10, 0, -1)
+            cv.circle(binary, (140, 160 - 30 * frame), 15, 0, -1)
+            _, property_table = bubble_properties_calculate(
+                binary, rules={}, engine='opencv')
+            frames.append((frame, property_table))
+        tracks, statistics = track_bubbles(frames, max_distance=40.)
+        self.assertEqual(len(statistics), 2)
+        np.testing.assert_allclose(
+            sorted(statistics["velocity_row"]), [-30., -20.], atol=0.5)
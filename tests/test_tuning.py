@@ -0,0 +1,71 @@
+import unittest
+
+from bubblekicker.pipelines import AdaptiveThresholdPipeline
+from bubblekicker.synthetic import synthetic_bubble_image
+from bubblekicker.tuning import tune_parameters
+
+
+class TestTuning(unittest.TestCase):
+
+    def setUp(self):
+        self.references = [synthetic_bubble_image((600, 800), 60,
+                                                  (20., 60.), seed=seed)
+                           for seed in range(2)]
+        self.grid = {'blocksize': [11, 31, 61], 'cvalue': [2, 10, 18],
+                     'dilate_footprint': [1, 3], 'border_buffer_size': [3],
+                     'border_bgval': [1], 'erode_footprint': [1, 3]}
+
+    def test_successive_halving(self):
+        """test the search finds a candidate among the best of the
+        exhaustive search with fewer full resolution evaluations"""
+        best, history = tune_parameters(self.references,
+                                        AdaptiveThresholdPipeline,
+                                        self.grid, levels=(2, 1, 0), eta=3)
+        _, full_history = tune_parameters(self.references,
+                                          AdaptiveThresholdPipeline,
+                                          self.grid, levels=(0,))
+        score = history[history["level"] == 0]["score"].min()
+        self.assertLess((full_history["score"] < score).sum(), 36 // 4)
+
+        self.assertEqual(list(history["rung"].unique()), [0, 1, 2])
+        self.assertEqual(len(history[history["rung"] == 0]), 36)
+        self.assertEqual(history.groupby("rung")["kept"].sum().tolist(),
+                         [12, 4, 1])
+        full_resolution = history[history["level"] == 0]["images"].sum()
+        self.assertLess(full_resolution, full_history["images"].sum())
+        self.assertLess(full_resolution, 36 * len(self.references) / 4)
+        self.assertEqual(len(best), 6)
+
+    def test_early_stopping(self):
+        """test poor candidates are not scored on all references"""
+        _, history = tune_parameters(self.references,
+                                     AdaptiveThresholdPipeline, self.grid,
+                                     levels=(1,))
+        stopped = history[history["stopped_early"]]
+        self.assertTrue(len(stopped) > 0)
+        self.assertTrue((stopped["images"] < len(self.references)).all())
+        self.assertEqual(history["kept"].sum(), 1)
+        self.assertFalse(history[history["kept"]]["stopped_early"].any())
+
+    def test_invalid_eta(self):
+        self.assertRaises(ValueError, tune_parameters, self.references,
+                          AdaptiveThresholdPipeline, self.grid, eta=1)
+
+    def test_invalid_candidates(self):
+        """test candidates that can not be run are never selected, while
+        invalid settings of the search raise"""
+        grid = dict(self.grid, blocksize=[12, 31], cvalue=[10],
+                    dilate_footprint=[3], erode_footprint=[3])
+        best, history = tune_parameters(self.references,
+                                        AdaptiveThresholdPipeline, grid,
+                                        levels=(1, 0), eta=2)
+        self.assertEqual(best["blocksize"], 31)
+        self.assertRaises(ValueError, tune_parameters, self.references,
+                          AdaptiveThresholdPipeline,
+                          dict(grid, blocksize=[12]), levels=(0,))
+        self.assertRaises(ValueError, tune_parameters, self.references,
+                          AdaptiveThresholdPipeline, grid, levels=(1,),
+                          which_property="colour")
+        self.assertRaises(Exception, tune_parameters, self.references,
+                          AdaptiveThresholdPipeline, grid, levels=(1,),
+                          rules={"area": {"above": 1}})
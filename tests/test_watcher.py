@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+import cv2 as cv
+
+from bubblekicker.bubblekicker import bubble_properties_calculate
+from bubblekicker.pipelines import CannyPipeline
+from bubblekicker.watcher import watch_folder
+
+
+def _write_bubble_image(filename, centers, radius=12):
+    """write a dark image with bright bubbles, moved into place at once"""
+    image = np.zeros((120, 160, 3), np.uint8)
+    for center in centers:
+        cv.circle(image, center, radius, (200, 200, 200), -1)
+    staging = os.path.dirname(filename) + "_staging.png"
+    cv.imwrite(staging, image)
+    os.rename(staging, filename)
+
+
+class TestWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.args = ([120, 180], 3, 3, 1, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _expected(self, path):
+        result = CannyPipeline(path, channel='red').run(*self.args)
+        return bubble_properties_calculate(result, engine='opencv')[1]
+
+    def test_new_files(self):
+        """test only the images written after the start are processed"""
+        _write_bubble_image(os.path.join(self.folder, "old.png"),
+                            [(40, 40)])
+        watcher = watch_folder(self.folder, CannyPipeline, self.args,
+                               pattern="img_*.png", poll_interval=0.05,
+                               workers=2)
+
+        def drop_images():
+            time.sleep(0.3)
+            for index in range(3):
+                _write_bubble_image(
+                    os.path.join(self.folder, "img_{}.png".format(index)),
+                    [(40, 40), (100, 40 + 10 * index)])
+
+        writer = threading.Thread(target=drop_images)
+        writer.start()
+        results = {}
+        for path, property_table, timing in watcher:
+            results[os.path.basename(path)] = property_table
+            self.assertGreaterEqual(timing['latency'],
+                                    timing['processing_time'])
+            self.assertGreaterEqual(timing['queue_time'], 0.)
+            if len(results) == 3:
+                break
+        watcher.close()
+        writer.join()
+
+        self.assertEqual(sorted(results),
+                         ["img_0.png", "img_1.png", "img_2.png"])
+        for name, property_table in results.items():
+            expected = self._expected(os.path.join(self.folder, name))
+            np.testing.assert_allclose(property_table["area"],
+                                       expected["area"])
+
+    def test_backpressure(self):
+        """test all existing images are delivered with single slots"""
+        for index in range(6):
+            _write_bubble_image(
+                os.path.join(self.folder, "img_{}.png".format(index)),
+                [(40, 40)])
+        stop = threading.Event()
+        names = []
+        for path, property_table, timing in watch_folder(
+                self.folder, CannyPipeline, self.args, existing=True,
+                settle_polls=0, poll_interval=0.05, queue_size=1, workers=1,
+                backend='thread', stop=stop):
+            names.append(os.path.basename(path))
+            time.sleep(0.05)
+            if len(names) == 6:
+                stop.set()
+        self.assertEqual(sorted(names),
+                         ["img_{}.png".format(index) for index in range(6)])
+
+    def test_failure(self):
+        """test an unreadable image is reported and the watcher goes on"""
+        watcher = watch_folder(self.folder, CannyPipeline, self.args,
+                               poll_interval=0.05, existing=True, workers=1)
+        with open(os.path.join(self.folder, "notes.txt"), "w") as txt:
+            txt.write("not an image")
+        path, property_table, _ = next(watcher)
+        watcher.close()
+        self.assertEqual(property_table.filename, "notes.txt")